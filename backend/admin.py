@@ -1,11 +1,29 @@
 from django.contrib import admin
-from backend.models import Company, Order, QuestionTemplate, Analytics
+from backend.models import (
+    Company,
+    Customer,
+    Order,
+    QuestionTemplate,
+    Analytics,
+    AnalyticsAggregate,
+    ArchivedConversation,
+    InboundMessage,
+)
 
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
     list_display = ('name', 'phone_number')
     search_fields = ('name', 'phone_number')
+    filter_horizontal = ('users',)
+
+
+@admin.register(Customer)
+class CustomerAdmin(admin.ModelAdmin):
+    list_display = ('phone_number', 'company', 'open_order')
+    list_filter = ('company',)
+    search_fields = ('phone_number',)
+    raw_id_fields = ('open_order',)
 
 
 @admin.register(Order)
@@ -14,6 +32,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ('company', 'order_at')
     search_fields = ('number', 'customer_name', 'customer_phone_number')
     ordering = ('-order_at',)
+    raw_id_fields = ('customer',)
 
 
 @admin.register(QuestionTemplate)
@@ -27,3 +46,26 @@ class AnalyticsAdmin(admin.ModelAdmin):
     list_display = ('order', 'created_at')
     search_fields = ('order__number',)
     ordering = ('-created_at',)
+
+
+@admin.register(ArchivedConversation)
+class ArchivedConversationAdmin(admin.ModelAdmin):
+    list_display = ('order', 'created_at')
+    search_fields = ('order__number',)
+    ordering = ('-created_at',)
+
+
+@admin.register(InboundMessage)
+class InboundMessageAdmin(admin.ModelAdmin):
+    list_display = ('sender_phone_number', 'company', 'message_type', 'received_at', 'processed_at')
+    list_filter = ('company', 'message_type')
+    search_fields = ('sender_phone_number',)
+    ordering = ('-created_at',)
+
+
+@admin.register(AnalyticsAggregate)
+class AnalyticsAggregateAdmin(admin.ModelAdmin):
+    list_display = ('company', 'date', 'branch_name', 'metric', 'key', 'value')
+    list_filter = ('company', 'metric')
+    search_fields = ('key', 'branch_name')
+    ordering = ('-date',)
@@ -1,31 +1,20 @@
-import base64
-import contextlib
 import io
-import os
 import re
 import json
-import warnings
 import sys
 import pandas as pd
 
 from PIL import Image
-from groq import Groq
-from sqlalchemy import create_engine
-from e2b_code_interpreter import Sandbox
 
-from django.conf import settings
+from backend.llm import chat_completion
+from backend.db_router import analytics_db
+from backend.profiling import format_profile, profile_dataframe
+from backend.sandbox import get_sandbox_pool
+from backend.sql_execution import database_url, execute_scoped_query, execute_scoped_result
 
 
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-
-DATABASE_CONNECTION = {
-    "host": settings.DATABASES["default"]["HOST"],
-    "database": settings.DATABASES["default"]["NAME"],
-    "user": settings.DATABASES["default"]["USER"],
-    "password": settings.DATABASES["default"]["PASSWORD"],
-    "port": settings.DATABASES["default"]["PORT"],
-}
-
+# Uploaded to every visualization sandbox
+DATA_FILE = "data.csv"
 
 SCHEMA_DESCRIPTION = """
 This postgres database Schema is as follows:
@@ -34,9 +23,8 @@ Model: backend_company
 - id: Primary key of Company model.
 - name: Company name.
 - phone_number: Company phone number.
-- api_token: Company API token.
-- instance_id: Company instance id.
-- webhook_token: Company webhook token.
+- created_at: Company creation date and time.
+- updated_at: Company update date and time.
 
 Model: backend_order
 - id: Primary key of Order model.
@@ -56,8 +44,9 @@ Model: backend_questiontemplate
 - order_id: Foreign key to Order model.
 - question: Question text.
 - priority: Question priority.
-- answer: Answer text.
+- answer: Answer text (typed, or transcribed from a voice note).
 - audio: Link to audio file.
+- search_vector: Full-text search index (tsvector, english) of answer. To find answers mentioning words or phrases, filter with search_vector @@ websearch_to_tsquery('english', '<words>') and order by ts_rank(search_vector, websearch_to_tsquery('english', '<words>')) DESC; never use LIKE or ILIKE on answer.
 - created_at: Question creation date and time.
 - updated_at: Question update date and time.
 
@@ -76,12 +65,10 @@ class SQLGeneratorAgent:
     def __init__(self):
 
         self.schema = SCHEMA_DESCRIPTION
-        self.connection_url = self.build_sqlalchemy_url()
-        self.llm = Groq(api_key=GROQ_API_KEY)
-        self.model = "compound-beta-mini"
 
         self.iter = 2
         self.sql_query = None
+        self.result_metadata = {}
         self.evaluation_status = {
             "evaluation": "REJECT",
             "reasoning": "",
@@ -89,15 +76,6 @@ class SQLGeneratorAgent:
             "revised_query": None,
         }
     
-    def build_sqlalchemy_url(self) -> str:
-        return (
-            f"postgresql+psycopg2://{os.environ.get('POSTGRES_USER')}:"
-            f"{os.environ.get('POSTGRES_PASSWORD')}@"
-            f"{os.environ.get('POSTGRES_HOST')}:"
-            f"{os.environ.get('POSTGRES_PORT')}/"
-            f"{os.environ.get('POSTGRES_DB')}"
-        )
-
     def clean_query(self, query: str) -> str:
         # Remove any leading or trailing whitespace
         query = query.strip()
@@ -143,23 +121,24 @@ class SQLGeneratorAgent:
             - Don't include thinking process or any help text.
             - Do not include comments, explanations, or any extra text.
             - Output only the SQL in a single line (no line breaks or formatting).
+            - To search the text of answers, use the search_vector full-text index as described in the schema.
+            - Don't use double-quoted identifiers, E'' strings, dollar quoting or comments, and only call common aggregate, window, math, text, date, JSON and full-text search functions; other queries are rejected.
             - If the query is unrelated to the schema, return: "The query is outside my scope".
             - If the query is unclear, return: "I don't understand the query".
             - If the topic is not SQL-related, return: "I am not able to help you with that".
         """
-        response = self.llm.chat.completions.create(
-            model=self.model,
-            temperature=0.1,
-            messages=[
+        content = chat_completion(
+            "sql_generate",
+            [
                 {
                     "role": "system",
                     "content": "You are an expert query generator for Postgres Database. You provide with SQL queries based on the user query.",
                 },
                 {"role": "user", "content": prompt},
             ],
+            temperature=0.1,
         )
 
-        content = response.choices[0].message.content
         query = self.clean_query(content)
 
         if not query.endswith(";"):
@@ -192,18 +171,17 @@ class SQLGeneratorAgent:
             "revised_query": "Rewritten SQL query, or null if not applicable."
             }}
         """
-        response = self.llm.chat.completions.create(
-            model=self.model,
-            temperature=0.1,
-            messages=[
+        response = chat_completion(
+            "sql_evaluate",
+            [
                 {
                     "role": "system",
                     "content": "You are an expert SQL evaluator using ReAct framework. Given the user query and the generated SQL query, evaluate the SQL query based on the schema provided.",
                 },
                 {"role": "user", "content": prompt},
             ],
+            temperature=0.1,
         )
-        response = response.choices[0].message.content
         match = re.search(r"{.*}", response, re.DOTALL)
         if match:
             try:
@@ -235,45 +213,58 @@ class SQLGeneratorAgent:
 
                 self.generate_sql_query(feedback_prompt)
 
-    def execute_sql_query(
-        self,
-    ) -> dict:
-        engine = create_engine(self.connection_url)
-
+    def execute_sql_query(self, company_id: int, offset: int = 0) -> pd.DataFrame:
         try:
-            return pd.read_sql(self.sql_query, engine)
+            pd_df, self.result_metadata = execute_scoped_query(
+                database_url(analytics_db()), self.sql_query, company_id, offset=offset
+            )
+            return pd_df
         except Exception as e:
             print(f"Error executing SQL query: {e}")
             raise e
     
 
-    def interpret_code(self, e2b_code_interpreter: Sandbox, code: str):
-        stdout_capture = io.StringIO()
-        stderr_capture = io.StringIO()
+    def execute_sql_result(self, company_id: int):
+        """
+        Fetch the first page and the whole result (up to NL_QUERY_MAX_ROWS
+        rows) with one query; returns (page, result) DataFrames
+        """
 
-        with contextlib.redirect_stdout(stdout_capture), contextlib.redirect_stderr(stderr_capture):
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                exec = e2b_code_interpreter.run_code(code)
+        try:
+            page_df, self.result_metadata, result_df = execute_scoped_result(
+                database_url(analytics_db()), self.sql_query, company_id
+            )
+            return page_df, result_df
+        except Exception as e:
+            print(f"Error executing SQL query: {e}")
+            raise e
 
-        if stderr_capture.getvalue():
+    def interpret_code(self, sandbox, code: str):
+        code_run = sandbox.run_code(code)
+
+        if code_run.stderr:
             print("[Code Interpreter Warnings/Errors]", file=sys.stderr)
-            print(stderr_capture.getvalue(), file=sys.stderr)
+            print(code_run.stderr, file=sys.stderr)
 
-        if stdout_capture.getvalue():
+        if code_run.stdout:
             print("[Code Interpreter Output]", file=sys.stdout)
-            print(stdout_capture.getvalue(), file=sys.stdout)
+            print(code_run.stdout, file=sys.stdout)
 
-        if exec.error:
-            print(f"[Code Interpreter ERROR] {exec.error}", file=sys.stderr)
+        if code_run.error:
+            print(f"[Code Interpreter ERROR] {code_run.error}", file=sys.stderr)
             return None
-        return exec.results
-
-    def generate_appropriate_visualization(self, pd_df: pd.DataFrame, user_query: str):
-        head_str = pd_df.head(5).to_string()
-        columns_str = ', '.join(pd_df.columns)
-        dtypes_str = pd_df.dtypes.to_string()
-        describe_str = pd_df.describe(include='all').to_string()
+        return code_run.pngs
+
+    def generate_appropriate_visualization(self, pd_df: pd.DataFrame, user_query: str, company_id: int):
+        # Summaries of the rows already fetched, so the prompt doesn't grow
+        # with the result and the query doesn't run again
+        profile = profile_dataframe(pd_df, capped=self.result_metadata.get("result_capped", False))
+        profile_str = format_profile(profile, pd_df)
+        if self.result_metadata.get("result_capped"):
+            profile_str += (
+                f"\n\nNOTE: The data holds only the first {len(pd_df)} rows of a larger result; "
+                "say so in the chart title."
+            )
 
         user_prompt = f"""
             You are a Python data scientist and data visualization expert. 
@@ -288,17 +279,8 @@ class SQLGeneratorAgent:
             USER QUERY:
             {user_query}
             
-            HEAD:
-            {head_str}
-
-            COLUMNS:
-            {columns_str}
-
-            DTYPES:
-            {dtypes_str}
-
-            DESCRIBE:
-            {describe_str}
+            DATA PROFILE:
+            {profile_str}
 
             # Instructions:
             - Understand the structure and semantics of the data.
@@ -308,50 +290,40 @@ class SQLGeneratorAgent:
             - If required, update dataframe to appropriate visualization.
             - Ensure the code is executable and does not require any additional context.
             - Do not include explanations or markdown. Just output the raw code.
-            - Use the provided CSV file path to read the data.
+            - Use the provided CSV file path to read the data: {DATA_FILE}
             - Use ReAct thinking: pause and revise your code before finalizing.
             - Make sure the code is compatible to dataframe always.
         """
 
-        response = self.llm.chat.completions.create(
-            model=self.model,
-            temperature=0.1,
-            messages=[
+        response = chat_completion(
+            "visualization",
+            [
                 {"role": "system", "content": "You are a Python data scientist and data visualization expert."},
                 {"role": "user", "content": user_prompt},
             ],
+            temperature=0.1,
         )
-        response = response.choices[0].message.content
 
         print("response", response)
         code = self.filter_code(response)
 
-        with Sandbox(api_key=settings.E2B_API_KEY) as code_interpreter:
-            code_results = self.interpret_code(code_interpreter, code)
-            if code_results:
-                for result in code_results:
-                    if hasattr(result, 'png') and result.png:
-                        png_data = base64.b64decode(result.png)
-                        image = Image.open(io.BytesIO(png_data))
-                        return image
-                    elif hasattr(result, 'figure'):
-                        return result.figure
-                    elif hasattr(result, 'show'):
-                        return result
+        with get_sandbox_pool().sandbox() as sandbox:
+            # Relative to the working directory of the sandbox's code
+            sandbox.write_file(DATA_FILE, pd_df.to_csv(index=False).encode())
+            pngs = self.interpret_code(sandbox, code)
+        if pngs:
+            return Image.open(io.BytesIO(pngs[0]))
     
-    def convert_image_to_base64(self, image):
+    def convert_image_to_png(self, image):
         if image is None:
             return None
             
         buffer = io.BytesIO()
         
         image.save(buffer, format='PNG')
-        buffer.seek(0)        
-        img_str = base64.b64encode(buffer.read()).decode('utf-8')
-        
-        return f"data:image/png;base64,{img_str}"
+        return buffer.getvalue()
 
-    def run_pipeline(self, user_query: str) -> dict:
+    def run_pipeline(self, user_query: str, company_id: int) -> dict:
         # Step 1: Generate SQL query
         self.generate_sql_query(user_query)
 
@@ -359,14 +331,15 @@ class SQLGeneratorAgent:
         self.validate_evaluation_status()
 
         print("SQL Query:", self.sql_query)
-        # Step 3: Execute query
-        pandas_data_frame = self.execute_sql_query()
+        # Step 3: Execute query; the chart is drawn from the whole result,
+        # not just the first page returned to the client
+        pandas_data_frame, result_data_frame = self.execute_sql_result(company_id)
 
         # Step 4: Create appropriate visualization
-        image = self.generate_appropriate_visualization(pandas_data_frame, user_query)
+        image = self.generate_appropriate_visualization(result_data_frame, user_query, company_id)
 
-        # Step 5: Convert image to base64
-        image_base64 = self.convert_image_to_base64(image)
+        # Step 5: Convert image to PNG bytes
+        image_png = self.convert_image_to_png(image)
 
 
-        return pandas_data_frame, image_base64
+        return pandas_data_frame, image_png
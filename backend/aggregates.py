@@ -0,0 +1,356 @@
+import hashlib
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DateField, Exists, Max, OuterRef, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from backend.constants import WRAP_UP_PRIORITY
+from backend.models import (
+    Analytics,
+    AnalyticsAggregate,
+    ArchivedConversation,
+    Order,
+    QuestionTemplate,
+)
+
+
+AGGREGATES_PREFIX = "analytics"
+CURSOR_SALT = "backend.analytics.cursor"
+
+GRANULARITIES = ("day", "week", "month")
+RESPONSE_KEYS = ("invited", "responded", "completed", "abandoned")
+
+# Weight of each sentiment label in a branch score (-1 to 1)
+SENTIMENT_SCORES = {
+    "positive": 1.0,
+    "pos_neutral": 0.5,
+    "neutral": 0.0,
+    "mixed": 0.0,
+    "neg_neutral": -0.5,
+    "negative": -1.0,
+}
+
+ANSWERED = (Q(answer__isnull=False) & ~Q(answer="")) | (Q(audio__isnull=False) & ~Q(audio=""))
+
+
+def version_key(company_id):
+    return f"{AGGREGATES_PREFIX}:version:{company_id}"
+
+
+def changed_days(since=None):
+    """
+    Return {company_id: {order dates}} whose orders, conversations or
+    analyses changed after `since` (every day when `since` is None)
+    """
+
+    orders = Order.objects.all()
+    questions = QuestionTemplate.objects.all()
+    analytics = Analytics.objects.all()
+    if since:
+        orders = orders.filter(updated_at__gt=since)
+        questions = questions.filter(updated_at__gt=since)
+        analytics = analytics.filter(updated_at__gt=since)
+
+    days = defaultdict(set)
+    for company_id, day in (
+        orders.annotate(day=TruncDate("order_at")).values_list("company_id", "day").distinct().iterator()
+    ):
+        days[company_id].add(day)
+    for queryset in (questions, analytics):
+        rows = (
+            queryset.annotate(day=TruncDate("order__order_at"))
+            .values_list("order__company_id", "day")
+            .distinct()
+        )
+        for company_id, day in rows.iterator():
+            days[company_id].add(day)
+    return days
+
+
+def _archived_responses(orders):
+    """
+    {order_id: (invited, responded, completed)} of the orders whose
+    questions were moved to ArchivedConversation
+    """
+
+    flags = {}
+    archives = ArchivedConversation.objects.filter(order__in=orders).values_list("order_id", "questions")
+    for order_id, questions in archives.iterator():
+        first = [question for question in questions if question["priority"] == 1]
+        flags[order_id] = (
+            bool(first),
+            any(question.get("answer") or question.get("audio") for question in first),
+            any(question["priority"] >= WRAP_UP_PRIORITY for question in questions),
+        )
+    return flags
+
+
+def _term(value):
+    return str(value).strip().lower()[:200]
+
+
+def build_day_aggregates(company_id, days):
+    """
+    Compute the aggregate rows of one company for the given order dates
+    """
+
+    # The order_at range keeps the (company, order_at) index usable
+    orders = Order.objects.filter(
+        company_id=company_id,
+        order_at__gte=timezone.make_aware(datetime.combine(min(days), time.min)),
+        order_at__lt=timezone.make_aware(datetime.combine(max(days) + timedelta(days=1), time.min)),
+        order_at__date__in=days,
+    )
+    counters = defaultdict(Counter)
+
+    analytics = (
+        Analytics.objects.filter(order__in=orders)
+        .annotate(day=TruncDate("order__order_at"))
+        .values_list("day", "order__branch_name", "sentiment_label", "products", "extracted_keywords")
+    )
+    for day, branch_name, sentiment_label, products, keywords in analytics.iterator():
+        branch_name = branch_name or ""
+        counters[(day, branch_name, "sentiment")][sentiment_label] += 1
+        for product in products or []:
+            if _term(product):
+                counters[(day, branch_name, "product")][_term(product)] += 1
+        for keyword in keywords or []:
+            if _term(keyword):
+                counters[(day, branch_name, "keyword")][_term(keyword)] += 1
+
+    # Conversations past CONVERSATION_RETENTION_DAYS are only in the archive
+    archived = _archived_responses(orders)
+    questions = QuestionTemplate.objects.filter(order=OuterRef("pk"))
+    responses = (
+        orders.annotate(
+            day=TruncDate("order_at"),
+            invited=Exists(questions.filter(priority=1)),
+            responded=Exists(questions.filter(ANSWERED, priority=1)),
+            completed=Exists(questions.filter(priority__gte=WRAP_UP_PRIORITY)),
+        )
+        .values_list("id", "day", "branch_name", "invited", "responded", "completed", "review_abandoned_at")
+    )
+    for order_id, day, branch_name, *flags, abandoned_at in responses.iterator():
+        flags = [
+            flag or archived_flag
+            for flag, archived_flag in zip(flags, archived.get(order_id, (False, False, False)))
+        ]
+        counter = counters[(day, branch_name or "", "response")]
+        for key, flag in zip(RESPONSE_KEYS, flags + [abandoned_at]):
+            if flag:
+                counter[key] += 1
+
+    return [
+        AnalyticsAggregate(
+            company_id=company_id,
+            date=day,
+            branch_name=branch_name,
+            metric=metric,
+            key=key,
+            value=value,
+        )
+        for (day, branch_name, metric), counter in counters.items()
+        for key, value in counter.items()
+    ]
+
+
+def refresh_aggregates(since=None):
+    """
+    Rebuild the aggregates of every day that changed after `since`
+
+    Returns the number of company-days rebuilt.
+    """
+
+    rebuilt = 0
+    for company_id, days in changed_days(since).items():
+        days = sorted(days)
+        for start in range(0, len(days), settings.ANALYTICS_REFRESH_BATCH_DAYS):
+            batch = days[start:start + settings.ANALYTICS_REFRESH_BATCH_DAYS]
+            rows = build_day_aggregates(company_id, batch)
+            with transaction.atomic(using="default"):
+                AnalyticsAggregate.objects.filter(company_id=company_id, date__in=batch).delete()
+                AnalyticsAggregate.objects.bulk_create(rows, batch_size=1000)
+            rebuilt += len(batch)
+        cache.set(version_key(company_id), timezone.now(), timeout=None)
+    return rebuilt
+
+
+def aggregates_version(company_id):
+    """
+    When the company's aggregates last changed, or None if there are none
+    """
+
+    version = cache.get(version_key(company_id))
+    if version is None:
+        version = AnalyticsAggregate.objects.filter(company_id=company_id).aggregate(
+            version=Max("updated_at")
+        )["version"]
+        if version:
+            cache.set(version_key(company_id), version, timeout=None)
+    return version
+
+
+def parse_report_params(query_params):
+    """
+    Validate the dashboard query parameters; raises ValueError
+    """
+
+    today = timezone.now().date()
+    try:
+        end = date.fromisoformat(query_params.get("end") or today.isoformat())
+        start = date.fromisoformat(
+            query_params.get("start") or (end - timedelta(days=settings.ANALYTICS_DEFAULT_RANGE_DAYS)).isoformat()
+        )
+    except ValueError:
+        raise ValueError("start and end must be YYYY-MM-DD dates")
+    if start > end:
+        raise ValueError("start must not be after end")
+
+    granularity = query_params.get("granularity") or "day"
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "branch": query_params.get("branch") or None,
+    }
+
+
+def _aggregates(company_id, metric, params):
+    queryset = AnalyticsAggregate.objects.filter(
+        company_id=company_id, metric=metric, date__range=(params["start"], params["end"])
+    )
+    if params["branch"]:
+        queryset = queryset.filter(branch_name=params["branch"])
+    return queryset
+
+
+def _series(company_id, metric, params):
+    rows = (
+        _aggregates(company_id, metric, params)
+        .annotate(period=Trunc("date", params["granularity"], output_field=DateField()))
+        .values_list("period", "key")
+        .annotate(total=Sum("value"))
+        .order_by("period", "key")
+    )
+    series = {}
+    for period, key, total in rows:
+        series.setdefault(period.isoformat(), {"period": period.isoformat()})[key] = total
+    return list(series.values())
+
+
+def sentiment_over_time(company_id, params):
+    points = _series(company_id, "sentiment", params)
+    for point in points:
+        point["total"] = sum(value for key, value in point.items() if key != "period")
+    return points
+
+
+def response_rates(company_id, params):
+    points = _series(company_id, "response", params)
+    for point in points:
+        for key in RESPONSE_KEYS:
+            point.setdefault(key, 0)
+        invited = point["invited"]
+        point["response_rate"] = round(point["responded"] / invited, 4) if invited else None
+        point["completion_rate"] = round(point["completed"] / invited, 4) if invited else None
+    return points
+
+
+def branch_scores(company_id, params):
+    rows = (
+        _aggregates(company_id, "sentiment", params)
+        .values_list("branch_name", "key")
+        .annotate(total=Sum("value"))
+        .order_by("branch_name")
+    )
+    branches = {}
+    for branch_name, sentiment_label, total in rows:
+        branch = branches.setdefault(branch_name, {"branch": branch_name, "reviews": 0, "sentiment": {}})
+        branch["reviews"] += total
+        branch["sentiment"][sentiment_label] = total
+
+    for branch in branches.values():
+        weighted = sum(
+            SENTIMENT_SCORES.get(label, 0.0) * total for label, total in branch["sentiment"].items()
+        )
+        branch["score"] = round(weighted / branch["reviews"], 4) if branch["reviews"] else None
+    return list(branches.values())
+
+
+def _top_terms(metric):
+    def report(company_id, params):
+        rows = (
+            _aggregates(company_id, metric, params)
+            .values_list("key")
+            .annotate(total=Sum("value"))
+            .order_by("-total", "key")
+        )
+        return [{"name": key, "count": total} for key, total in rows]
+    return report
+
+
+# name: (builder, cursor sort key of a result item)
+REPORTS = {
+    "sentiment": (sentiment_over_time, lambda item: [item["period"]]),
+    "response-rates": (response_rates, lambda item: [item["period"]]),
+    "branches": (branch_scores, lambda item: [item["branch"]]),
+    "products": (_top_terms("product"), lambda item: [-item["count"], item["name"]]),
+    "keywords": (_top_terms("keyword"), lambda item: [-item["count"], item["name"]]),
+}
+
+
+def report_etag(company_id, report, params, cursor, version):
+    raw = f"{company_id}:{report}:{sorted(params.items())}:{cursor}:{version.isoformat()}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def get_report(company_id, report, params, version):
+    """
+    Return every item of a report, cached per (company, report, range,
+    granularity, branch) and aggregates version
+    """
+
+    key = "{}:report:{}:{}:{}:{}:{}:{}:{}".format(
+        AGGREGATES_PREFIX,
+        company_id,
+        report,
+        params["start"],
+        params["end"],
+        params["granularity"],
+        hashlib.sha256((params["branch"] or "").encode()).hexdigest()[:16],
+        version.timestamp() if version else 0,
+    )
+    items = cache.get(key)
+    if items is None:
+        builder, _ = REPORTS[report]
+        items = builder(company_id, params)
+        cache.set(key, items, timeout=settings.ANALYTICS_CACHE_TIMEOUT)
+    return items
+
+
+def paginate(items, report, cursor, page_size):
+    """
+    Return (page, next cursor) of items after the signed `cursor`. The
+    cursor holds the sort key of the last item seen, so pages stay stable
+    when items are added before it.
+    """
+
+    _, sort_key = REPORTS[report]
+    if cursor:
+        last = signing.loads(cursor, salt=CURSOR_SALT)
+        items = [item for item in items if sort_key(item) > last]
+
+    page = items[:page_size]
+    next_cursor = None
+    if len(items) > page_size:
+        next_cursor = signing.dumps(sort_key(page[-1]), salt=CURSOR_SALT)
+    return page, next_cursor
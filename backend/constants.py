@@ -31,3 +31,51 @@ class SentimentScoreChoices(Enum):
             'negative': cls.NEGATIVE.value,
             'neutral': cls.NEUTRAL.value,
         }
+
+
+# Priority of the closing message; it's stored pre-answered ("N/A")
+WRAP_UP_PRIORITY = 4
+
+OPENING_QUESTION = "Hi! We'd love to hear your thoughts — how was your experience at our restaurant?"
+
+# Pre-written replies keyed by (sentiment of the latest answer, turn).
+# Turns 1 and 2 acknowledge and ask one follow-up; the wrap-up is keyed by
+# the overall tone of the conversation.
+FOLLOW_UP_TEMPLATES = {
+    ("positive", 1): [
+        "So glad to hear that! Was there a dish you enjoyed the most?",
+        "That's great to hear! What stood out for you the most?",
+    ],
+    ("positive", 2): [
+        "Love that! Anything at all we could do to make your next visit even better?",
+        "Thanks for sharing! Is there anything you'd like to see on our menu?",
+    ],
+    ("negative", 1): [
+        "Thanks for letting us know. Could you tell us a bit more about what went wrong?",
+        "We appreciate the honesty. Was it the food, the service, or something else?",
+    ],
+    ("negative", 2): [
+        "That's really helpful, thank you. Was the rest of your meal okay?",
+        "Got it, we'll pass this on to the team. Was there anything you did enjoy?",
+    ],
+    ("neutral", 1): [
+        "Thanks for the feedback! Is there anything we could have done better?",
+        "Appreciate it! How did you find the food and the service?",
+    ],
+    ("neutral", 2): [
+        "Thanks! Is there anything you'd change about your order next time?",
+        "Good to know. How was the speed of service?",
+    ],
+}
+
+WRAP_UP_TEMPLATES = {
+    "positive": [
+        "Thanks so much for the kind words! We'd love it if you could leave us a 5-star Google review.",
+    ],
+    "neutral": [
+        "Thanks for taking the time to share your thoughts! If you enjoyed your visit, a Google review would mean a lot to us.",
+    ],
+    "negative": [
+        "Thank you for the honest feedback — we'll work on this. We hope your next visit is better, so here's 15% off your next order.",
+    ],
+}
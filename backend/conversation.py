@@ -0,0 +1,226 @@
+from enum import Enum
+
+from django.db import transaction
+from django.utils import timezone
+
+from backend.constants import (
+    FOLLOW_UP_TEMPLATES,
+    OPENING_QUESTION,
+    WRAP_UP_PRIORITY,
+    WRAP_UP_TEMPLATES,
+)
+from backend.customers import close_conversation, open_conversation
+from backend.helpers import classify_answer_sentiment, overall_sentiment
+from backend.models import Order, QuestionTemplate
+from backend.speculation import take_speculative_reply
+from backend.utils import create_next_question_for_order
+
+
+class ConversationState(Enum):
+    NOT_STARTED = "not_started"
+    AWAITING_ANSWER = "awaiting_answer"
+    REPLY_DUE = "reply_due"
+    COMPLETED = "completed"
+    ABANDONED = "abandoned"
+
+
+class Conversation:
+    """
+    Review conversation for a single order.
+
+    All of the order's questions are loaded with one query and kept in
+    memory; the state is derived from them and every transition works on
+    that list instead of re-querying. Answers and new questions are only
+    written by save(), in one transaction.
+
+    With `speculative=True`, replies pre-generated while the customer was
+    answering are used when no template fits, instead of calling the LLM.
+    """
+
+    def __init__(self, order, questions=None, speculative=False):
+        self.order = order
+        self.speculative = speculative
+        if questions is None:
+            questions = QuestionTemplate.objects.filter(order=order).order_by("priority")
+        self.questions = sorted(questions, key=lambda question: question.priority)
+        # question -> fields changed since the last save()
+        self._changed = {}
+
+    @property
+    def state(self):
+        if self.order.review_abandoned_at:
+            return ConversationState.ABANDONED
+        if not self.questions:
+            return ConversationState.NOT_STARTED
+        if self.questions[-1].priority >= WRAP_UP_PRIORITY:
+            return ConversationState.COMPLETED
+        if self.pending_question is None:
+            return ConversationState.REPLY_DUE
+        return ConversationState.AWAITING_ANSWER
+
+    @property
+    def pending_question(self):
+        for question in self.questions:
+            if not question.is_question_answered:
+                return question
+        return None
+
+    @property
+    def turn(self):
+        return len(self.questions)
+
+    @property
+    def next_priority(self):
+        return self.questions[-1].priority + 1 if self.questions else 1
+
+    @property
+    def awaiting_transcript(self):
+        """
+        The latest answer is a voice note that hasn't been transcribed yet
+        """
+
+        question = self.questions[-1] if self.questions else None
+        return bool(question and question.audio and not question.answer)
+
+    @property
+    def is_wrap_up_turn(self):
+        return self.next_priority >= WRAP_UP_PRIORITY
+
+    def record_answer(self, question, answer):
+        question.answer = answer
+        self._changed.setdefault(question, set()).add("answer")
+
+    def record_audio(self, question, name):
+        question.audio.name = name
+        self._changed.setdefault(question, set()).add("audio")
+
+    def mark_sent(self, question):
+        question.sent_at = timezone.now()
+        question.send_count += 1
+        if question.pk is not None:
+            self._changed.setdefault(question, set()).update(["sent_at", "send_count"])
+
+    def abandon(self):
+        """
+        Expire the conversation: it is closed without a wrap-up and the
+        customer can be invited to review later orders
+        """
+
+        now = timezone.now()
+        self.order.review_abandoned_at = self.order.updated_at = now
+        with transaction.atomic():
+            # updated_at is bumped by hand so the dashboard aggregates see the change
+            Order.objects.filter(pk=self.order.pk).update(review_abandoned_at=now, updated_at=now)
+            close_conversation(self.order)
+
+    def answer_sentiments(self):
+        return [
+            classify_answer_sentiment(question.answer)
+            for question in self.questions
+            if question.is_question_answered
+        ]
+
+    def template_reply(self, sentiments=None):
+        """
+        Pick a pre-written reply for the current turn, or None if no
+        template fits (unclear sentiment or an unusual turn).
+
+        `sentiments` overrides the answers' sentiments, e.g. to ask which
+        reply an answer of a given sentiment would get before it arrives.
+        """
+
+        if sentiments is None:
+            sentiments = self.answer_sentiments()
+
+        if self.is_wrap_up_turn:
+            sentiment = overall_sentiment(sentiments)
+            templates = WRAP_UP_TEMPLATES.get(sentiment)
+        else:
+            sentiment = sentiments[-1] if sentiments else None
+            templates = FOLLOW_UP_TEMPLATES.get((sentiment, self.turn))
+
+        if not templates:
+            return None
+
+        # Vary the wording between customers but keep it stable per order
+        return templates[self.order.id % len(templates)]
+
+    def generate_reply(self):
+        """
+        Return the next message text, falling back to the LLM only when no
+        template fits
+        """
+
+        reply = self.template_reply()
+        if reply:
+            return reply
+
+        if self.speculative and self.questions:
+            reply = take_speculative_reply(self.questions[-1])
+            if reply:
+                return reply
+        return create_next_question_for_order(self.questions)
+
+    def add_question(self, text, answer=None):
+        question = QuestionTemplate(
+            order=self.order,
+            question=text,
+            answer=answer,
+            priority=self.next_priority,
+        )
+        self.questions.append(question)
+        return question
+
+    def save(self):
+        """
+        Write recorded answers and new questions: one UPDATE per changed
+        question and a single INSERT, however long the history is
+        """
+
+        new_questions = [question for question in self.questions if question.pk is None]
+        if not self._changed and not new_questions:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            for question, fields in self._changed.items():
+                QuestionTemplate.objects.filter(pk=question.pk).update(
+                    updated_at=now, **{field: getattr(question, field) for field in fields}
+                )
+                question.updated_at = now
+            if new_questions:
+                QuestionTemplate.objects.bulk_create(new_questions)
+            if self.state == ConversationState.COMPLETED:
+                close_conversation(self.order)
+            elif any(question.priority == 1 for question in new_questions):
+                open_conversation(self.order)
+        self._changed = {}
+
+    def advance(self):
+        """
+        Move the conversation forward: open it, re-ask the pending
+        question, or add the next follow-up / wrap-up after an answer.
+
+        Returns the message to send to the customer, or None if there is
+        nothing to send. New questions are kept in memory until save().
+        """
+
+        state = self.state
+        if state in (ConversationState.COMPLETED, ConversationState.ABANDONED):
+            return None
+        if state == ConversationState.NOT_STARTED:
+            return self.add_question(OPENING_QUESTION).question
+        if state == ConversationState.AWAITING_ANSWER:
+            # Questions seeded up front are asked before generating new ones
+            return self.pending_question.question
+
+        reply = self.generate_reply()
+        if not reply:
+            return None
+
+        if self.is_wrap_up_turn:
+            # The wrap-up doesn't expect an answer
+            self.add_question(reply, answer="N/A")
+        else:
+            self.add_question(reply)
+        return reply
@@ -0,0 +1,101 @@
+import re
+
+from django.conf import settings
+
+from backend.models import Customer
+
+
+def normalize_phone_number(raw, default_country_code=None):
+    """
+    Return a phone number in E.164 form (+923001234567), or None if it can't
+    be one
+
+    Accepts WhatsApp ids (923001234567@c.us), international numbers with a
+    leading + or 00, and national numbers with a trunk 0, which get
+    settings.DEFAULT_PHONE_COUNTRY_CODE.
+    """
+
+    if not raw:
+        return None
+
+    raw = raw.split("@")[0].strip()
+    digits = re.sub(r"\D", "", raw)
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        digits = (default_country_code or settings.DEFAULT_PHONE_COUNTRY_CODE) + digits[1:]
+
+    # E.164 numbers have at most 15 digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return f"+{digits}"
+
+
+def get_customers(company_id, phone_numbers):
+    """
+    Return {raw phone number: Customer} for the given numbers, creating the
+    missing customers in bulk. Numbers that can't be normalized are left out.
+    """
+
+    normalized = {}
+    for raw in phone_numbers:
+        phone_number = normalize_phone_number(raw)
+        if phone_number:
+            normalized[raw] = phone_number
+
+    if not normalized:
+        return {}
+
+    # ignore_conflicts: another process may create the same customer concurrently
+    Customer.objects.bulk_create(
+        [
+            Customer(company_id=company_id, phone_number=phone_number)
+            for phone_number in set(normalized.values())
+        ],
+        ignore_conflicts=True,
+    )
+    customers = {
+        customer.phone_number: customer
+        for customer in Customer.objects.filter(
+            company_id=company_id, phone_number__in=set(normalized.values())
+        )
+    }
+    return {raw: customers[phone_number] for raw, phone_number in normalized.items()}
+
+
+def get_customer(company_id, phone_number):
+    return get_customers(company_id, [phone_number]).get(phone_number)
+
+
+def open_conversation(order):
+    """
+    Point the order's customer at this order's review conversation
+    """
+
+    if order.customer_id:
+        Customer.objects.filter(id=order.customer_id).update(open_order=order)
+
+
+def close_conversation(order):
+    """
+    Clear the customer's pointer if it still refers to this order
+    """
+
+    if order.customer_id:
+        Customer.objects.filter(id=order.customer_id, open_order=order).update(open_order=None)
+
+
+def move_open_conversation(order, previous_customer_id):
+    """
+    Hand the order's review conversation in progress over to its new
+    customer after its phone number changed. A customer already in another
+    conversation keeps that one.
+    """
+
+    if not previous_customer_id or previous_customer_id == order.customer_id:
+        return
+    moved = Customer.objects.filter(id=previous_customer_id, open_order=order).update(open_order=None)
+    if moved and order.customer_id:
+        Customer.objects.filter(id=order.customer_id, open_order__isnull=True).update(open_order=order)
@@ -0,0 +1,93 @@
+import contextlib
+import contextvars
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+
+REPLICA_ALIAS = "replica"
+REPLICA_LAG_CACHE_KEY = "db:replica_lag"
+
+# Replay lag in seconds; 0 when the replica has replayed everything it received
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+_analytics_reads = contextvars.ContextVar("analytics_reads", default=False)
+
+
+def replica_lag():
+    """
+    Return the replica's lag in seconds, or None if it is unreachable.
+    Checked at most every REPLICA_LAG_CHECK_INTERVAL seconds.
+    """
+
+    lag = cache.get(REPLICA_LAG_CACHE_KEY)
+    if lag is not None:
+        return lag if lag >= 0 else None
+
+    try:
+        with connections[REPLICA_ALIAS].cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = float(cursor.fetchone()[0])
+    except DatabaseError as e:
+        print(f"Replica unavailable, reading from the primary: {e}")
+        lag = -1
+
+    cache.set(REPLICA_LAG_CACHE_KEY, lag, timeout=settings.REPLICA_LAG_CHECK_INTERVAL)
+    return lag if lag >= 0 else None
+
+
+def analytics_db():
+    """
+    Database alias for analytics reads: the replica when one is configured
+    and no more than REPLICA_MAX_LAG_SECONDS behind, otherwise the primary
+    """
+
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return "default"
+    lag = replica_lag()
+    if lag is None or lag > settings.REPLICA_MAX_LAG_SECONDS:
+        return "default"
+    return REPLICA_ALIAS
+
+
+@contextlib.contextmanager
+def analytics_reads():
+    """
+    Route ORM reads inside the block to analytics_db(). Writes always go
+    to the primary.
+    """
+
+    token = _analytics_reads.set(True)
+    try:
+        yield
+    finally:
+        _analytics_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Everything uses the primary except reads made inside analytics_reads(),
+    so the conversation path always reads its own writes
+    """
+
+    def db_for_read(self, model, **hints):
+        if _analytics_reads.get():
+            return analytics_db()
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
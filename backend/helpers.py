@@ -1,4 +1,25 @@
+import re
 from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+POSITIVE_WORDS = {
+    "good", "great", "amazing", "awesome", "excellent", "delicious", "tasty", "loved",
+    "love", "nice", "perfect", "fantastic", "fresh", "friendly", "yummy", "best",
+    "enjoyed", "wonderful", "happy", "satisfied", "fast", "quick", "fine",
+}
+NEGATIVE_WORDS = {
+    "bad", "cold", "terrible", "awful", "worst", "late", "slow", "rude", "stale",
+    "disappointed", "disappointing", "horrible", "poor", "raw", "burnt", "salty",
+    "bland", "dirty", "wrong", "missing", "overpriced", "hate", "never", "not",
+    "didn't", "wasn't", "unhappy", "soggy",
+}
+
+# Answers longer than this with no clear signal get a tailored LLM reply
+MAX_NEUTRAL_ANSWER_WORDS = 12
 
 
 def refine_sentiment(original_sentiment, emotions):
@@ -35,3 +56,56 @@ def re_structure_orders(orders):
         orders_dict[key].sort(key=lambda d: d["questions__priority"])
 
     return orders_dict
+
+
+def classify_answer_sentiment(answer):
+    """
+    Cheap lexicon-based sentiment of a single customer answer.
+
+    Returns "positive", "negative" or "neutral", or None when the answer is
+    missing, mixed, or too long to classify confidently.
+    """
+
+    if not answer:
+        return None
+
+    words = re.findall(r"[a-z']+", answer.lower())
+    has_pos = any(word in POSITIVE_WORDS for word in words)
+    has_neg = any(word in NEGATIVE_WORDS for word in words)
+
+    if has_pos and has_neg:
+        return None
+    elif has_neg:
+        return "negative"
+    elif has_pos:
+        return "positive"
+    elif len(words) <= MAX_NEUTRAL_ANSWER_WORDS:
+        return "neutral"
+    return None
+
+
+def overall_sentiment(sentiments):
+    """
+    Combine per-answer sentiments into the tone used for the wrap-up.
+    Any negative answer makes the conversation negative.
+    """
+
+    sentiments = [sentiment for sentiment in sentiments if sentiment]
+    if not sentiments:
+        return None
+    if "negative" in sentiments:
+        return "negative"
+    if "positive" in sentiments:
+        return "positive"
+    return "neutral"
+
+
+def get_review_due_at(order_at):
+    """
+    When to invite the customer to review an order: REVIEW_DELAY_HOURS after
+    it was placed, or None if the order is already outside the review window
+    """
+
+    if order_at < timezone.now() - timedelta(days=settings.REVIEW_WINDOW_DAYS):
+        return None
+    return order_at + timedelta(hours=settings.REVIEW_DELAY_HOURS)
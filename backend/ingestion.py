@@ -0,0 +1,221 @@
+import gzip
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from backend.customers import get_customers, move_open_conversation
+from backend.helpers import get_review_due_at
+from backend.models import Order
+
+
+# Fields a re-sent order overwrites; review scheduling is only set on insert
+UPSERT_FIELDS = [
+    "branch_name",
+    "details",
+    "order_at",
+    "customer_name",
+    "customer_phone_number",
+    "customer",
+    "order_details",
+    "updated_at",
+]
+
+
+def iter_lines(stream, compressed=False):
+    """
+    Yield (line number, text) from a JSON Lines body, one line at a time,
+    without reading the whole body into memory
+    """
+
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream)
+
+    for line_number, line in enumerate(iter(stream.readline, b""), start=1):
+        line = line.decode("utf-8", errors="replace").strip()
+        if line:
+            yield line_number, line
+
+
+def _clean_line_item(item):
+    if not isinstance(item, dict) or not str(item.get("item") or "").strip():
+        raise ValueError("each line item needs an item name")
+    try:
+        quantity = int(item.get("quantity", 1))
+        price = Decimal(str(item.get("price", 0)))
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError("quantity and price must be numbers")
+    # NaN can't be compared and infinities aren't valid JSON
+    if not price.is_finite():
+        raise ValueError("quantity and price must be numbers")
+    if quantity < 1 or price < 0:
+        raise ValueError("quantity must be positive and price non-negative")
+    return {
+        "item": str(item["item"]).strip(),
+        "quantity": quantity,
+        "price": float(price),
+        "special_notes": str(item.get("special_notes") or ""),
+    }
+
+
+def validate_order(data):
+    """
+    Return (cleaned values, None) for a valid order row or (None, errors)
+    """
+
+    if not isinstance(data, dict):
+        return None, {"__all__": "expected a JSON object"}
+
+    errors = {}
+    values = {}
+    for field, max_length in (("number", 100), ("customer_name", 100), ("customer_phone_number", 100)):
+        value = str(data.get(field) or "").strip()
+        if not value:
+            errors[field] = "required"
+        elif len(value) > max_length:
+            errors[field] = f"at most {max_length} characters"
+        values[field] = value
+
+    branch_name = data.get("branch_name")
+    if branch_name is not None and len(str(branch_name)) > 100:
+        errors["branch_name"] = "at most 100 characters"
+    values["branch_name"] = str(branch_name) if branch_name is not None else None
+    values["details"] = str(data.get("details") or "")
+
+    try:
+        order_at = parse_datetime(str(data.get("order_at") or ""))
+    except ValueError:
+        # Well-formed but nonexistent, e.g. February 30th
+        order_at = None
+    if order_at is None:
+        errors["order_at"] = "ISO 8601 date and time required"
+    elif timezone.is_naive(order_at):
+        order_at = timezone.make_aware(order_at)
+    values["order_at"] = order_at
+
+    line_items = data.get("order_details") or []
+    if not isinstance(line_items, list):
+        errors["order_details"] = "expected a list of line items"
+    else:
+        try:
+            values["order_details"] = [_clean_line_item(item) for item in line_items]
+        except ValueError as e:
+            errors["order_details"] = str(e)
+
+    if errors:
+        return None, errors
+    return values, None
+
+
+def upsert_orders(company, rows):
+    """
+    Insert or update a batch of validated orders on (company, number)
+
+    Args:
+        company: Company the orders belong to
+        rows: List of (line number, cleaned values) with unique order numbers
+
+    Returns:
+        A list of per-row results in the same order
+    """
+
+    numbers = [values["number"] for _, values in rows]
+    # {number: customer id} of the orders already stored
+    existing = dict(
+        Order.objects.filter(company=company, number__in=numbers).values_list("number", "customer_id")
+    )
+    customers = get_customers(company.id, {values["customer_phone_number"] for _, values in rows})
+
+    orders = []
+    for _, values in rows:
+        customer = customers.get(values["customer_phone_number"])
+        orders.append(
+            Order(
+                company=company,
+                customer=customer,
+                # Replies are matched to customers, so a number that can't be
+                # normalized is never invited
+                review_due_at=get_review_due_at(values["order_at"]) if customer else None,
+                **values,
+            )
+        )
+    with transaction.atomic():
+        Order.objects.bulk_create(
+            orders,
+            update_conflicts=True,
+            unique_fields=["company", "number"],
+            update_fields=UPSERT_FIELDS,
+        )
+        for order in orders:
+            if order.number in existing:
+                move_open_conversation(order, existing[order.number])
+
+    return [
+        {
+            "line": line_number,
+            "number": order.number,
+            "id": order.id,
+            "status": "updated" if order.number in existing else "created",
+        }
+        for (line_number, _), order in zip(rows, orders)
+    ]
+
+
+def ingest_orders(company, lines):
+    """
+    Validate and upsert orders from (line number, JSON text) pairs in
+    batches of settings.ORDER_INGEST_BATCH_SIZE, yielding one result per line
+    """
+
+    batch = {}
+
+    def flush():
+        rows = list(batch.values())
+        batch.clear()
+        try:
+            return upsert_orders(company, rows)
+        except DatabaseError as e:
+            # The batch is rolled back; earlier and later batches are kept
+            print(f"Error upserting a batch of {len(rows)} orders for company {company.id}: {e}")
+            return [
+                {
+                    "line": line_number,
+                    "number": values["number"],
+                    "status": "error",
+                    "errors": {"__all__": "could not be saved, retry"},
+                }
+                for line_number, values in rows
+            ]
+
+    for count, (line_number, line) in enumerate(lines, start=1):
+        if count > settings.ORDER_INGEST_MAX_ROWS:
+            yield {"line": line_number, "status": "error", "errors": {"__all__": "too many rows in one request"}}
+            break
+
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"line": line_number, "status": "error", "errors": {"__all__": f"invalid JSON: {e.msg}"}}
+            continue
+
+        values, errors = validate_order(data)
+        if errors:
+            number = data.get("number") if isinstance(data, dict) else None
+            yield {"line": line_number, "number": number, "status": "error", "errors": errors}
+            continue
+
+        # A number repeated within a batch can't be upserted twice in one
+        # statement; the last occurrence wins
+        previous = batch.pop(values["number"], None)
+        if previous:
+            yield {"line": previous[0], "number": values["number"], "status": "superseded", "by_line": line_number}
+        batch[values["number"]] = (line_number, values)
+
+        if len(batch) >= settings.ORDER_INGEST_BATCH_SIZE:
+            yield from flush()
+
+    if batch:
+        yield from flush()
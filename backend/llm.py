@@ -0,0 +1,271 @@
+import hashlib
+import json
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+
+LLM_PREFIX = "llm"
+
+# Every place in the code base that talks to the LLM
+CALL_SITES = (
+    "analyze_review",
+    "next_question",
+    "sql_generate",
+    "sql_evaluate",
+    "visualization",
+)
+
+USAGE_FIELDS = ("calls", "errors", "coalesced", "prompt_tokens", "completion_tokens", "latency_ms")
+
+# Keys holding concurrency counters expire so a crashed worker can't leak a slot forever
+SLOT_TTL = 300
+POLL_INTERVAL = 0.05
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMBudgetExceeded(LLMError):
+    pass
+
+
+def _incr(key, amount=1, timeout=None):
+    # cache.incr raises if the key is missing
+    if not cache.add(key, amount, timeout=timeout):
+        return cache.incr(key, amount)
+    return amount
+
+
+def _decr(key, amount=1):
+    try:
+        if cache.decr(key, amount) < 0:
+            cache.set(key, 0, timeout=SLOT_TTL)
+    except ValueError:
+        pass
+
+
+def _estimate_tokens(messages, max_tokens):
+    # ~4 characters per token is close enough for budgeting
+    prompt_chars = sum(len(message["content"]) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+class _Limits:
+    """
+    Concurrency slots and tokens-per-minute budget for one scope (global or
+    a single company), shared by every process through the cache.
+    """
+
+    def __init__(self, scope, max_concurrency, tokens_per_minute):
+        self.scope = scope
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.slot_key = f"{LLM_PREFIX}:slots:{scope}"
+        # (budget key, tokens) reserved by acquire(), refunded if the call fails
+        self.reserved = None
+
+    def budget_key(self, minute=None):
+        minute = minute if minute is not None else int(time.time() // 60)
+        return f"{LLM_PREFIX}:tpm:{self.scope}:{minute}"
+
+    def acquire(self, tokens, deadline):
+        self._reserve_tokens(tokens, deadline)
+        while True:
+            taken = _incr(self.slot_key, timeout=SLOT_TTL)
+            # Every acquire extends the TTL, so the counter only expires once
+            # the scope has been idle for SLOT_TTL
+            cache.touch(self.slot_key, SLOT_TTL)
+            if taken <= self.max_concurrency:
+                return
+            _decr(self.slot_key)
+            if time.monotonic() > deadline:
+                self.refund_tokens()
+                raise LLMBudgetExceeded(f"No free LLM slot for {self.scope}")
+            time.sleep(POLL_INTERVAL)
+
+    def release(self):
+        _decr(self.slot_key)
+
+    def refund_tokens(self):
+        if self.reserved:
+            key, tokens = self.reserved
+            _decr(key, tokens)
+            self.reserved = None
+
+    def adjust_tokens(self, estimated, actual):
+        if actual > estimated:
+            _incr(self.budget_key(), actual - estimated, timeout=120)
+
+    def _reserve_tokens(self, tokens, deadline):
+        while True:
+            key = self.budget_key()
+            if _incr(key, tokens, timeout=120) <= self.tokens_per_minute:
+                self.reserved = (key, tokens)
+                return
+            _decr(key, tokens)
+            wait = 60 - time.time() % 60
+            if time.monotonic() + wait > deadline:
+                raise LLMBudgetExceeded(f"Tokens-per-minute budget exhausted for {self.scope}")
+            time.sleep(wait)
+
+
+def _record_usage(call_site, **values):
+    for field, amount in values.items():
+        if amount:
+            _incr(f"{LLM_PREFIX}:usage:{call_site}:{field}", amount)
+
+
+def usage_stats():
+    """
+    Return {call_site: {field: total}} for every known call site
+    """
+
+    keys = [
+        f"{LLM_PREFIX}:usage:{call_site}:{field}"
+        for call_site in CALL_SITES
+        for field in USAGE_FIELDS
+    ]
+    values = cache.get_many(keys)
+    return {
+        call_site: {
+            field: values.get(f"{LLM_PREFIX}:usage:{call_site}:{field}", 0)
+            for field in USAGE_FIELDS
+        }
+        for call_site in CALL_SITES
+    }
+
+
+def _post_completion(model, messages, temperature, max_tokens, timeout):
+    headers = {
+        "Authorization": f"Bearer {settings.GROQ_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    response = requests.post(GROQ_CHAT_URL, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _complete_with_fallback(call_site, models, messages, temperature, max_tokens, timeout):
+    last_error = None
+    for model in models:
+        started_at = time.monotonic()
+        try:
+            result = _post_completion(model, messages, temperature, max_tokens, timeout)
+        except requests.RequestException as e:
+            _record_usage(call_site, errors=1)
+            print(f"LLM call {call_site} failed on {model}: {e}")
+            last_error = e
+            continue
+
+        usage = result.get("usage", {})
+        _record_usage(
+            call_site,
+            calls=1,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            latency_ms=int((time.monotonic() - started_at) * 1000),
+        )
+        return result["choices"][0]["message"]["content"], usage.get("total_tokens", 0)
+
+    raise LLMError(f"All models failed for {call_site}") from last_error
+
+
+def chat_completion(
+    call_site,
+    messages,
+    temperature=0.1,
+    company_id=None,
+    max_tokens=None,
+    timeout=None,
+):
+    """
+    Run a chat completion through the shared gateway
+
+    Args:
+        call_site: One of CALL_SITES; picks the model chain and labels usage
+        messages: OpenAI-style chat messages
+        temperature: Sampling temperature
+        company_id: Tenant the call is made for, if any (per-tenant limits)
+        max_tokens: Completion token cap (default: settings.LLM_MAX_TOKENS)
+        timeout: Per-call timeout in seconds (default: settings.LLM_TIMEOUT)
+
+    Returns:
+        The completion text. Identical requests already in flight in any
+        worker are waited on instead of being sent again.
+    """
+
+    max_tokens = max_tokens or settings.LLM_MAX_TOKENS
+    timeout = timeout or settings.LLM_TIMEOUT
+    models = settings.LLM_MODELS.get(call_site, settings.LLM_MODELS["default"])
+
+    request_hash = hashlib.sha256(
+        json.dumps([models, messages, temperature, max_tokens], sort_keys=True).encode()
+    ).hexdigest()
+    inflight_key = f"{LLM_PREFIX}:inflight:{request_hash}"
+    result_key = f"{LLM_PREFIX}:result:{request_hash}"
+
+    deadline = time.monotonic() + timeout * len(models)
+
+    # Coalesce with an identical request another worker is already running
+    owns_inflight = False
+    while True:
+        content = cache.get(result_key)
+        if content is not None:
+            _record_usage(call_site, coalesced=1)
+            return content
+        owns_inflight = cache.add(inflight_key, 1, timeout=int(timeout * len(models)) + 1)
+        if owns_inflight or time.monotonic() > deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    # The company scope is taken first, so a company at its own limit waits
+    # without holding global slots other tenants need
+    scopes = []
+    if company_id:
+        scopes.append(
+            _Limits(
+                f"company:{company_id}",
+                settings.LLM_COMPANY_MAX_CONCURRENCY,
+                settings.LLM_COMPANY_TOKENS_PER_MINUTE,
+            )
+        )
+    scopes.append(_Limits("global", settings.LLM_MAX_CONCURRENCY, settings.LLM_TOKENS_PER_MINUTE))
+
+    # Waiting for limits must leave time for the call within the task's time limit
+    acquire_deadline = min(deadline, time.monotonic() + settings.LLM_MAX_WAIT)
+    estimated_tokens = _estimate_tokens(messages, max_tokens)
+    acquired = []
+    completed = False
+    try:
+        for limits in scopes:
+            limits.acquire(estimated_tokens, acquire_deadline)
+            acquired.append(limits)
+
+        content, total_tokens = _complete_with_fallback(
+            call_site, models, messages, temperature, max_tokens, timeout
+        )
+        completed = True
+        for limits in scopes:
+            limits.adjust_tokens(estimated_tokens, total_tokens)
+
+        cache.set(result_key, content, timeout=settings.LLM_COALESCE_TTL)
+        return content
+    finally:
+        for limits in acquired:
+            limits.release()
+            if not completed:
+                limits.refund_tokens()
+        if owns_inflight:
+            cache.delete(inflight_key)
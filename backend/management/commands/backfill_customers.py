@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from backend.constants import WRAP_UP_PRIORITY
+from backend.customers import get_customers
+from backend.models import Company, Customer, Order
+
+
+class Command(BaseCommand):
+    help = "Create customers for existing orders and point them at their open review conversations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        for company in Company.objects.all():
+            attached = 0
+            last_id = 0
+            while True:
+                orders = list(
+                    Order.objects.filter(company=company, customer__isnull=True, id__gt=last_id)
+                    .only("id", "customer_phone_number")
+                    .order_by("id")[:batch_size]
+                )
+                if not orders:
+                    break
+                last_id = orders[-1].id
+
+                # Orders whose number can't be normalized stay without a customer
+                customers = get_customers(company.id, {order.customer_phone_number for order in orders})
+                for order in orders:
+                    order.customer = customers.get(order.customer_phone_number)
+                Order.objects.bulk_update(orders, ["customer"])
+                attached += sum(1 for order in orders if order.customer)
+            self.stdout.write(f"{company.name}: attached {attached} orders to customers")
+
+        # The open conversation is the customer's oldest order that has
+        # questions but no wrap-up yet
+        open_orders = (
+            Order.objects.filter(customer__isnull=False)
+            .annotate(last_priority=Max("questions__priority"))
+            .filter(last_priority__lt=WRAP_UP_PRIORITY)
+            .order_by("customer_id", "order_at")
+            .values_list("customer_id", "id")
+        )
+        open_order_ids = {}
+        for customer_id, order_id in open_orders.iterator():
+            open_order_ids.setdefault(customer_id, order_id)
+
+        Customer.objects.exclude(id__in=open_order_ids).update(open_order=None)
+        customers = list(Customer.objects.filter(id__in=open_order_ids).only("id"))
+        for customer in customers:
+            customer.open_order_id = open_order_ids[customer.id]
+        Customer.objects.bulk_update(customers, ["open_order"], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(customers)} customers have an open conversation"))
@@ -74,6 +74,7 @@ class Command(BaseCommand):
                     order = Order.objects.create(
                         company=company,
                         branch_name=row.get('branch_name', ''),
+                        number=row.get('number') or f'TEST-{reader.line_num}',
                         details=row.get('details', ''),
                         order_at=timezone.now() if not row.get('order_at') else timezone.make_aware(
                             datetime.strptime(row.get('order_at'), '%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from backend.llm import USAGE_FIELDS, usage_stats
+
+
+class Command(BaseCommand):
+    help = "Show LLM calls, token usage and latency per call site"
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write("call_site".ljust(16) + "".join(field.rjust(20) for field in USAGE_FIELDS) + "avg_latency_ms".rjust(20))
+        for call_site, stats in usage_stats().items():
+            average_latency = stats["latency_ms"] // stats["calls"] if stats["calls"] else 0
+            self.stdout.write(
+                call_site.ljust(16)
+                + "".join(str(stats[field]).rjust(20) for field in USAGE_FIELDS)
+                + str(average_latency).rjust(20)
+            )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from backend.aggregates import refresh_aggregates
+from backend.db_router import analytics_reads
+
+
+class Command(BaseCommand):
+    help = "Rebuild the dashboard aggregates for the whole order history"
+
+    def handle(self, *args, **kwargs):
+        with analytics_reads():
+            rebuilt = refresh_aggregates()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt aggregates for {rebuilt} company-days"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.speculation import speculation_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit rate and latency saved by speculative reply pre-generation"
+
+    def handle(self, *args, **kwargs):
+        stats = speculation_stats()
+        self.stdout.write(f"Hits: {stats['hits']}")
+        self.stdout.write(f"Misses: {stats['misses']}")
+        self.stdout.write(f"Hit rate: {stats['hit_rate']:.1%}")
+        self.stdout.write(f"Latency saved: {stats['latency_saved_ms'] / 1000:.1f}s")
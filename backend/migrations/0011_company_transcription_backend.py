@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_remove_analytics_sentiment_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='transcription_backend',
+            field=models.CharField(choices=[('lemonfox', 'LemonFox API'), ('local', 'Local Whisper (CPU)')], default='lemonfox', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_company_transcription_backend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='speculative_questions',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-19 11:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_company_speculative_questions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='users',
+            field=models.ManyToManyField(blank=True, related_name='companies', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
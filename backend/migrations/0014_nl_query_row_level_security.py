@@ -0,0 +1,65 @@
+# Restricted role and row-level security for natural language SQL queries.
+# The role only sees rows of the company in the `servewell.company_id`
+# setting; the application user owns the tables and isn't affected.
+
+from django.db import migrations
+
+
+COMPANY_SCOPE = "current_setting('servewell.company_id')::bigint"
+
+CREATE_ROLE = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'servewell_nl_reader') THEN
+        CREATE ROLE servewell_nl_reader NOLOGIN;
+    END IF;
+END
+$$;
+GRANT servewell_nl_reader TO CURRENT_USER;
+GRANT USAGE ON SCHEMA public TO servewell_nl_reader;
+GRANT SELECT (id, name, phone_number, created_at, updated_at) ON backend_company TO servewell_nl_reader;
+GRANT SELECT ON backend_order, backend_questiontemplate, backend_analytics TO servewell_nl_reader;
+"""
+
+DROP_ROLE = """
+REVOKE ALL ON backend_company, backend_order, backend_questiontemplate, backend_analytics FROM servewell_nl_reader;
+REVOKE USAGE ON SCHEMA public FROM servewell_nl_reader;
+DROP ROLE IF EXISTS servewell_nl_reader;
+"""
+
+POLICIES = {
+    "backend_company": f"id = {COMPANY_SCOPE}",
+    "backend_order": f"company_id = {COMPANY_SCOPE}",
+    "backend_questiontemplate": f"order_id IN (SELECT id FROM backend_order WHERE company_id = {COMPANY_SCOPE})",
+    "backend_analytics": f"order_id IN (SELECT id FROM backend_order WHERE company_id = {COMPANY_SCOPE})",
+}
+
+
+def enable_policies():
+    statements = []
+    for table, condition in POLICIES.items():
+        statements.append(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY;")
+        statements.append(
+            f"CREATE POLICY nl_company_scope ON {table} FOR SELECT TO servewell_nl_reader USING ({condition});"
+        )
+    return "\n".join(statements)
+
+
+def disable_policies():
+    statements = []
+    for table in POLICIES:
+        statements.append(f"DROP POLICY IF EXISTS nl_company_scope ON {table};")
+        statements.append(f"ALTER TABLE {table} DISABLE ROW LEVEL SECURITY;")
+    return "\n".join(statements)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_company_users'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ROLE, DROP_ROLE),
+        migrations.RunSQL(enable_policies(), disable_policies()),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_nl_query_row_level_security'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='instance_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
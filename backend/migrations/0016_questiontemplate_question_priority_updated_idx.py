@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_alter_company_instance_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='questiontemplate',
+            index=models.Index(fields=['priority', 'updated_at'], name='question_priority_updated_idx'),
+        ),
+    ]
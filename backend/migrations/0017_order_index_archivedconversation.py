@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_questiontemplate_question_priority_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['company', 'order_at'], name='order_company_order_at_idx'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('questions', models.JSONField(default=list)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archived_conversation', to='backend.order')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
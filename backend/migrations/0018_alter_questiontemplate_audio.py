@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 15:00
+
+import backend.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_order_index_archivedconversation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='questiontemplate',
+            name='audio',
+            field=models.FileField(blank=True, null=True, storage=backend.storage.get_audio_storage, upload_to='audio/'),
+        ),
+    ]
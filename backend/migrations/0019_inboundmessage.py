@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 16:20
+
+import backend.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_alter_questiontemplate_audio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboundMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sender_phone_number', models.CharField(max_length=100)),
+                ('message_type', models.CharField(choices=[('chat', 'Text'), ('ptt', 'Voice note')], max_length=20)),
+                ('content', models.TextField(blank=True, default='')),
+                ('media', models.FileField(blank=True, null=True, storage=backend.storage.get_audio_storage, upload_to='audio/')),
+                ('received_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbound_messages', to='backend.company')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
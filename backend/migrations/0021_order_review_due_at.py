@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-19 17:10
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_uninvited_orders(apps, schema_editor):
+    # Orders still inside the review window that were never invited
+    Order = apps.get_model("backend", "Order")
+    orders = Order.objects.filter(
+        order_at__gte=timezone.now() - timedelta(days=settings.REVIEW_WINDOW_DAYS),
+        questions__isnull=True,
+    )
+    for order in orders.only("id", "order_at").iterator():
+        Order.objects.filter(id=order.id).update(
+            review_due_at=order.order_at + timedelta(hours=settings.REVIEW_DELAY_HOURS)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0020_customer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='review_due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('review_due_at__isnull', False)), fields=['review_due_at'], name='order_review_due_idx'),
+        ),
+        migrations.RunPython(schedule_uninvited_orders, migrations.RunPython.noop),
+    ]
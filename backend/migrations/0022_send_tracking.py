@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0021_order_review_due_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='review_abandoned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='questiontemplate',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='questiontemplate',
+            name='send_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
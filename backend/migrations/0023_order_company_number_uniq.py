@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 18:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def make_order_numbers_unique(apps, schema_editor):
+    # Earlier imports could repeat a number (or leave it empty); all but the
+    # first order of each group get the order id appended
+    Order = apps.get_model("backend", "Order")
+    duplicates = (
+        Order.objects.values("company_id", "number")
+        .annotate(total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        orders = Order.objects.filter(
+            company_id=duplicate["company_id"], number=duplicate["number"]
+        ).order_by("id")
+        for order in orders[1:]:
+            Order.objects.filter(id=order.id).update(number=f"{order.number}-{order.id}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0022_send_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_order_numbers_unique, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('company', 'number'), name='order_company_number_uniq'),
+        ),
+    ]
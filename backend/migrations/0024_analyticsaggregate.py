@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0023_order_company_number_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField()),
+                ('branch_name', models.CharField(blank=True, default='', max_length=100)),
+                ('metric', models.CharField(choices=[('sentiment', 'Sentiment'), ('product', 'Product'), ('keyword', 'Keyword'), ('response', 'Response')], max_length=20)),
+                ('key', models.CharField(max_length=200)),
+                ('value', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_aggregates', to='backend.company')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('company', 'metric', 'date', 'branch_name', 'key'), name='analytics_aggregate_uniq')],
+            },
+        ),
+    ]
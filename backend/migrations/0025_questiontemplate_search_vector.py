@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-19 19:20
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# Written by hand so the GIN index is built without blocking writes. Adding
+# the stored column rewrites backend_questiontemplate once.
+ADD_COLUMN = """
+ALTER TABLE backend_questiontemplate
+    ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english'::regconfig, COALESCE(answer, ''))) STORED;
+"""
+
+DROP_COLUMN = "ALTER TABLE backend_questiontemplate DROP COLUMN search_vector;"
+
+CREATE_INDEX = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS question_search_idx
+    ON backend_questiontemplate USING gin (search_vector);
+"""
+
+DROP_INDEX = "DROP INDEX CONCURRENTLY IF EXISTS question_search_idx;"
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('backend', '0024_analyticsaggregate'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(ADD_COLUMN, DROP_COLUMN),
+                migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='questiontemplate',
+                    name='search_vector',
+                    field=models.GeneratedField(
+                        db_persist=True,
+                        expression=django.contrib.postgres.search.SearchVector('answer', config='english'),
+                        output_field=django.contrib.postgres.search.SearchVectorField(),
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name='questiontemplate',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='question_search_idx'),
+                ),
+            ],
+        ),
+    ]
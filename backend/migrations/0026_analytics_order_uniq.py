@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+
+# Keep the latest analysis of orders that were analyzed more than once
+DELETE_DUPLICATES = """
+DELETE FROM backend_analytics a
+USING backend_analytics newer
+WHERE newer.order_id = a.order_id AND newer.id > a.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0025_questiontemplate_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='analytics',
+            constraint=models.UniqueConstraint(fields=('order',), name='analytics_order_uniq'),
+        ),
+    ]
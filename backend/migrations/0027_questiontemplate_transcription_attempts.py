@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0026_analytics_order_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questiontemplate',
+            name='transcription_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from django.db.models import JSONField, Q
 
+from backend.storage import get_audio_storage
+
 
 class TimeStampedModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -11,20 +16,61 @@ class TimeStampedModel(models.Model):
 
 
 class Company(TimeStampedModel):
+    TRANSCRIPTION_BACKEND_CHOICES = [
+        ("lemonfox", "LemonFox API"),
+        ("local", "Local Whisper (CPU)"),
+    ]
+
     name = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=100)
     api_token = models.CharField(max_length=100)
-    instance_id = models.CharField(max_length=100)
+    instance_id = models.CharField(max_length=100, unique=True)
     webhook_token = models.CharField(max_length=100)
+    transcription_backend = models.CharField(
+        max_length=20, choices=TRANSCRIPTION_BACKEND_CHOICES, default="lemonfox"
+    )
+    speculative_questions = models.BooleanField(default=False)
+    users = models.ManyToManyField(
+        settings.AUTH_USER_MODEL, related_name="companies", blank=True
+    )
 
     def __str__(self):
         return self.name
 
 
+class Customer(TimeStampedModel):
+    """
+    A company's customer, identified by the E.164 form of their phone number
+    (backend/customers.py). `open_order` points at the order whose review
+    conversation is in progress, so inbound messages resolve it directly.
+    """
+
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="customers"
+    )
+    phone_number = models.CharField(max_length=20)
+    open_order = models.ForeignKey(
+        "Order", on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company", "phone_number"], name="customer_company_phone_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.phone_number} - {self.company.name}"
+
+
 class Order(TimeStampedModel):
     company = models.ForeignKey(
         Company, on_delete=models.CASCADE, related_name="orders"
     )
+    customer = models.ForeignKey(
+        Customer, on_delete=models.SET_NULL, related_name="orders", null=True, blank=True
+    )
     branch_name = models.CharField(max_length=100, null=True, blank=True)
     number = models.CharField(max_length=100)
     details = models.TextField()
@@ -32,6 +78,10 @@ class Order(TimeStampedModel):
     customer_name = models.CharField(max_length=100)
     customer_phone_number = models.CharField(max_length=100)
     order_details = JSONField(default=list)
+    # When the review invitation is due; cleared once it has been sent
+    review_due_at = models.DateTimeField(null=True, blank=True)
+    # Set when the customer stopped answering (see send_review_reminders)
+    review_abandoned_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -45,6 +95,20 @@ class Order(TimeStampedModel):
 
     # ]
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["company", "order_at"], name="order_company_order_at_idx"),
+            models.Index(
+                fields=["review_due_at"],
+                condition=Q(review_due_at__isnull=False),
+                name="order_review_due_idx",
+            ),
+        ]
+        constraints = [
+            # Upsert key of the ingestion API
+            models.UniqueConstraint(fields=["company", "number"], name="order_company_number_uniq"),
+        ]
+
     def __str__(self):
         return f"{self.number} - {self.company.name}"
 
@@ -60,10 +124,28 @@ class QuestionTemplate(TimeStampedModel):
     question = models.TextField()
     priority = models.IntegerField()
     answer = models.TextField(null=True, blank=True)
-    audio = models.FileField(upload_to="audio/", null=True, blank=True)
+    audio = models.FileField(upload_to="audio/", storage=get_audio_storage, null=True, blank=True)
+    # Last time the question was sent to the customer, and how many times it was
+    sent_at = models.DateTimeField(null=True, blank=True)
+    send_count = models.PositiveIntegerField(default=0)
+    # Failed transcriptions of the voice note by transcribe_pending_audio
+    transcription_attempts = models.PositiveSmallIntegerField(default=0)
+    # Full-text search document of the answer (typed or transcribed),
+    # maintained by Postgres
+    search_vector = models.GeneratedField(
+        expression=SearchVector("answer", config="english"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["priority", "updated_at"], name="question_priority_updated_idx"),
+            GinIndex(fields=["search_vector"], name="question_search_idx"),
+        ]
+
     def __str__(self):
         return f"{self.order.number} - {self.question}"
 
@@ -72,6 +154,56 @@ class QuestionTemplate(TimeStampedModel):
         return any([self.answer, self.audio])
 
 
+class InboundMessage(TimeStampedModel):
+    """
+    A WhatsApp message received by the webhook. Tasks are queued with its id
+    only; voice notes are decoded and stored once, at receipt.
+    """
+
+    MESSAGE_TYPE_CHOICES = [
+        ("chat", "Text"),
+        ("ptt", "Voice note"),
+    ]
+
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="inbound_messages"
+    )
+    sender_phone_number = models.CharField(max_length=100)
+    message_type = models.CharField(max_length=20, choices=MESSAGE_TYPE_CHOICES)
+    content = models.TextField(blank=True, default="")
+    media = models.FileField(upload_to="audio/", storage=get_audio_storage, null=True, blank=True)
+    received_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.sender_phone_number} - {self.message_type}"
+
+
+class ArchivedConversation(TimeStampedModel):
+    """
+    Questions and answers of an order past the retention period, moved out of
+    QuestionTemplate so the hot table only holds recent conversations.
+    """
+
+    order = models.OneToOneField(
+        Order, on_delete=models.CASCADE, related_name="archived_conversation"
+    )
+    questions = JSONField(default=list)
+
+    # [
+    #     {
+    #         "question": "How was your experience?",
+    #         "priority": 1,
+    #         "answer": "Great",
+    #         "audio": "audio/audio_2_4_20250418101724.ogg",
+    #         "created_at": "2025-04-18T10:17:24Z"
+    #     }
+    # ]
+
+    def __str__(self):
+        return f"{self.order.number} - archived"
+
+
 class Analytics(TimeStampedModel):
     SENTIMENT_CHOICES = [
         ("positive", "Positive"),
@@ -101,10 +233,51 @@ class Analytics(TimeStampedModel):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # One analysis per order, however many times it is requested
+            models.UniqueConstraint(fields=["order"], name="analytics_order_uniq"),
+        ]
+
     def __str__(self):
         return f"{self.order.number} - {self.sentiment_label} - {self.emotions}"
 
 
+class AnalyticsAggregate(TimeStampedModel):
+    """
+    Daily per-branch counters behind the dashboard endpoints
+    (backend/aggregates.py). Days are rebuilt from Order, QuestionTemplate
+    and Analytics when their conversations or analyses change.
+    """
+
+    METRIC_CHOICES = [
+        ("sentiment", "Sentiment"),
+        ("product", "Product"),
+        ("keyword", "Keyword"),
+        ("response", "Response"),
+    ]
+
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="analytics_aggregates"
+    )
+    date = models.DateField()
+    branch_name = models.CharField(max_length=100, blank=True, default="")
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    key = models.CharField(max_length=200)
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company", "metric", "date", "branch_name", "key"],
+                name="analytics_aggregate_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.company.name} - {self.date} - {self.metric}:{self.key}"
+
+
 class CompanyData(TimeStampedModel):
     company_id = models.ForeignKey(Company, on_delete=models.CASCADE)
     company_name = models.CharField(max_length=100)
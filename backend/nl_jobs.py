@@ -0,0 +1,228 @@
+import time
+import uuid
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from backend.transport import dataframe_to_arrow, store_visualization
+
+
+JOB_PREFIX = "nl_job"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+def job_key(job_id):
+    return f"{JOB_PREFIX}:{job_id}"
+
+
+def result_key(job_id):
+    return f"{JOB_PREFIX}:{job_id}:result"
+
+
+def active_jobs_key(user_id):
+    return cache.make_key(f"{JOB_PREFIX}:active:{user_id}")
+
+
+# Active jobs of a user are a sorted set of job ids scored by when they stop
+# counting, so a job whose worker died frees its slot after
+# NL_QUERY_JOB_TIME_LIMIT and finishing twice can't free two slots
+CLAIM_SLOT_SCRIPT = """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[4])
+redis.call("EXPIRE", KEYS[1], ARGV[5])
+return 1
+"""
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+    return _redis
+
+
+def claim_job_slot(user_id, job_id):
+    now = time.time()
+    time_limit = settings.NL_QUERY_JOB_TIME_LIMIT
+    return bool(
+        get_redis().eval(
+            CLAIM_SLOT_SCRIPT,
+            1,
+            active_jobs_key(user_id),
+            now,
+            settings.NL_QUERY_MAX_JOBS_PER_USER,
+            now + time_limit,
+            job_id,
+            time_limit,
+        )
+    )
+
+
+def release_job_slot(user_id, job_id):
+    get_redis().zrem(active_jobs_key(user_id), job_id)
+
+
+def run_nl_query(company_id, query=None, page_token=None):
+    """
+    Run the NL pipeline for `query`, or fetch the next page of an earlier
+    query from its page token (no LLM call)
+
+    Returns:
+        (DataFrame, sql_query, pagination metadata, PNG bytes or None)
+    """
+
+    # The analytics stack (pandas, SQLAlchemy, PIL, e2b) is only loaded by
+    # processes that actually serve NL queries
+    from backend.agent import SQLGeneratorAgent
+    from backend.sql_execution import read_page_token
+
+    sql_agent = SQLGeneratorAgent()
+    if page_token:
+        sql_agent.sql_query, offset = read_page_token(page_token, company_id)
+        df = sql_agent.execute_sql_query(company_id, offset=offset)
+        image_png = None
+    else:
+        df, image_png = sql_agent.run_pipeline(query, company_id)
+    return df, sql_agent.sql_query, sql_agent.result_metadata, image_png
+
+
+def result_payload(df, query, sql_query, pagination, visualization_url):
+    return {
+        "status": "success",
+        "sql_query": sql_query,
+        "visualization_url": visualization_url,
+        "metadata": {
+            "columns": list(df.columns),
+            "shape": list(df.shape),
+            "query": query,
+            "pagination": pagination,
+        },
+    }
+
+
+def create_job(user_id, company_id, query=None, page_token=None):
+    """
+    Register a queued job, or raise JobLimitExceeded if the user already
+    has NL_QUERY_MAX_JOBS_PER_USER jobs queued or running
+    """
+
+    job_id = uuid.uuid4().hex
+    if not claim_job_slot(user_id, job_id):
+        raise JobLimitExceeded(
+            f"At most {settings.NL_QUERY_MAX_JOBS_PER_USER} queries can run at once"
+        )
+
+    job = {
+        "id": job_id,
+        "user_id": user_id,
+        "company_id": company_id,
+        "query": query,
+        "page_token": page_token,
+        "status": QUEUED,
+        "error": None,
+        "created_at": timezone.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    cache.set(job_key(job["id"]), job, timeout=settings.NL_QUERY_JOB_TTL)
+    return job
+
+
+def get_job(job_id):
+    """
+    Return a job, failing it first if it has been running for longer than
+    NL_QUERY_JOB_TIME_LIMIT (its worker died and it wasn't redelivered)
+    """
+
+    job = cache.get(job_key(job_id))
+    if job and job["status"] == RUNNING and _is_stale(job):
+        _update_job(
+            job,
+            status=FAILED,
+            error=f"The query did not finish within {settings.NL_QUERY_JOB_TIME_LIMIT} seconds",
+            finished_at=timezone.now().isoformat(),
+        )
+        release_job_slot(job["user_id"], job_id)
+    return job
+
+
+def _is_stale(job):
+    started_at = parse_datetime(job["started_at"] or "")
+    limit = timedelta(seconds=settings.NL_QUERY_JOB_TIME_LIMIT)
+    return started_at is None or started_at + limit < timezone.now()
+
+
+def get_job_result(job_id):
+    """
+    Return {"payload", "visualization_id", "arrow"} of a succeeded job, or
+    None. "arrow" is the result table as an Arrow IPC stream.
+    """
+
+    return cache.get(result_key(job_id))
+
+
+def _update_job(job, **fields):
+    job.update(fields)
+    cache.set(job_key(job["id"]), job, timeout=settings.NL_QUERY_JOB_TTL)
+
+
+def run_job(job_id):
+    """
+    Execute a queued job and store its result for NL_QUERY_JOB_TTL seconds
+    """
+
+    from backend.sql_execution import UnsafeQueryError
+
+    job = get_job(job_id)
+    if not job:
+        # Expired: its slot has expired too
+        return
+    if job["status"] in (SUCCEEDED, FAILED):
+        # A redelivered task of a finished job
+        release_job_slot(job["user_id"], job_id)
+        return
+    if job["status"] == RUNNING:
+        # Redelivered because the worker running it died (tasks are acked
+        # late); jobs running past the time limit were failed by get_job
+        print(f"NL query job {job_id} was interrupted, running it again")
+
+    _update_job(job, status=RUNNING, started_at=timezone.now().isoformat())
+    try:
+        df, sql_query, pagination, image_png = run_nl_query(
+            job["company_id"], query=job["query"], page_token=job["page_token"]
+        )
+        visualization_id = store_visualization(image_png, job["company_id"]) if image_png else None
+        payload = result_payload(df, job["query"], sql_query, pagination, None)
+        cache.set(
+            result_key(job_id),
+            {"payload": payload, "visualization_id": visualization_id, "arrow": dataframe_to_arrow(df)},
+            timeout=settings.NL_QUERY_JOB_TTL,
+        )
+        _update_job(job, status=SUCCEEDED, finished_at=timezone.now().isoformat())
+    except signing.BadSignature:
+        _update_job(job, status=FAILED, error="Invalid page token", finished_at=timezone.now().isoformat())
+    except UnsafeQueryError as e:
+        _update_job(job, status=FAILED, error=str(e), finished_at=timezone.now().isoformat())
+    except Exception as e:
+        print(f"NL query job {job_id} failed: {e}")
+        _update_job(job, status=FAILED, error=str(e), finished_at=timezone.now().isoformat())
+    finally:
+        release_job_slot(job["user_id"], job_id)
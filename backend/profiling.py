@@ -0,0 +1,120 @@
+import pandas as pd
+from django.conf import settings
+
+
+# Longest value shown in top values and sample rows
+MAX_VALUE_CHARS = 40
+
+
+def downcast(df):
+    """
+    Return df with numeric columns at their smallest dtype and repetitive
+    text columns (branches, sentiment labels) as categoricals
+    """
+
+    df = df.copy()
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object:
+            # Postgres numerics arrive as Decimal objects
+            try:
+                numeric = pd.to_numeric(series, errors="coerce")
+            except TypeError:
+                numeric = None
+            if numeric is not None and series.notna().any() and numeric.notna().sum() == series.notna().sum():
+                series = numeric
+        if pd.api.types.is_bool_dtype(series):
+            pass
+        elif pd.api.types.is_integer_dtype(series):
+            series = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series):
+            series = pd.to_numeric(series, downcast="float")
+        elif series.dtype == object:
+            try:
+                if series.nunique() <= len(series) // 2:
+                    series = series.astype("category")
+            except TypeError:
+                # Unhashable values such as JSON objects
+                series = series.astype(str)
+        df[column] = series
+    return df
+
+
+def profile_dataframe(df, capped=False):
+    """
+    Summarize a fetched result (at most NL_QUERY_MAX_ROWS rows) without
+    querying again
+
+    Returns:
+        {"row_count", "capped", "columns": [{"name", "kind", "non_null",
+        "distinct", "min", "max", "mean", "top"}]}
+    """
+
+    columns = downcast(df.iloc[:, :settings.VISUALIZATION_PROFILE_MAX_COLUMNS])
+
+    profile = {"row_count": len(df), "capped": capped, "columns": []}
+    for name in columns.columns:
+        series = columns[name]
+        column = {
+            "name": name,
+            "non_null": int(series.count()),
+            "distinct": int(series.nunique()),
+            "min": None,
+            "max": None,
+            "mean": None,
+            "top": [],
+        }
+        if pd.api.types.is_bool_dtype(series):
+            column["kind"] = "boolean"
+        elif pd.api.types.is_numeric_dtype(series):
+            column.update(kind="numeric", min=float(series.min()), max=float(series.max()), mean=float(series.mean()))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            column.update(kind="datetime", min=str(series.min()), max=str(series.max()))
+        else:
+            column["kind"] = "text"
+
+        if column["kind"] in ("text", "boolean"):
+            counts = series.dropna().astype(str).str.slice(0, MAX_VALUE_CHARS).value_counts()
+            column["top"] = list(counts.head(settings.VISUALIZATION_PROFILE_TOP_VALUES).items())
+        profile["columns"].append(column)
+    return profile
+
+
+def _number(value):
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def format_profile(profile, df):
+    """
+    Render a profile and a few sample rows for the visualization prompt,
+    in at most VISUALIZATION_PROMPT_MAX_CHARS characters
+    """
+
+    rows = f"ROWS: {profile['row_count']}"
+    if profile["capped"]:
+        rows += " (the result is capped at this many rows)"
+
+    lines = [rows, "", "COLUMNS:"]
+    for column in profile["columns"]:
+        line = (
+            f"- {column['name']} ({column['kind']}): "
+            f"{column['non_null']} non-null, {column['distinct']} distinct"
+        )
+        if column["min"] is not None:
+            line += f", min {_number(column['min'])}, max {_number(column['max'])}"
+        if column["mean"] is not None:
+            line += f", mean {_number(column['mean'])}"
+        if column["top"]:
+            line += "; top: " + ", ".join(f"{value} ({n})" for value, n in column["top"])
+        lines.append(line)
+
+    head = df.head(5).to_string(
+        max_cols=settings.VISUALIZATION_PROFILE_MAX_COLUMNS, max_colwidth=MAX_VALUE_CHARS
+    )
+    lines += ["", "SAMPLE ROWS:", head]
+
+    text = "\n".join(lines)
+    max_chars = settings.VISUALIZATION_PROMPT_MAX_CHARS
+    if len(text) > max_chars:
+        text = text[:max_chars] + "\n... (truncated)"
+    return text
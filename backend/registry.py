@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.models import Company
+
+
+COMPANY_CACHE_PREFIX = "company:instance"
+
+# instance_id -> (expires_at, company), per process
+_local_companies = {}
+
+
+def company_cache_key(instance_id):
+    return f"{COMPANY_CACHE_PREFIX}:{instance_id}"
+
+
+def get_company_by_instance_id(instance_id):
+    """
+    Return the company for a WhatsApp instance id, or None
+
+    Looks in a short-lived in-process cache first, then the shared cache,
+    and only then the database. Entries are dropped on Company save/delete
+    (see backend.signals); other processes pick the change up once their
+    local entry expires.
+    """
+
+    now = time.monotonic()
+    entry = _local_companies.get(instance_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    company = cache.get(company_cache_key(instance_id))
+    if company is None:
+        company = Company.objects.filter(instance_id=instance_id).first()
+        if company is None:
+            return None
+        cache.set(company_cache_key(instance_id), company, timeout=settings.COMPANY_CACHE_TIMEOUT)
+
+    _local_companies[instance_id] = (now + settings.COMPANY_LOCAL_CACHE_TIMEOUT, company)
+    return company
+
+
+def invalidate_company(instance_id):
+    _local_companies.pop(instance_id, None)
+    cache.delete(company_cache_key(instance_id))
@@ -0,0 +1,169 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Q
+
+from backend.models import ArchivedConversation, InboundMessage, Order, QuestionTemplate
+from backend.storage import (
+    COMPACT_AUDIO_DIR,
+    get_audio_storage,
+    local_audio_path,
+    transcode_audio,
+)
+
+
+def get_cold_storage():
+    return FileSystemStorage(location=settings.COLD_MEDIA_ROOT)
+
+
+def delete_audio_if_unreferenced(name):
+    # Content-addressed files can be shared by several questions and the
+    # inbound messages they came from
+    if (
+        name
+        and not QuestionTemplate.objects.filter(audio=name).exists()
+        and not InboundMessage.objects.filter(media=name).exists()
+    ):
+        get_audio_storage().delete(name)
+
+
+def move_audio_to_cold_storage(name, cold_storage):
+    """
+    Copy an audio file to cold storage and return its name there. The hot
+    copy is removed once the archive transaction commits, unless another
+    question still uses it.
+    """
+
+    audio_storage = get_audio_storage()
+    if not name or not audio_storage.exists(name):
+        return name
+
+    with audio_storage.open(name, "rb") as audio_file:
+        cold_name = cold_storage.save(name, audio_file)
+    transaction.on_commit(lambda: delete_audio_if_unreferenced(name))
+    return cold_name
+
+
+def archive_conversations(cutoff, batch_size):
+    """
+    Move the questions of up to `batch_size` orders placed before `cutoff`
+    into ArchivedConversation, and their audio to cold storage
+
+    Returns:
+        The number of orders archived
+    """
+
+    cold_storage = get_cold_storage()
+
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.filter(order_at__lt=cutoff, questions__isnull=False)
+            .order_by("order_at")
+            .values_list("id", flat=True)
+            .distinct()[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        questions = (
+            QuestionTemplate.objects.filter(order_id__in=order_ids)
+            .select_for_update()
+            .order_by("order_id", "priority")
+        )
+
+        archived = {}
+        for question in questions:
+            archived.setdefault(question.order_id, []).append(
+                {
+                    "question": question.question,
+                    "priority": question.priority,
+                    "answer": question.answer,
+                    "audio": move_audio_to_cold_storage(question.audio.name, cold_storage),
+                    "created_at": question.created_at.isoformat(),
+                    "updated_at": question.updated_at.isoformat(),
+                }
+            )
+
+        # An order may already have an archive if it was reviewed again after archiving
+        existing = {
+            archive.order_id: archive
+            for archive in ArchivedConversation.objects.filter(order_id__in=archived)
+        }
+        for order_id, archive in existing.items():
+            archive.questions = archive.questions + archived.pop(order_id)
+            archive.save(update_fields=["questions", "updated_at"])
+
+        ArchivedConversation.objects.bulk_create(
+            [
+                ArchivedConversation(order_id=order_id, questions=order_questions)
+                for order_id, order_questions in archived.items()
+            ]
+        )
+        QuestionTemplate.objects.filter(order_id__in=order_ids).delete()
+
+    return len(order_ids)
+
+
+def compact_audio(cutoff, policy, batch_size):
+    """
+    Apply the audio retention policy to voice notes transcribed before `cutoff`
+
+    Args:
+        cutoff: Only audio of questions last updated before this is touched
+        policy: "transcode" (re-encode as low-bitrate Opus) or "delete"
+        batch_size: Maximum number of distinct files handled
+
+    Returns:
+        The number of files compacted
+    """
+
+    names = list(
+        QuestionTemplate.objects.filter(updated_at__lt=cutoff)
+        .exclude(audio="")
+        .exclude(audio__isnull=True)
+        .exclude(Q(answer__isnull=True) | Q(answer=""))
+        .exclude(audio__startswith=COMPACT_AUDIO_DIR)
+        .values_list("audio", flat=True)
+        .distinct()[:batch_size]
+    )
+
+    audio_storage = get_audio_storage()
+    compacted = 0
+    for name in names:
+        # Questions sharing the clip that aren't transcribed yet, and inbound
+        # messages not processed yet, still need it
+        if QuestionTemplate.objects.filter(audio=name).filter(Q(answer__isnull=True) | Q(answer="")).exists():
+            continue
+        if InboundMessage.objects.filter(media=name, processed_at__isnull=True).exists():
+            continue
+
+        if policy == "delete":
+            QuestionTemplate.objects.filter(audio=name).update(audio="")
+            InboundMessage.objects.filter(media=name).update(media="")
+            audio_storage.delete(name)
+            compacted += 1
+            continue
+
+        field_file = QuestionTemplate.objects.filter(audio=name).first().audio
+        with local_audio_path(field_file) as path:
+            transcoded_path = transcode_audio(path)
+        if not transcoded_path:
+            continue
+
+        try:
+            with open(transcoded_path, "rb") as transcoded_file:
+                new_name = audio_storage.save(
+                    f"{COMPACT_AUDIO_DIR}/{os.path.basename(transcoded_path)}", File(transcoded_file)
+                )
+        finally:
+            os.remove(transcoded_path)
+
+        QuestionTemplate.objects.filter(audio=name).update(audio=new_name)
+        InboundMessage.objects.filter(media=name).update(media=new_name)
+        audio_storage.delete(name)
+        compacted += 1
+
+    return compacted
@@ -0,0 +1,364 @@
+import base64
+import collections
+import contextlib
+import json
+import os
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_runner.py")
+
+CodeRun = collections.namedtuple("CodeRun", ["pngs", "stdout", "stderr", "error"])
+
+
+class SandboxError(Exception):
+    pass
+
+
+class E2BSandbox:
+    """
+    Remote E2B code interpreter. Its kernel keeps state between runs, so
+    reset() clears variables, figures and uploaded files.
+    """
+
+    workdir = "/home/user"
+
+    RESET_CODE = "import matplotlib.pyplot as plt\nplt.close('all')\n%reset -f"
+
+    def __init__(self):
+        # Only processes that run visualizations load the E2B client
+        from e2b_code_interpreter import Sandbox
+
+        self._sandbox = Sandbox(api_key=settings.E2B_API_KEY, timeout=self._lifetime())
+        self._files = []
+
+    @staticmethod
+    def _lifetime():
+        # The remote sandbox must outlive the time it may idle in the pool
+        return settings.SANDBOX_IDLE_TIMEOUT + settings.SANDBOX_RUN_TIMEOUT
+
+    def is_healthy(self):
+        return self._sandbox.is_running()
+
+    def write_file(self, name, data):
+        path = f"{self.workdir}/{name}"
+        self._sandbox.files.write(path, data)
+        self._files.append(path)
+        return path
+
+    def run_code(self, code):
+        execution = self._sandbox.run_code(code, timeout=settings.SANDBOX_RUN_TIMEOUT)
+        error = None
+        if execution.error:
+            error = f"{execution.error.name}: {execution.error.value}\n{execution.error.traceback}"
+        return CodeRun(
+            pngs=[base64.b64decode(result.png) for result in execution.results if getattr(result, "png", None)],
+            stdout="".join(execution.logs.stdout),
+            stderr="".join(execution.logs.stderr),
+            error=error,
+        )
+
+    def reset(self):
+        self._sandbox.run_code(self.RESET_CODE, timeout=settings.SANDBOX_RUN_TIMEOUT)
+        for path in self._files:
+            self._sandbox.files.remove(path)
+        self._files = []
+        self._sandbox.set_timeout(self._lifetime())
+
+    def close(self):
+        self._sandbox.kill()
+
+
+class LocalSandbox:
+    """
+    Stand-in for E2B: a Python subprocess (backend/sandbox_runner.py) with
+    memory, CPU and file limits, its own temporary directory and no
+    environment secrets. For development and benchmarking; it is not an
+    isolation boundary.
+    """
+
+    def __init__(self):
+        self._base = tempfile.mkdtemp(prefix="sandbox-")
+        self.workdir = os.path.join(self._base, "work")
+        os.mkdir(self.workdir)
+
+        env = {
+            "PATH": os.environ.get("PATH", ""),
+            "HOME": self._base,
+            "MPLBACKEND": "Agg",
+            "MPLCONFIGDIR": os.path.join(self._base, "matplotlib"),
+            "OPENBLAS_NUM_THREADS": "1",
+            "OMP_NUM_THREADS": "1",
+        }
+        self._process = subprocess.Popen(
+            [
+                sys.executable,
+                RUNNER,
+                "--memory-mb", str(settings.LOCAL_SANDBOX_MEMORY_MB),
+                "--cpu-seconds", str(settings.LOCAL_SANDBOX_CPU_SECONDS),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.workdir,
+            env=env,
+            text=True,
+        )
+        # Returns once the runner has imported the data science stack
+        self._request({"op": "ping"}, timeout=settings.SANDBOX_START_TIMEOUT)
+
+    def _request(self, request, timeout):
+        try:
+            self._process.stdin.write(json.dumps(request) + "\n")
+            self._process.stdin.flush()
+            ready, _, _ = select.select([self._process.stdout], [], [], timeout)
+            line = self._process.stdout.readline() if ready else None
+        except (BrokenPipeError, OSError) as e:
+            self.close()
+            raise SandboxError(f"Local sandbox failed: {e}")
+
+        if not ready:
+            self.close()
+            raise SandboxError(f"Local sandbox did not answer within {timeout}s")
+        if not line:
+            self.close()
+            raise SandboxError("Local sandbox exited")
+        return json.loads(line)
+
+    def is_healthy(self):
+        if self._process.poll() is not None:
+            return False
+        try:
+            return self._request({"op": "ping"}, timeout=5)["ok"]
+        except SandboxError:
+            return False
+
+    def write_file(self, name, data):
+        path = os.path.join(self.workdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def run_code(self, code):
+        response = self._request({"op": "run", "code": code}, timeout=settings.SANDBOX_RUN_TIMEOUT)
+        return CodeRun(
+            pngs=[base64.b64decode(png) for png in response["pngs"]],
+            stdout=response["stdout"],
+            stderr=response["stderr"],
+            error=response["error"],
+        )
+
+    def reset(self):
+        self._request({"op": "reset"}, timeout=settings.SANDBOX_RUN_TIMEOUT)
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        shutil.rmtree(self._base, ignore_errors=True)
+
+
+SANDBOX_BACKENDS = {
+    "e2b": E2BSandbox,
+    "local": LocalSandbox,
+}
+
+
+class _Pooled:
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.uses = 0
+        self.idle_since = time.monotonic()
+        self.checked_at = time.monotonic()
+
+
+class SandboxPool:
+    """
+    Keeps up to `size` sandboxes warm for this process; leased sandboxes
+    count towards `size`, so sequential runs reuse the same sandbox.
+
+    A leased sandbox is reset in the background after use and goes back to
+    the pool, unless it failed or has served `max_uses` runs. Idle sandboxes
+    are health checked every `health_check_interval` seconds and closed after
+    `idle_timeout` seconds without use, so a quiet worker holds none.
+    """
+
+    def __init__(self, factory, size, idle_timeout, max_uses, health_check_interval):
+        self.factory = factory
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_uses = max_uses
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+
+        self._idle = collections.deque()
+        self._starting = 0
+        # Leased, or being reset or closed after a lease
+        self._leased = 0
+        self._lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap, name="sandbox-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _create(self):
+        try:
+            return _Pooled(self.factory())
+        finally:
+            with self._lock:
+                self._starting -= 1
+
+    def _close(self, pooled):
+        try:
+            pooled.sandbox.close()
+        except Exception as e:
+            print(f"Error closing sandbox: {e}")
+
+    def _add_idle(self, pooled):
+        pooled.idle_since = pooled.checked_at = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(pooled)
+                return
+        self._close(pooled)
+
+    def _fill(self):
+        try:
+            self._add_idle(self._create())
+        except Exception as e:
+            print(f"Error starting sandbox: {e}")
+
+    def warm(self):
+        """
+        Start sandboxes in the background until `size` are idle, starting
+        or leased
+        """
+
+        with self._lock:
+            missing = self.size - len(self._idle) - self._starting - self._leased
+            self._starting += max(missing, 0)
+        for _ in range(missing):
+            threading.Thread(target=self._fill, name="sandbox-pool-fill", daemon=True).start()
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self._starting += 1
+                    break
+                # Most recently used first, so surplus sandboxes age out
+                pooled = self._idle.pop()
+
+            if time.monotonic() - pooled.checked_at < self.health_check_interval or pooled.sandbox.is_healthy():
+                return pooled
+            self._close(pooled)
+
+        print("No warm sandbox available, starting one")
+        return self._create()
+
+    def _recycle(self, pooled):
+        try:
+            pooled.sandbox.reset()
+        except Exception as e:
+            print(f"Error resetting sandbox: {e}")
+            self._close(pooled)
+            return
+        self._add_idle(pooled)
+
+    def _release(self, pooled, reuse):
+        try:
+            if reuse:
+                self._recycle(pooled)
+            else:
+                self._close(pooled)
+        finally:
+            with self._lock:
+                self._leased -= 1
+        if not reuse:
+            self.warm()
+
+    @contextlib.contextmanager
+    def sandbox(self):
+        """
+        Lease a clean sandbox for the duration of the block
+        """
+
+        pooled = self._acquire()
+        with self._lock:
+            self._leased += 1
+        self.warm()
+        failed = True
+        try:
+            yield pooled.sandbox
+            failed = False
+        finally:
+            pooled.uses += 1
+            reuse = not failed and pooled.uses < self.max_uses
+            threading.Thread(target=self._release, args=(pooled, reuse), daemon=True).start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.health_check_interval, self.idle_timeout))
+            now = time.monotonic()
+            with self._lock:
+                expired = [pooled for pooled in self._idle if now - pooled.idle_since > self.idle_timeout]
+                due = [
+                    pooled for pooled in self._idle
+                    if pooled not in expired and now - pooled.checked_at > self.health_check_interval
+                ]
+                for pooled in expired + due:
+                    self._idle.remove(pooled)
+
+            for pooled in expired:
+                self._close(pooled)
+            for pooled in due:
+                if pooled.sandbox.is_healthy():
+                    pooled.checked_at = time.monotonic()
+                    with self._lock:
+                        if len(self._idle) < self.size:
+                            self._idle.appendleft(pooled)
+                            continue
+                    self._close(pooled)
+                else:
+                    print("Closing unhealthy sandbox")
+                    self._close(pooled)
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._close(pooled)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """
+    This process's pool of settings.SANDBOX_BACKEND sandboxes
+    """
+
+    global _pool
+    with _pool_lock:
+        # Threads don't survive a fork, so a forked child needs its own pool
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = SandboxPool(
+                SANDBOX_BACKENDS[settings.SANDBOX_BACKEND],
+                size=settings.SANDBOX_POOL_SIZE,
+                idle_timeout=settings.SANDBOX_IDLE_TIMEOUT,
+                max_uses=settings.SANDBOX_MAX_USES,
+                health_check_interval=settings.SANDBOX_HEALTH_CHECK_INTERVAL,
+            )
+        return _pool
@@ -0,0 +1,129 @@
+"""
+Child process of backend.sandbox.LocalSandbox. Not imported by Django.
+
+Reads one JSON request per line from stdin and writes one JSON response per
+line to the original stdout:
+
+    {"op": "ping"}              -> {"ok": true}
+    {"op": "run", "code": ...}  -> {"ok": true, "pngs": [base64...], "stdout": ..., "stderr": ..., "error": ...}
+    {"op": "reset"}             -> {"ok": true}
+
+Code runs in the process's working directory with a fresh namespace after
+every reset. Matplotlib figures left open by a run are returned as PNGs.
+
+    python sandbox_runner.py --memory-mb 1024 --cpu-seconds 300
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import traceback
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+# Preloaded so runs don't pay for the imports
+PRELOAD = ("numpy", "pandas", "matplotlib.pyplot", "seaborn")
+
+
+def limit_resources(memory_mb, cpu_seconds):
+    # Soft and hard limits are equal so the code can't raise them again.
+    # The CPU limit covers the whole process, which the pool recycles after
+    # SANDBOX_MAX_USES runs.
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (100 * 1024 * 1024, 100 * 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, 256))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def preload():
+    for module in PRELOAD:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+
+def open_figures():
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is None:
+        return []
+    return [pyplot.figure(number) for number in pyplot.get_fignums()]
+
+
+def close_figures():
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        pyplot.close("all")
+
+
+def run(code, namespace):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            exec(compile(code, "<sandbox>", "exec"), namespace)
+        except BaseException:
+            error = traceback.format_exc(limit=5)
+
+    pngs = []
+    for figure in open_figures():
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png", bbox_inches="tight")
+        pngs.append(base64.b64encode(buffer.getvalue()).decode())
+    return {"ok": True, "pngs": pngs, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "error": error}
+
+
+def reset(workdir):
+    close_figures()
+    for name in os.listdir(workdir):
+        path = os.path.join(workdir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    os.chdir(workdir)
+    return {"__name__": "__main__"}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-mb", type=int, required=True)
+    parser.add_argument("--cpu-seconds", type=int, required=True)
+    args = parser.parse_args()
+    limit_resources(args.memory_mb, args.cpu_seconds)
+
+    # Requests and responses use private copies of stdin and stdout, so
+    # code that reads stdin or prints can't corrupt them
+    requests = os.fdopen(os.dup(sys.stdin.fileno()))
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    workdir = os.getcwd()
+    preload()
+    namespace = reset(workdir)
+
+    for line in requests:
+        request = json.loads(line)
+        if request["op"] == "run":
+            response = run(request["code"], namespace)
+        elif request["op"] == "reset":
+            namespace = reset(workdir)
+            response = {"ok": True}
+        else:
+            response = {"ok": True}
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
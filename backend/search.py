@@ -0,0 +1,134 @@
+from datetime import date, datetime, time, timedelta
+from html import escape
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core import signing
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from backend.db_router import analytics_reads
+from backend.models import QuestionTemplate
+
+
+CURSOR_SALT = "backend.search.cursor"
+SEARCH_CONFIG = "english"
+MAX_QUERY_LENGTH = 200
+
+# Placeholders ts_headline puts around matches; replaced by <mark> tags
+# after the customer's text is HTML-escaped
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+
+def _highlight(snippet):
+    return (
+        escape(snippet)
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_STOP, "</mark>")
+    )
+
+
+def parse_search_params(query_params):
+    """
+    Validate the answer search query parameters; raises ValueError
+    """
+
+    q = (query_params.get("q") or "").strip()
+    if not q:
+        raise ValueError("q is required")
+    if len(q) > MAX_QUERY_LENGTH:
+        raise ValueError(f"q must be at most {MAX_QUERY_LENGTH} characters")
+
+    try:
+        start = date.fromisoformat(query_params["start"]) if query_params.get("start") else None
+        end = date.fromisoformat(query_params["end"]) if query_params.get("end") else None
+    except ValueError:
+        raise ValueError("start and end must be YYYY-MM-DD dates")
+    if start and end and start > end:
+        raise ValueError("start must not be after end")
+
+    return {
+        "q": q,
+        "start": start,
+        "end": end,
+        "branch": query_params.get("branch") or None,
+    }
+
+
+def search_answers(company_id, params, cursor=None, page_size=None):
+    """
+    Return (page, next cursor) of a company's answers matching params["q"]
+    (web search syntax: words, "quoted phrases", or, -exclusions), best
+    match first, with highlighted snippets
+
+    The cursor holds the (rank, id) of the last result, so pages don't
+    repeat or skip answers when new ones arrive.
+    """
+
+    page_size = page_size or settings.SEARCH_PAGE_SIZE
+    query = SearchQuery(params["q"], search_type="websearch", config=SEARCH_CONFIG)
+
+    answers = QuestionTemplate.objects.filter(order__company_id=company_id, search_vector=query)
+    if params["branch"]:
+        answers = answers.filter(order__branch_name=params["branch"])
+    if params["start"]:
+        answers = answers.filter(order__order_at__gte=timezone.make_aware(datetime.combine(params["start"], time.min)))
+    if params["end"]:
+        answers = answers.filter(
+            order__order_at__lt=timezone.make_aware(datetime.combine(params["end"] + timedelta(days=1), time.min))
+        )
+
+    # ts_rank is a real; as one its value doesn't survive the round trip
+    # through the cursor, so rank=<cursor rank> would never match
+    answers = answers.annotate(rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+    if cursor:
+        rank, last_id = signing.loads(cursor, salt=CURSOR_SALT)
+        answers = answers.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=last_id))
+
+    answers = answers.order_by("-rank", "-id").values(
+        "id",
+        "rank",
+        "question",
+        "order_id",
+        "order__number",
+        "order__branch_name",
+        "order__order_at",
+    )
+
+    with analytics_reads():
+        rows = list(answers[:page_size + 1])
+        # ts_headline re-parses each answer, so it only runs for the page
+        snippets = dict(
+            QuestionTemplate.objects.filter(id__in=[row["id"] for row in rows[:page_size]])
+            .annotate(
+                snippet=SearchHeadline(
+                    "answer",
+                    query,
+                    config=SEARCH_CONFIG,
+                    start_sel=HIGHLIGHT_START,
+                    stop_sel=HIGHLIGHT_STOP,
+                    max_fragments=2,
+                )
+            )
+            .values_list("id", "snippet")
+        )
+
+    page = [
+        {
+            "id": row["id"],
+            "order_id": row["order_id"],
+            "order_number": row["order__number"],
+            "branch": row["order__branch_name"],
+            "order_at": row["order__order_at"].isoformat(),
+            "question": row["question"],
+            "snippet": _highlight(snippets.get(row["id"]) or ""),
+            "rank": row["rank"],
+        }
+        for row in rows[:page_size]
+    ]
+    next_cursor = None
+    if len(rows) > page_size:
+        next_cursor = signing.dumps([page[-1]["rank"], page[-1]["id"]], salt=CURSOR_SALT)
+    return page, next_cursor
@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from backend.customers import get_customer, move_open_conversation
+from backend.helpers import get_review_due_at
+from backend.models import Company, Order
+from backend.registry import invalidate_company
+
+
+@receiver(pre_save, sender=Company)
+def remember_previous_instance_id(sender, instance, **kwargs):
+    instance._previous_instance_id = None
+    if instance.pk:
+        instance._previous_instance_id = (
+            Company.objects.filter(pk=instance.pk).values_list("instance_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company_cache(sender, instance, **kwargs):
+    invalidate_company(instance.instance_id)
+    previous_instance_id = getattr(instance, "_previous_instance_id", None)
+    if previous_instance_id and previous_instance_id != instance.instance_id:
+        invalidate_company(previous_instance_id)
+
+
+@receiver(post_init, sender=Order)
+@receiver(post_save, sender=Order)
+def remember_saved_phone_number(sender, instance, **kwargs):
+    # No query: the values as loaded or last saved, None for a new order
+    # or a deferred field
+    instance._saved_phone_number = instance.__dict__.get("customer_phone_number")
+    instance._saved_customer_id = instance.__dict__.get("customer_id")
+
+
+@receiver(pre_save, sender=Order)
+def attach_customer(sender, instance, **kwargs):
+    # Bulk ingestion skips signals and attaches customers with get_customers().
+    # The customer is only looked up for a new order or a changed number
+    if not instance.company_id or "customer_phone_number" in instance.get_deferred_fields():
+        return
+    if instance._state.adding:
+        if instance.customer_id is None:
+            instance.customer = get_customer(instance.company_id, instance.customer_phone_number)
+    elif instance.customer_phone_number != instance._saved_phone_number:
+        instance.customer = get_customer(instance.company_id, instance.customer_phone_number)
+        move_open_conversation(instance, instance._saved_customer_id)
+
+
+@receiver(pre_save, sender=Order)
+def schedule_review(sender, instance, **kwargs):
+    # Bulk ingestion skips signals and sets review_due_at itself. Orders
+    # without a customer (see attach_customer) can't receive replies
+    if instance._state.adding and instance.review_due_at is None and instance.customer_id:
+        instance.review_due_at = get_review_due_at(instance.order_at)
@@ -0,0 +1,115 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.helpers import classify_answer_sentiment
+from backend.utils import create_next_question_for_order
+
+
+# Answers classify_answer_sentiment can't place (mixed or long) are the
+# "mixed" class; they never get a template, so they most need a reply ready
+MIXED = "mixed"
+ANSWER_CLASSES = ("positive", "negative", "neutral", MIXED)
+
+SPECULATION_PREFIX = "speculation"
+HITS_KEY = f"{SPECULATION_PREFIX}:stats:hits"
+MISSES_KEY = f"{SPECULATION_PREFIX}:stats:misses"
+SAVED_MS_KEY = f"{SPECULATION_PREFIX}:stats:saved_ms"
+
+
+def speculation_key(question_id, answer_class):
+    return f"{SPECULATION_PREFIX}:{question_id}:{answer_class}"
+
+
+def _incr(key, amount=1):
+    # cache.incr raises if the key is missing
+    if not cache.add(key, amount, timeout=None):
+        cache.incr(key, amount)
+
+
+def classify_answer(answer):
+    return classify_answer_sentiment(answer) or MIXED
+
+
+def speculative_classes(conversation):
+    """
+    The answer classes whose reply to the pending question would come from
+    the LLM, because no template fits them
+    """
+
+    sentiments = conversation.answer_sentiments()
+    return [
+        answer_class
+        for answer_class in ANSWER_CLASSES
+        # A mixed answer has no sentiment of its own
+        if not conversation.template_reply(sentiments + [None if answer_class == MIXED else answer_class])
+    ]
+
+
+def pregenerate_replies(conversation):
+    """
+    Generate the next reply for each answer class while the customer is
+    still answering the pending question, and cache them. Only classes no
+    template answers are generated, as templates are used first.
+
+    Returns the number of replies stored.
+    """
+
+    pending = conversation.pending_question
+    if pending is None:
+        return 0
+
+    stored = 0
+    for answer_class in speculative_classes(conversation):
+        started_at = time.monotonic()
+        try:
+            reply = create_next_question_for_order(
+                conversation.questions, expected_tone=answer_class
+            )
+        except Exception as e:
+            print(f"Error pre-generating {answer_class} reply for question {pending.id}: {e}")
+            continue
+        generation_ms = int((time.monotonic() - started_at) * 1000)
+
+        if reply:
+            cache.set(
+                speculation_key(pending.id, answer_class),
+                {"reply": reply, "generation_ms": generation_ms},
+                timeout=settings.SPECULATIVE_REPLY_TIMEOUT,
+            )
+            stored += 1
+    return stored
+
+
+def take_speculative_reply(question):
+    """
+    Return the pre-generated reply matching the answer to `question`, or
+    None on a miss. Hits, misses and the generation time saved are counted.
+    """
+
+    entry = None
+    if question.answer:
+        entry = cache.get(speculation_key(question.id, classify_answer(question.answer)))
+
+    if not entry:
+        _incr(MISSES_KEY)
+        return None
+
+    cache.delete_many([speculation_key(question.id, c) for c in ANSWER_CLASSES])
+    _incr(HITS_KEY)
+    _incr(SAVED_MS_KEY, entry["generation_ms"])
+    return entry["reply"]
+
+
+def speculation_stats():
+    stats = cache.get_many([HITS_KEY, MISSES_KEY, SAVED_MS_KEY])
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        "latency_saved_ms": stats.get(SAVED_MS_KEY, 0),
+    }
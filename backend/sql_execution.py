@@ -0,0 +1,265 @@
+import contextlib
+import re
+
+import pandas as pd
+from django.conf import settings
+from django.core import signing
+from sqlalchemy import URL, create_engine, text
+
+
+# Role created in migration 0014; row-level security policies scope it to
+# the company set in the `servewell.company_id` setting.
+NL_QUERY_ROLE = "servewell_nl_reader"
+
+PAGE_TOKEN_SALT = "backend.nl_query.page"
+
+# Statements that could change the scope or the session from inside a query
+FORBIDDEN_SQL = re.compile(
+    r"\b(set_config|current_setting|set|reset|role|insert|update|delete|"
+    r"truncate|drop|alter|create|grant|revoke|copy|call|do|listen|notify)\b",
+    re.IGNORECASE,
+)
+
+# The row-level security scope is a setting the NL role could change with
+# set_config(), so generated SQL may only call these functions
+ALLOWED_FUNCTIONS = frozenset({
+    # Aggregates and window functions
+    "count", "sum", "avg", "min", "max", "stddev", "stddev_pop", "stddev_samp",
+    "variance", "var_pop", "var_samp", "corr", "bool_and", "bool_or", "every",
+    "string_agg", "array_agg", "json_agg", "jsonb_agg", "percentile_cont",
+    "percentile_disc", "mode", "row_number", "rank", "dense_rank", "percent_rank",
+    "cume_dist", "ntile", "lag", "lead", "first_value", "last_value", "nth_value",
+    "grouping",
+    # Conditionals and math
+    "coalesce", "nullif", "greatest", "least", "abs", "ceil", "ceiling", "floor",
+    "round", "trunc", "sign", "mod", "power", "sqrt", "exp", "ln", "log",
+    "width_bucket",
+    # Text
+    "lower", "upper", "initcap", "length", "char_length", "trim", "btrim",
+    "ltrim", "rtrim", "lpad", "rpad", "substring", "substr", "left", "right",
+    "position", "strpos", "replace", "concat", "concat_ws", "split_part",
+    "reverse", "string_to_array", "array_to_string",
+    # Dates
+    "now", "date", "date_part", "date_trunc", "extract", "age", "make_date",
+    "make_interval", "to_char", "to_date", "to_timestamp", "to_number",
+    "timezone", "justify_interval",
+    # JSON and arrays
+    "json_array_elements", "json_array_elements_text", "jsonb_array_elements",
+    "jsonb_array_elements_text", "json_array_length", "jsonb_array_length",
+    "json_extract_path_text", "jsonb_extract_path_text", "json_typeof",
+    "jsonb_typeof", "json_build_object", "jsonb_build_object", "unnest",
+    "array_length", "cardinality", "generate_series",
+    # Full-text search
+    "to_tsvector", "to_tsquery", "plainto_tsquery", "phraseto_tsquery",
+    "websearch_to_tsquery", "ts_rank", "ts_rank_cd", "ts_headline",
+})
+
+# Keywords and type names that can precede a parenthesis without a call
+SQL_KEYWORDS = frozenset({
+    "select", "from", "where", "and", "or", "not", "in", "exists", "any", "all",
+    "some", "as", "on", "join", "using", "values", "over", "filter", "within",
+    "cast", "case", "when", "then", "else", "by", "having", "limit", "offset",
+    "union", "intersect", "except", "lateral", "distinct", "is", "like", "ilike",
+    "between", "array", "row", "rollup", "cube", "sets", "materialized",
+    "interval", "numeric", "decimal", "varchar", "char", "character", "varying",
+    "timestamp", "time", "float", "zone",
+})
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+# A name followed by "(", and the keyword before it if the name is being
+# defined rather than called ("AS alias(column)", "WITH name(column)")
+FUNCTION_CALL = re.compile(r"(?:\b(as|with|recursive)\s+)?\b(\w+)\s*\(", re.IGNORECASE)
+
+
+class UnsafeQueryError(ValueError):
+    pass
+
+
+_engines = {}
+
+
+def database_url(alias):
+    """
+    SQLAlchemy URL of a Django database alias ("default" or "replica")
+    """
+
+    database = settings.DATABASES[alias]
+    return URL.create(
+        "postgresql+psycopg2",
+        username=database["USER"],
+        password=database["PASSWORD"],
+        host=database["HOST"],
+        port=int(database["PORT"]) if database["PORT"] else None,
+        database=database["NAME"],
+    )
+
+
+def get_engine(connection_url):
+    # One pooled engine per database per process instead of one per query
+    if connection_url not in _engines:
+        _engines[connection_url] = create_engine(connection_url, pool_pre_ping=True)
+    return _engines[connection_url]
+
+
+def validate_read_only_sql(sql_query):
+    """
+    Return the query without its trailing semicolon, or raise
+    UnsafeQueryError if it isn't a single SELECT statement that only calls
+    ALLOWED_FUNCTIONS
+    """
+
+    query = sql_query.strip().rstrip(";").strip()
+    if not re.match(r"^(select|with)\b", query, re.IGNORECASE):
+        raise UnsafeQueryError("Only SELECT queries can be run")
+    if ";" in query:
+        raise UnsafeQueryError("Only a single statement can be run")
+
+    # String literals may legitimately contain any word
+    without_literals = STRING_LITERAL.sub("''", query)
+    if "'" in STRING_LITERAL.sub("", without_literals):
+        raise UnsafeQueryError("The query has an unterminated string")
+    # Quoted and Unicode-escaped identifiers, escape strings, dollar quoting
+    # and comments can all hide a name from the checks below
+    if re.search(r'["$\\]|--|/\*', without_literals) or re.search(
+        r"(?<!\w)(u&|e'')", without_literals, re.IGNORECASE
+    ):
+        raise UnsafeQueryError("Quoted identifiers, escapes and comments aren't allowed")
+    if FORBIDDEN_SQL.search(without_literals):
+        raise UnsafeQueryError("The query uses a statement that isn't allowed")
+
+    for defining_keyword, name in FUNCTION_CALL.findall(without_literals):
+        name = name.lower()
+        if defining_keyword or name.isdigit() or name in SQL_KEYWORDS or name in ALLOWED_FUNCTIONS:
+            continue
+        raise UnsafeQueryError(f"The query calls {name}(), which isn't allowed")
+    return query
+
+
+def make_page_token(sql_query, company_id, offset):
+    return signing.dumps(
+        {"sql": sql_query, "company_id": company_id, "offset": offset},
+        salt=PAGE_TOKEN_SALT,
+    )
+
+
+def read_page_token(token, company_id):
+    """
+    Return (sql_query, offset) from a page token issued for `company_id`
+    """
+
+    payload = signing.loads(token, salt=PAGE_TOKEN_SALT, max_age=settings.NL_QUERY_PAGE_TOKEN_MAX_AGE)
+    if payload["company_id"] != company_id:
+        raise signing.BadSignature("Page token was issued for another company")
+    return payload["sql"], payload["offset"]
+
+
+@contextlib.contextmanager
+def scoped_connection(connection_url, company_id):
+    """
+    Open a read-only transaction as the restricted NL role, scoped to one
+    company and limited to NL_QUERY_STATEMENT_TIMEOUT_MS per statement
+    """
+
+    engine = get_engine(connection_url)
+    with engine.connect() as connection:
+        with connection.begin():
+            connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+            connection.execute(
+                text("SELECT set_config('servewell.company_id', :company_id, true)"),
+                {"company_id": str(company_id)},
+            )
+            connection.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true)"),
+                {"timeout": str(settings.NL_QUERY_STATEMENT_TIMEOUT_MS)},
+            )
+            connection.exec_driver_sql(f"SET LOCAL ROLE {NL_QUERY_ROLE}")
+            yield connection
+
+
+def _fetch_scoped(connection_url, query, company_id, limit, offset):
+    with scoped_connection(connection_url, company_id) as connection:
+        # Fetch one extra row to know whether there are more
+        result = connection.execution_options(stream_results=True).exec_driver_sql(
+            f"SELECT * FROM ({query}) AS nl_result LIMIT {limit + 1} OFFSET {int(offset)}"
+        )
+        columns = list(result.keys())
+        rows = result.fetchmany(limit + 1)
+        result.close()
+    return columns, rows
+
+
+def _page(sql_query, company_id, offset, rows, limit):
+    page_size = settings.NL_QUERY_PAGE_SIZE
+    max_rows = settings.NL_QUERY_MAX_ROWS
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_offset = offset + len(rows)
+    capped = has_more and next_offset >= max_rows
+
+    metadata = {
+        "offset": offset,
+        "page_size": page_size,
+        "row_count": len(rows),
+        "max_rows": max_rows,
+        "truncated": has_more,
+        "row_cap_reached": capped,
+        "next_page_token": (
+            make_page_token(sql_query, company_id, next_offset)
+            if has_more and not capped
+            else None
+        ),
+    }
+    return rows, metadata
+
+
+def execute_scoped_query(connection_url, sql_query, company_id, offset=0):
+    """
+    Run generated SQL as the restricted NL role, scoped to one company
+
+    Args:
+        connection_url: SQLAlchemy database URL
+        sql_query: The generated SELECT statement
+        company_id: Company whose rows are visible
+        offset: Row offset of the page to fetch
+
+    Returns:
+        A (DataFrame, metadata) tuple. metadata holds the page size, whether
+        the result was truncated and the token for the next page, if any.
+    """
+
+    query = validate_read_only_sql(sql_query)
+    # Never page past the hard cap
+    limit = max(min(settings.NL_QUERY_PAGE_SIZE, settings.NL_QUERY_MAX_ROWS - offset), 0)
+
+    columns, rows = _fetch_scoped(connection_url, query, company_id, limit, offset)
+    rows, metadata = _page(sql_query, company_id, offset, rows, limit)
+    return pd.DataFrame(rows, columns=columns), metadata
+
+
+def execute_scoped_result(connection_url, sql_query, company_id):
+    """
+    Like execute_scoped_query() for the first page, but the same query also
+    fetches the whole result up to NL_QUERY_MAX_ROWS rows, for the
+    visualization
+
+    Returns:
+        A (first page DataFrame, metadata, result DataFrame) tuple. metadata
+        also holds how many rows the result DataFrame has and whether the
+        result was cut at NL_QUERY_MAX_ROWS.
+    """
+
+    query = validate_read_only_sql(sql_query)
+    max_rows = settings.NL_QUERY_MAX_ROWS
+    limit = min(settings.NL_QUERY_PAGE_SIZE, max_rows)
+
+    columns, rows = _fetch_scoped(connection_url, query, company_id, max_rows, 0)
+    page_rows, metadata = _page(sql_query, company_id, 0, rows[:limit + 1], limit)
+    metadata["result_row_count"] = min(len(rows), max_rows)
+    metadata["result_capped"] = len(rows) > max_rows
+    return (
+        pd.DataFrame(page_rows, columns=columns),
+        metadata,
+        pd.DataFrame(rows[:max_rows], columns=columns),
+    )
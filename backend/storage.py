@@ -0,0 +1,125 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+# Transcoded audio is stored under this prefix so it isn't compacted twice
+COMPACT_AUDIO_DIR = "audio/compact"
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorageMixin:
+    """
+    Stores each file under the sha256 of its content, fanned out into
+    nested directories (audio/ab/cd/abcd....ogg). Saving content that is
+    already stored returns the existing name without writing anything.
+    """
+
+    fan_out_levels = 2
+
+    def hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        fan_out = [digest[i * 2:i * 2 + 2] for i in range(self.fan_out_levels)]
+        return "/".join([directory, *fan_out, f"{digest}{extension}"]).lstrip("/")
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.hashed_name(name, content_hash(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+class ContentAddressedFileSystemStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    pass
+
+
+_audio_storage = None
+
+
+def get_audio_storage():
+    """
+    Storage for voice notes, chosen by settings.AUDIO_STORAGE_BACKEND
+    ("filesystem" or "s3"; the latter needs django-storages and the AWS_* settings)
+    """
+
+    global _audio_storage
+    if _audio_storage is None:
+        if settings.AUDIO_STORAGE_BACKEND == "s3":
+            from storages.backends.s3 import S3Storage
+
+            class ContentAddressedS3Storage(ContentAddressedStorageMixin, S3Storage):
+                pass
+
+            _audio_storage = ContentAddressedS3Storage()
+        else:
+            _audio_storage = ContentAddressedFileSystemStorage()
+    return _audio_storage
+
+
+@contextlib.contextmanager
+def local_audio_path(field_file):
+    """
+    Yield a local filesystem path for a stored file, downloading it to a
+    temporary file when the storage is remote
+    """
+
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+
+    if path:
+        yield path
+        return
+
+    extension = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=extension) as temp_file:
+        with field_file.storage.open(field_file.name, "rb") as remote_file:
+            shutil.copyfileobj(remote_file, temp_file)
+        temp_file.flush()
+        yield temp_file.name
+
+
+def transcode_audio(source_path):
+    """
+    Re-encode a voice note as low-bitrate mono Opus with ffmpeg
+
+    Returns:
+        Path of a temporary .ogg file (the caller deletes it), or None on error
+    """
+
+    fd, output_path = tempfile.mkstemp(suffix=".ogg")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-loglevel", "error", "-i", source_path,
+                "-ac", "1", "-c:a", "libopus", "-b:a", settings.AUDIO_TRANSCODE_BITRATE,
+                output_path,
+            ],
+            check=True,
+            timeout=120,
+        )
+        return output_path
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Error transcoding {source_path}: {e}")
+        os.remove(output_path)
+        return None
@@ -1,9 +1,59 @@
+import json
 import streamlit as st
-import pandas as pd
+import pyarrow as pa
 import requests
 import time
 from datetime import datetime, timedelta
 
+ARROW_STREAM_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+JOBS_URL = "http://localhost:8000/api/generate_sql/jobs/"
+JOB_TIMEOUT_SECONDS = 300
+
+
+def read_arrow_response(response):
+    """Read an Arrow IPC query response into a DataFrame and its metadata"""
+    with pa.ipc.open_stream(response.content) as reader:
+        table = reader.read_all()
+    payload = json.loads(table.schema.metadata[b"servewell"])
+    return table.to_pandas(), payload
+
+
+def fetch_visualization(url, headers):
+    """Download the visualization PNG, or None if there isn't one"""
+    if not url:
+        return None
+    try:
+        response = requests.get(url, headers={"Authorization": headers["Authorization"]})
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException:
+        return None
+
+def run_query_job(prompt, headers):
+    """Submit the query as a job, wait for it and return the result response"""
+    response = requests.post(JOBS_URL, json={"query": prompt}, headers=headers)
+    if response.status_code == 429:
+        raise RuntimeError(response.json().get("error"))
+    response.raise_for_status()
+    job = response.json()
+
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    while job["status"] in ("queued", "running"):
+        if time.monotonic() > deadline:
+            raise RuntimeError("The query is taking too long, please try again later")
+        time.sleep(1)
+        response = requests.get(job["status_url"], headers=headers)
+        response.raise_for_status()
+        job = response.json()
+
+    if job["status"] == "failed":
+        raise RuntimeError(job["error"])
+
+    response = requests.get(job["result_url"], headers=headers)
+    response.raise_for_status()
+    return response
+
+
 def login(username, password):
     """Authenticate user and get JWT tokens"""
     try:
@@ -97,16 +147,16 @@ def main():
                     # Make authenticated API request
                     headers = {
                         "Authorization": f"Bearer {st.session_state.access_token}",
-                        "Content-Type": "application/json"
+                        "Content-Type": "application/json",
+                        "Accept": ARROW_STREAM_CONTENT_TYPE,
                     }
                     
-                    response = requests.post(
-                        "http://localhost:8000/api/generate_sql/",
-                        json={"query": prompt},
-                        headers=headers
-                    )
-                    
-                    if response.status_code == 401:
+                    try:
+                        response = run_query_job(prompt, headers)
+                    except requests.exceptions.HTTPError as e:
+                        if e.response is None or e.response.status_code != 401:
+                            raise
+
                         # Try token refresh if unauthorized
                         new_access_token = refresh_token(st.session_state.refresh_token)
                         if new_access_token:
@@ -115,11 +165,7 @@ def main():
                             
                             # Retry with new token
                             headers["Authorization"] = f"Bearer {new_access_token}"
-                            response = requests.post(
-                                "http://localhost:8000/generate_sql/",
-                                json={"query": prompt},
-                                headers=headers
-                            )
+                            response = run_query_job(prompt, headers)
                         else:
                             st.warning("Your session has expired. Please login again.")
                             st.session_state.authenticated = False
@@ -127,10 +173,9 @@ def main():
                             st.rerun()
                     
                     response.raise_for_status()
-                    data = response.json()
+                    df, data = read_arrow_response(response)
 
-                    old_data, image = data.get("data"), data.get("visualization")
-                    df = pd.DataFrame(old_data)
+                    image = fetch_visualization(data.get("visualization_url"), headers)
                     sql_query = data.get("sql_query")
 
                     assistant_response = f"**SQL Query:**\n```sql\n{sql_query}\n```"
@@ -1,239 +1,678 @@
-import base64
+import os
+import time
+from contextlib import ExitStack
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from datetime import timedelta
 
-from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
-from django.core.files.base import ContentFile
 
+from backend.aggregates import refresh_aggregates
+from backend.constants import WRAP_UP_PRIORITY
+from backend.conversation import Conversation, ConversationState
+from backend.customers import normalize_phone_number
+from backend.db_router import analytics_db, analytics_reads
 from backend.helpers import create_conversation, re_structure_orders
-from backend.models import Company, Order, QuestionTemplate, Analytics
+from backend.llm import LLMError
+from backend.models import Customer, InboundMessage, Order, QuestionTemplate, Analytics
+from backend.nl_jobs import run_job
+from backend.retention import archive_conversations, compact_audio
+from backend.storage import local_audio_path
+from backend.speculation import pregenerate_replies, speculative_classes
+from backend.transcription import transcribe_with_fallback
 from backend.utils import (
     send_whats_app_message,
     transcribe_audio_file,
     analyze_review_with_groq,
-    create_next_question_for_order,
 )
 
 
-@shared_task
+@shared_task(acks_late=True, soft_time_limit=50, time_limit=60)
 def start_review():
-    for company in Company.objects.all():
-        print("Executing task for company", company)
+    """
+    Invite customers to review orders whose invitation became due
+    (Order.review_due_at, set at ingest). Runs every minute and only reads
+    the due orders, through a partial index.
+    """
 
-        # Get orders older than 6 hours, ordered by customer then order date
-        orders = (
-            company.orders.filter(order_at__lte=timezone.now() - timedelta(hours=6))
-            .order_by("order_at")
-        )
+    now = timezone.now()
+    window_start = now - timedelta(days=settings.REVIEW_WINDOW_DAYS)
+    retry_at = now + timedelta(minutes=settings.REVIEW_RETRY_MINUTES)
+    invited = skipped = deferred = 0
+
+    while True:
+        question_ids = []
+        with transaction.atomic():
+            # skip_locked: an overlapping run takes the next batch instead of waiting
+            orders = list(
+                Order.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(review_due_at__lte=now)
+                .select_related("customer")
+                .prefetch_related("questions")
+                .order_by("review_due_at")[:settings.REVIEW_DISPATCH_BATCH_SIZE]
+            )
+            if not orders:
+                break
+
+            # Invited or never to be invited: the invitation is no longer due
+            done_ids = []
+            # The customer is reviewing another order: try again later
+            deferred_ids = []
+            # A customer is only in one review conversation at a time
+            busy_customers = set()
+            for order in orders:
+                customer = order.customer
+                conversation = Conversation(order, order.questions.all())
+                if (
+                    order.order_at < window_start
+                    or conversation.state != ConversationState.NOT_STARTED
+                    # Replies are matched by customer, so they would be dropped
+                    or customer is None
+                ):
+                    done_ids.append(order.id)
+                    skipped += 1
+                    continue
+                if (customer and customer.open_order_id not in (None, order.id)) or customer in busy_customers:
+                    deferred_ids.append(order.id)
+                    continue
+
+                conversation.advance()
+                conversation.save()
+                question_ids.append(conversation.pending_question.id)
+                done_ids.append(order.id)
+                if customer:
+                    busy_customers.add(customer)
+
+            Order.objects.filter(id__in=done_ids).update(review_due_at=None)
+            # Past the review window, start_review drops it as above
+            Order.objects.filter(id__in=deferred_ids).update(review_due_at=retry_at)
+            deferred += len(deferred_ids)
+
+        for question_id in question_ids:
+            send_question.delay(question_id)
+        invited += len(question_ids)
+
+    if invited or skipped or deferred:
+        print(f"Review invitations: {invited} queued, {deferred} deferred, {skipped} skipped")
+
+
+@shared_task(acks_late=True, soft_time_limit=30, time_limit=45)
+def send_question(question_id, send_count=0):
+    """
+    Send a pending question to the customer (outbound queue)
 
-        seen_customers = {}
-        for order in orders:
-            phone = order.customer_phone_number
-            if phone in seen_customers:
-                continue  # already found an uncompleted order for this customer
+    `send_count` is how many times the question had been sent when this send
+    was queued; a redelivered or duplicate task finds it changed and does nothing.
+    """
 
-            if not order.is_order_completed:
-                seen_customers[phone] = order
+    question = (
+        QuestionTemplate.objects.select_related("order__company")
+        .filter(id=question_id)
+        .first()
+    )
+    if not question or question.is_question_answered:
+        return
 
-        for order in seen_customers.values():
-            print("Processing order", order)
+    now = timezone.now()
+    claimed = QuestionTemplate.objects.filter(id=question_id, send_count=send_count).update(
+        send_count=F("send_count") + 1, sent_at=now, updated_at=now
+    )
+    if not claimed:
+        return
 
-            question_template = QuestionTemplate.objects.filter(
-                order=order,
-            ).exists()
+    order = question.order
+    company = order.company
+    send_whats_app_message(
+        company.instance_id,
+        company.api_token,
+        order.customer_phone_number,
+        question.question,
+    )
 
-            if not question_template:
-                QuestionTemplate.objects.create(
-                    order=order,
-                    question="Hi! We'd love to hear your thoughts — how was your experience at our restaurant?",
-                    priority=1,
-                )
-            print("Processing order", order)
-            latest_unanswered_question = (
-                QuestionTemplate.objects.filter(order=order)
-                .filter(Q(answer__isnull=True) | Q(answer=""))
-                .order_by("priority")
-                .first()
-            )
+    # Reminders repeat the same question, so the replies are already cached
+    if company.speculative_questions and send_count == 0:
+        pregenerate_next_questions.delay(order.id)
 
-            if latest_unanswered_question:
-                print("Sending question to", order.customer_phone_number)
-                send_whats_app_message(
-                    company.instance_id,
-                    company.api_token,
-                    order.customer_phone_number,
-                    latest_unanswered_question.question,
-                )
 
+@shared_task(acks_late=True, soft_time_limit=300, time_limit=330)
+def send_review_reminders():
+    """
+    Nudge customers who haven't answered the pending question, following
+    REVIEW_REMINDER_HOURS, and abandon conversations left unanswered for
+    CONVERSATION_EXPIRY_HOURS after the last reminder. Only open
+    conversations (Customer.open_order) are read.
+    """
 
-@shared_task
-def process_next_step_for_order(
-    message_sender_phone_number,
-    instance_id,
-    message_content,
-    message_type="chat",
-    media_type=None,
-    media_data=None,
-):
-    company = Company.objects.filter(instance_id=instance_id).first()
-    if not company:
-        return
+    now = timezone.now()
+    reminder_hours = settings.REVIEW_REMINDER_HOURS
+    expiry = timedelta(hours=settings.CONVERSATION_EXPIRY_HOURS)
+    reply_retry_after = timedelta(minutes=settings.CONVERSATION_REPLY_SWEEP_MINUTES)
+    reminders = abandoned = retried = 0
+
+    customers = (
+        Customer.objects.filter(open_order__isnull=False)
+        .select_related("open_order")
+        .prefetch_related("open_order__questions")
+        .order_by("id")
+    )
+    for customer in customers.iterator(chunk_size=500):
+        conversation = Conversation(customer.open_order, customer.open_order.questions.all())
+        if conversation.state == ConversationState.REPLY_DUE:
+            # An answer whose reply still failed after continue_conversation's retries
+            if (
+                not conversation.awaiting_transcript
+                and now - conversation.questions[-1].updated_at >= reply_retry_after
+            ):
+                continue_conversation.delay(customer.open_order_id)
+                retried += 1
+            continue
+        if conversation.state != ConversationState.AWAITING_ANSWER:
+            continue
 
-    orders = Order.objects.filter(
-        company=company,
-        customer_phone_number=message_sender_phone_number,
-    ).order_by("order_at")
+        question = conversation.pending_question
+        if not question.sent_at:
+            continue  # still queued for its first send
+
+        # send_count includes the first send
+        reminders_sent = question.send_count - 1
+        waited = now - question.sent_at
+        if reminders_sent < len(reminder_hours):
+            if waited >= timedelta(hours=reminder_hours[reminders_sent]):
+                send_question.delay(question.id, send_count=question.send_count)
+                reminders += 1
+        elif waited >= expiry:
+            conversation.abandon()
+            abandoned += 1
+
+    print(
+        f"Review reminders: {reminders} queued, {abandoned} conversations abandoned, "
+        f"{retried} replies retried"
+    )
 
-    order = None
-    for o in orders:
-        if not o.is_order_completed:
-            order = o
-            break
 
-    if not order:
+@shared_task(acks_late=True, soft_time_limit=300, time_limit=330)
+def run_nl_query_job(job_id):
+    """
+    Run a natural language query job (nl_query queue)
+    """
+
+    run_job(job_id)
+
+
+@shared_task(ignore_result=False)
+def ping():
+    """
+    No-op used by benchmarks/queue_latency.py to measure queue wait times
+    """
+
+    return time.time()
+
+
+@shared_task(acks_late=True)
+def busy_wait(seconds):
+    """
+    Occupies a worker for `seconds`; used by benchmarks/queue_latency.py to build a backlog
+    """
+
+    time.sleep(seconds)
+
+
+@shared_task(acks_late=True, soft_time_limit=60, time_limit=90)
+def process_next_step_for_order(inbound_message_id):
+    # Claim the message so a redelivered task doesn't record the answer twice
+    claimed = InboundMessage.objects.filter(
+        id=inbound_message_id, processed_at__isnull=True
+    ).update(processed_at=timezone.now())
+    if not claimed:
         return
 
-    # Get all unanswered questions for this order
-    unanswered_question = (
-        QuestionTemplate.objects.filter(order=order)
-        .filter(Q(answer__isnull=True) | Q(answer=""))
-        .filter(audio="")
-        .order_by("priority")
-    )
+    inbound_message = InboundMessage.objects.select_related("company").get(id=inbound_message_id)
+    company = inbound_message.company
+    message_type = inbound_message.message_type
 
-    if not unanswered_question.exists():
-        send_whats_app_message(
-            company.instance_id,
-            company.api_token,
-            order.customer_phone_number,
-            "We've already received all your responses. Thank you!",
+    # One indexed lookup of the customer's open conversation
+    customer = (
+        Customer.objects.filter(
+            company=company,
+            phone_number=normalize_phone_number(inbound_message.sender_phone_number),
+            open_order__isnull=False,
         )
+        .select_related("open_order")
+        .prefetch_related("open_order__questions")
+        .first()
+    )
+    if not customer:
+        return
+
+    open_order = customer.open_order
+    conversation = Conversation(
+        open_order, open_order.questions.all(), speculative=company.speculative_questions
+    )
+    if conversation.state not in (ConversationState.AWAITING_ANSWER, ConversationState.REPLY_DUE):
+        return
+
+    order = conversation.order
+
+    if conversation.state == ConversationState.REPLY_DUE:
+        # The reply to the last answer is still coming (being retried, or the
+        # voice note waits for its transcript). Text adds to that answer, so
+        # the reply covers it; anything else waits for the next question.
+        answered = conversation.questions[-1]
+        if message_type == "chat" and not conversation.awaiting_transcript:
+            conversation.record_answer(answered, f"{answered.answer}\n{inbound_message.content}")
+            conversation.save()
+        elif inbound_message.created_at > timezone.now() - timedelta(hours=settings.CONVERSATION_EXPIRY_HOURS):
+            InboundMessage.objects.filter(id=inbound_message_id).update(processed_at=None)
+            process_next_step_for_order.apply_async(
+                (inbound_message_id,), countdown=settings.CONVERSATION_REPLY_RETRY_DELAY
+            )
+        else:
+            print(f"Dropping message {inbound_message_id}: order {order.number} never got its reply")
         return
 
     # Get the first unanswered question
-    latest_unanswered_question = unanswered_question.first()
+    latest_unanswered_question = conversation.pending_question
 
     # Handle different types of messages
     if message_type == "chat":
         # Handle text message
-        latest_unanswered_question.answer = message_content
-        latest_unanswered_question.save()
+        conversation.record_answer(latest_unanswered_question, inbound_message.content)
+
+    elif message_type == "ptt" and inbound_message.media:
+        # Handle audio message, already stored by the webhook. Transcription
+        # runs on the media queue, which hands back to continue_conversation
+        conversation.record_audio(latest_unanswered_question, inbound_message.media.name)
+        conversation.save()
+        transcribe_answer.delay(latest_unanswered_question.id)
+        return
 
-    elif message_type == "ptt" and media_data:
-        # Handle audio message
-        try:
-            # Decode base64 data
-            audio_content = base64.b64decode(media_data)
+    # The message is claimed, so the answer is written before the reply is
+    # generated: a failed LLM call must not lose it
+    conversation.save()
 
-            # Generate a filename with timestamp
-            timestamp = timezone.now().strftime("%Y%m%d%H%M%S")
-            extension = "ogg" if "ogg" in media_type else "mp3"
-            filename = f"audio_{order.id}_{latest_unanswered_question.id}_{timestamp}.{extension}"
+    try:
+        reply_to_answer(conversation, company)
+    except (LLMError, SoftTimeLimitExceeded) as e:
+        print(f"Error replying to order {order.number}, retrying: {e}")
+        continue_conversation.apply_async((order.id,), countdown=settings.CONVERSATION_REPLY_RETRY_DELAY)
+
+
+def reply_to_answer(conversation, company):
+    """
+    Send the next question, or the wrap-up, of a conversation whose latest
+    answer is saved. Raises LLMError when no template fits and generation fails.
+    """
+
+    order = conversation.order
+
+    # Reply from the template library (or the LLM when nothing fits)
+    reply = conversation.advance()
+    if not reply:
+        reply = "Thank you for your responses."
+
+    # Replies added to the conversation are sent right away
+    if conversation.questions[-1].pk is None:
+        conversation.mark_sent(conversation.questions[-1])
+
+    conversation.save()
+
+    send_whats_app_message(
+        company.instance_id,
+        company.api_token,
+        order.customer_phone_number,
+        reply,
+    )
+
+    if conversation.state == ConversationState.COMPLETED:
+        analyze_order_sentiment.delay(order.id)
+    elif (
+        company.speculative_questions
+        and conversation.state == ConversationState.AWAITING_ANSWER
+        and speculative_classes(conversation)
+    ):
+        pregenerate_next_questions.delay(order.id)
 
-            # Save the file to the audio field
-            latest_unanswered_question.audio.save(
-                filename, ContentFile(audio_content), save=True
-            )
-            print(
-                f"Saved audio response for order {order.number}, question {latest_unanswered_question.question}"
-            )
 
-            # Transcribe the audio file
-            file_path = latest_unanswered_question.audio.path
+@shared_task(acks_late=True, soft_time_limit=120, time_limit=150)
+def transcribe_answer(question_id):
+    """
+    Transcribe a voice note answer (media queue), then queue the reply on the
+    conversation queue. A failed transcription is left to transcribe_pending_audio.
+    """
 
-            transcribed_text = transcribe_audio_file(file_path, language="english")
-            if transcribed_text:
-                latest_unanswered_question.answer = transcribed_text
-                latest_unanswered_question.save()
+    question = QuestionTemplate.objects.select_related("order__company").filter(id=question_id).first()
+    if not question or not question.audio:
+        return
 
+    if not question.answer:
+        try:
+            with local_audio_path(question.audio) as file_path:
+                transcribed_text = transcribe_audio_file(
+                    file_path, language="english", backend=question.order.company.transcription_backend
+                )
         except Exception as e:
             print(f"Error processing audio file: {e}")
             return
+        if not transcribed_text:
+            return
+        question.answer = transcribed_text
+        question.save(update_fields=["answer", "updated_at"])
 
-    # Try to create next question
-    questions = QuestionTemplate.objects.filter(order=order)
-    latest_priority = latest_unanswered_question.priority + 1
-    next_question = create_next_question_for_order(questions)
-    if next_question:
-        if latest_priority == 4:
-            QuestionTemplate.objects.create(
-                order=order,
-                question=next_question,
-                answer="N/A",
-                priority=latest_priority,
-            )
-            send_whats_app_message(
-                company.instance_id,
-                company.api_token,
-                order.customer_phone_number,
-                next_question,
-            )            
-            return # No more questions to ask
-        else:
-            QuestionTemplate.objects.create(
-                order=order,
-                question=next_question,
-                priority=latest_priority,
-            )
+    continue_conversation.delay(question.order_id)
 
-    # Check if there are more questions to ask
-    remaining_questions = (
-        QuestionTemplate.objects.filter(order=order)
-        .filter(Q(answer__isnull=True) | Q(answer=""))
-        .filter(audio="")
-        .order_by("priority")
-        .exclude(id=latest_unanswered_question.id)
+
+def conversation_reply_lock_key(order_id):
+    return f"conversation:reply:{order_id}"
+
+
+@shared_task(
+    acks_late=True,
+    soft_time_limit=60,
+    time_limit=90,
+    autoretry_for=(LLMError, SoftTimeLimitExceeded),
+    retry_backoff=30,
+    max_retries=5,
+)
+def continue_conversation(order_id):
+    """
+    Reply to a saved answer whose reply failed (conversation queue). Does
+    nothing once the conversation has moved on, so duplicates are harmless.
+    """
+
+    lock_key = conversation_reply_lock_key(order_id)
+    if not cache.add(lock_key, 1, timeout=90):
+        return
+    try:
+        order = Order.objects.select_related("company").filter(id=order_id).first()
+        if not order:
+            return
+        conversation = Conversation(order, speculative=order.company.speculative_questions)
+        if conversation.state != ConversationState.REPLY_DUE or conversation.awaiting_transcript:
+            return
+        reply_to_answer(conversation, order.company)
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task(soft_time_limit=120, time_limit=150)
+def pregenerate_next_questions(order_id):
+    """
+    Speculatively generate the follow-up for each answer class while the
+    customer is still answering
+    """
+
+    order = Order.objects.filter(id=order_id).first()
+    if not order:
+        return
+
+    conversation = Conversation(order)
+    if conversation.state != ConversationState.AWAITING_ANSWER:
+        return
+
+    stored = pregenerate_replies(conversation)
+    print(f"Pre-generated {stored} replies for order {order.number}")
+
+
+ANALYSIS_WATERMARK_KEY = "analysis:watermark"
+
+
+def analysis_lock_key(order_id):
+    return f"analysis:order:{order_id}"
+
+
+def analyze_orders(order_ids):
+    """
+    Analyze the conversations of the given orders and save the results to Analytics model
+
+    Returns the ids of orders that are still unanalyzed because the
+    analysis failed or another worker is running it.
+    """
+
+    orders = (
+        Order.objects.filter(id__in=order_ids)
+        .order_by("-order_at", "id", "questions__priority")
+        .values("id", "company_id", "questions__answer", "questions__question", "questions__priority")
     )
 
-    if remaining_questions.exists():
-        next_unanswered_question = remaining_questions.first()
-        send_whats_app_message(
-            company.instance_id,
-            company.api_token,
-            order.customer_phone_number,
-            next_unanswered_question.question,
+    orders_dict = re_structure_orders(orders)
+
+    unanalyzed = []
+    for order_id, questions in orders_dict.items():
+        # Keeps two workers from paying for the same analysis at once. It is
+        # released when the analysis ends, and only outlives a killed worker
+        # by ANALYSIS_LOCK_TIMEOUT; the unique constraint is the real dedup.
+        lock_key = analysis_lock_key(order_id)
+        if not cache.add(lock_key, 1, timeout=settings.ANALYSIS_LOCK_TIMEOUT):
+            unanalyzed.append(order_id)
+            continue
+
+        try:
+            if Analytics.objects.filter(order_id=order_id).exists():
+                continue
+
+            conversation = create_conversation(questions)
+            analysis = analyze_review_with_groq(conversation, company_id=questions[0]["company_id"])
+
+            if "error" in analysis:
+                print(f"Error occurred while generating analysis for order {order_id}")
+                print(f"Error {analysis}")
+                unanalyzed.append(order_id)
+                continue
+
+            Analytics.objects.get_or_create(
+                order_id=order_id,
+                defaults={
+                    "sentiment_label": analysis.get("sentiment"),
+                    "emotions": analysis.get("emotions", []),
+                    "extracted_keywords": analysis.get("keywords", []),
+                    "products": analysis.get("product_name", []),
+                },
+            )
+            print(f"Analytics created for order {order_id}")
+        finally:
+            cache.delete(lock_key)
+
+    return unanalyzed
+
+
+@shared_task(acks_late=True, soft_time_limit=120, time_limit=150)
+def analyze_order_sentiment(order_id):
+    """
+    Analyze a single order as soon as its conversation is completed
+    """
+
+    # Completion events, redeliveries and the catch-up sweep may all ask
+    if Analytics.objects.filter(order_id=order_id).exists():
+        return
+
+    analyze_orders([order_id])
+
+
+@shared_task(acks_late=True, soft_time_limit=1800, time_limit=1860)
+def analyze_orders_sentiment():
+    """
+    Catch-up sweep for completed conversations that weren't analyzed when they
+    finished. Only conversations wrapped up since the last sweep are checked.
+    """
+
+    sweep_started_at = timezone.now()
+    oldest = sweep_started_at - timedelta(days=settings.ANALYSIS_CATCH_UP_LOOKBACK_DAYS)
+    since = cache.get(ANALYSIS_WATERMARK_KEY) or oldest
+
+    # The sweep reads from the replica when it is healthy; the next sweep
+    # starts early enough to see rows that hadn't been replicated yet
+    with analytics_reads():
+        if analytics_db() != "default":
+            sweep_started_at -= timedelta(seconds=settings.REPLICA_MAX_LAG_SECONDS)
+
+        completed_at = {}
+        for order_id, updated_at in QuestionTemplate.objects.filter(
+            priority__gte=WRAP_UP_PRIORITY, updated_at__gt=since
+        ).values_list("order_id", "updated_at"):
+            completed_at[order_id] = min(updated_at, completed_at.get(order_id, updated_at))
+        analyzed_order_ids = set(
+            Analytics.objects.filter(order_id__in=completed_at).values_list("order_id", flat=True)
         )
-    else:
-        send_whats_app_message(
-            company.instance_id,
-            company.api_token,
-            order.customer_phone_number,
-            "Thank you for your responses.",
+
+    pending_order_ids = sorted(set(completed_at) - analyzed_order_ids)
+    print(f"Catching up analysis for {len(pending_order_ids)} orders since {since}")
+    unanalyzed = analyze_orders(pending_order_ids)
+
+    # Orders that failed or were being analyzed elsewhere stay inside the
+    # next sweep's window, up to the lookback limit
+    watermark = sweep_started_at
+    if unanalyzed:
+        print(f"{len(unanalyzed)} orders left for the next sweep")
+        earliest = min(completed_at[order_id] for order_id in unanalyzed)
+        watermark = max(min(watermark, earliest - timedelta(microseconds=1)), oldest)
+    cache.set(ANALYSIS_WATERMARK_KEY, watermark, timeout=None)
+
+
+AGGREGATES_WATERMARK_KEY = "analytics:aggregates:watermark"
+
+
+@shared_task(acks_late=True, soft_time_limit=600, time_limit=660)
+def refresh_analytics_aggregates():
+    """
+    Rebuild the dashboard aggregates of the days whose conversations or
+    analyses changed since the last run
+    """
+
+    refresh_started_at = timezone.now()
+    with analytics_reads():
+        if analytics_db() != "default":
+            refresh_started_at -= timedelta(seconds=settings.REPLICA_MAX_LAG_SECONDS)
+        since = cache.get(AGGREGATES_WATERMARK_KEY) or (
+            refresh_started_at - timedelta(days=settings.ANALYTICS_REFRESH_LOOKBACK_DAYS)
         )
+        rebuilt = refresh_aggregates(since)
 
+    cache.set(AGGREGATES_WATERMARK_KEY, refresh_started_at, timeout=None)
+    print(f"Rebuilt analytics aggregates for {rebuilt} company-days changed since {since}")
 
-@shared_task
-def analyze_orders_sentiment():
+
+@shared_task(acks_late=True, soft_time_limit=900, time_limit=960)
+def transcribe_pending_audio():
     """
-    Analyze customer feedback for an order and save the results to Analytics model
+    Transcribe voice notes that were saved without a transcript (e.g. because
+    the provider was down), in batches per company transcription backend.
+    Clips that failed TRANSCRIPTION_MAX_ATTEMPTS times, or whose question is
+    older than TRANSCRIPTION_PENDING_MAX_AGE_HOURS, are no longer retried.
     """
 
-    # Find orders with no analytics records
-    orders_with_analytics = Analytics.objects.values_list("order_id", flat=True)
-    orders_without_analytics = (
-        Order.objects.exclude(id__in=orders_with_analytics)
-        .select_related("questions")
-        .order_by("-order_at", "id", "questions__priority")
-        .values("id", "questions__answer", "questions__question", "questions__priority")
+    oldest = timezone.now() - timedelta(hours=settings.TRANSCRIPTION_PENDING_MAX_AGE_HOURS)
+    pending_questions = (
+        QuestionTemplate.objects.exclude(audio="")
+        .exclude(audio__isnull=True)
+        .filter(Q(answer__isnull=True) | Q(answer=""))
+        .filter(created_at__gte=oldest, transcription_attempts__lt=settings.TRANSCRIPTION_MAX_ATTEMPTS)
+        .select_related("order__company")
+        .order_by("id")
     )
 
-    orders_dict = re_structure_orders(orders_without_analytics)
+    questions_by_backend = {}
+    for question in pending_questions:
+        backend = question.order.company.transcription_backend
+        questions_by_backend.setdefault(backend, []).append(question)
+
+    batch_size = settings.TRANSCRIPTION_BATCH_SIZE
+    for backend, questions in questions_by_backend.items():
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            with ExitStack() as stack:
+                texts = transcribe_clips(stack, batch, backend)
+
+            failed_ids = []
+            for question, text in zip(batch, texts):
+                if text:
+                    question.answer = text
+                    question.save(update_fields=["answer", "updated_at"])
+                    # Replies to answers that were waiting for their transcript
+                    continue_conversation.delay(question.order_id)
+                else:
+                    failed_ids.append(question.id)
+            QuestionTemplate.objects.filter(id__in=failed_ids).update(
+                transcription_attempts=F("transcription_attempts") + 1
+            )
+            print(f"Transcribed {len(batch) - len(failed_ids)}/{len(batch)} clips with {backend}")
 
-    for order_id, questions in orders_dict.items():
-        conversation = create_conversation(questions)
-        analysis = analyze_review_with_groq(conversation)
 
-        if "error" in analysis:
-            print(f"Error occurred while generating analysis for order {order_id}")
-            print(f"Error {analysis}")
+def transcribe_clips(stack, questions, backend):
+    """
+    Transcribe the voice notes of `questions` in one batch, opening their
+    files on `stack`. A clip that can't be read, or that breaks the batch,
+    gets None instead of failing the others.
+    """
+
+    paths = {}
+    for question in questions:
+        try:
+            path = stack.enter_context(local_audio_path(question.audio))
+            os.stat(path)
+        except Exception as e:
+            print(f"Error reading audio of question {question.id}: {e}")
             continue
+        paths[question.id] = path
+
+    readable = list(paths.values())
+    try:
+        texts = dict(zip(paths, transcribe_with_fallback(readable, language="english", backend_name=backend)))
+    except Exception as e:
+        print(f"Error transcribing a batch of {len(readable)} clips, retrying one by one: {e}")
+        texts = {}
+        for question_id, path in paths.items():
+            try:
+                texts[question_id] = transcribe_with_fallback([path], language="english", backend_name=backend)[0]
+            except Exception as e:
+                print(f"Error transcribing audio of question {question_id}: {e}")
+    return [texts.get(question.id) for question in questions]
+
+
+@shared_task(acks_late=True, soft_time_limit=1800, time_limit=1860)
+def archive_old_conversations():
+    """
+    Move conversations older than the retention period out of the hot tables, in batches
+    """
 
-        Analytics.objects.create(
-            order_id=order_id,
-            sentiment_label=analysis.get("sentiment"),
-            emotions=analysis.get("emotions", []),
-            extracted_keywords=analysis.get("keywords", []),
-            products=analysis.get("product_name", []),
-        )
-        print(f"Analytics created for order {order_id}")
+    cutoff = timezone.now() - timedelta(days=settings.CONVERSATION_RETENTION_DAYS)
+    total = 0
+    for _ in range(settings.ARCHIVE_MAX_BATCHES_PER_RUN):
+        archived = archive_conversations(cutoff, settings.ARCHIVE_BATCH_SIZE)
+        total += archived
+        if archived < settings.ARCHIVE_BATCH_SIZE:
+            break
+    print(f"Archived conversations of {total} orders placed before {cutoff}")
+
+
+@shared_task(acks_late=True, soft_time_limit=1800, time_limit=1860)
+def compact_transcribed_audio():
+    """
+    Transcode or delete voice notes that were transcribed more than
+    AUDIO_RETENTION_DAYS ago, according to AUDIO_RETENTION_POLICY
+    """
+
+    policy = settings.AUDIO_RETENTION_POLICY
+    if policy not in ("transcode", "delete"):
+        return
+
+    cutoff = timezone.now() - timedelta(days=settings.AUDIO_RETENTION_DAYS)
+    compacted = compact_audio(cutoff, policy, settings.AUDIO_COMPACT_BATCH_SIZE)
+    print(f"Compacted ({policy}) {compacted} audio files transcribed before {cutoff}")
+
+
+@shared_task(acks_late=True, soft_time_limit=600, time_limit=660)
+def prune_inbound_messages():
+    """
+    Delete processed inbound messages past INBOUND_MESSAGE_RETENTION_DAYS.
+    Voice notes stay in storage, they're referenced by the questions.
+    """
+
+    cutoff = timezone.now() - timedelta(days=settings.INBOUND_MESSAGE_RETENTION_DAYS)
+    deleted, _ = InboundMessage.objects.filter(
+        processed_at__isnull=False, created_at__lt=cutoff
+    ).delete()
+    print(f"Deleted {deleted} inbound messages received before {cutoff}")
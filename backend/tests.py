@@ -1,3 +1,1063 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+import requests
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from backend.aggregates import build_day_aggregates, changed_days
+from backend.constants import FOLLOW_UP_TEMPLATES, OPENING_QUESTION, WRAP_UP_PRIORITY, WRAP_UP_TEMPLATES
+from backend.conversation import Conversation, ConversationState
+from backend.customers import normalize_phone_number
+from backend.db_router import REPLICA_LAG_CACHE_KEY, ReplicaRouter, analytics_reads, replica_lag
+from backend.ingestion import ingest_orders, validate_order
+from backend.llm import LLMBudgetExceeded, LLMError, chat_completion, usage_stats
+from backend.models import (
+    Analytics,
+    ArchivedConversation,
+    Company,
+    Customer,
+    InboundMessage,
+    Order,
+    QuestionTemplate,
+)
+from backend.nl_jobs import FAILED, RUNNING, SUCCEEDED, create_job, get_job, job_key, run_job
+from backend.profiling import format_profile, profile_dataframe
+from backend.registry import _local_companies, get_company_by_instance_id
+from backend.sandbox import SandboxPool
+from backend.search import parse_search_params, search_answers
+from backend.speculation import MIXED, pregenerate_replies, speculation_stats, speculative_classes
+from backend.sql_execution import UnsafeQueryError, validate_read_only_sql
+from backend.tasks import process_next_step_for_order, transcribe_pending_audio
+
+
+class ValidateReadOnlySqlTests(SimpleTestCase):
+    def assertRejected(self, sql_query):
+        with self.assertRaises(UnsafeQueryError):
+            validate_read_only_sql(sql_query)
+
+    def test_accepts_select_with_allowed_functions(self):
+        query = (
+            "SELECT o.branch_name, date_trunc('month', o.order_at) AS month, count(*) AS orders, "
+            "round(avg(a.score)::numeric(10, 2), 2) FROM backend_order o "
+            "JOIN backend_analytics a ON a.order_id = o.id "
+            "WHERE o.order_at >= now() - interval '30 days' GROUP BY 1, 2 ORDER BY 2;"
+        )
+        self.assertEqual(validate_read_only_sql(query), query.rstrip(";"))
+
+    def test_accepts_cte_and_table_alias_column_lists(self):
+        validate_read_only_sql(
+            "WITH recent AS (SELECT id FROM backend_order) "
+            "SELECT p FROM recent, unnest(ARRAY[1, 2]) AS t(p)"
+        )
+
+    def test_accepts_forbidden_words_inside_string_literals(self):
+        validate_read_only_sql("SELECT id FROM backend_questiontemplate WHERE answer = 'please set_config(it''s)'")
+
+    def test_accepts_full_text_search(self):
+        validate_read_only_sql(
+            "SELECT id FROM backend_questiontemplate "
+            "WHERE search_vector @@ websearch_to_tsquery('english', 'cold fries')"
+        )
+
+    def test_rejects_writes_and_multiple_statements(self):
+        self.assertRejected("DELETE FROM backend_order")
+        self.assertRejected("SELECT 1; DELETE FROM backend_order")
+        self.assertRejected("WITH d AS (DELETE FROM backend_order RETURNING id) SELECT * FROM d")
+
+    def test_rejects_set_config(self):
+        self.assertRejected("SELECT set_config('servewell.company_id', '2', true)")
+        self.assertRejected("SELECT pg_catalog.set_config ('servewell.company_id', '2', true)")
+
+    def test_rejects_unicode_escaped_identifier(self):
+        self.assertRejected(
+            "SELECT U&\"\\0073et_config\"('servewell.company_id', '2', true), * FROM backend_order"
+        )
+        self.assertRejected("SELECT u&'\\0041' FROM backend_order")
+
+    def test_rejects_quoted_identifiers(self):
+        self.assertRejected("SELECT \"set_config\"('servewell.company_id', '2', true)")
+        self.assertRejected('SELECT "id" FROM backend_order')
+
+    def test_rejects_escape_strings_dollar_quotes_and_comments(self):
+        # E'\'' would end the literal where the plain literal syntax doesn't
+        self.assertRejected("SELECT E'\\'' , set_config('servewell.company_id', '2', true), ''")
+        self.assertRejected("SELECT $$x$$")
+        self.assertRejected("SELECT id FROM backend_order -- comment")
+        self.assertRejected("SELECT id /* comment */ FROM backend_order")
+
+    def test_rejects_unterminated_string(self):
+        self.assertRejected("SELECT 'abc FROM backend_order")
+
+    def test_rejects_functions_not_on_the_allow_list(self):
+        self.assertRejected("SELECT pg_sleep(10)")
+        self.assertRejected("SELECT pg_read_file('/etc/passwd')")
+        self.assertRejected("SELECT * FROM dblink('host=x', 'SELECT 1') AS t(a int)")
+
+
+class NormalizePhoneNumberTests(SimpleTestCase):
+    def test_international_forms(self):
+        self.assertEqual(normalize_phone_number("+92 300 1234567"), "+923001234567")
+        self.assertEqual(normalize_phone_number("0092-300-1234567"), "+923001234567")
+        self.assertEqual(normalize_phone_number("923001234567@c.us"), "+923001234567")
+
+    def test_trunk_zero_gets_the_default_country_code(self):
+        with self.settings(DEFAULT_PHONE_COUNTRY_CODE="92"):
+            self.assertEqual(normalize_phone_number("0300 1234567"), "+923001234567")
+        self.assertEqual(normalize_phone_number("07700 900123", default_country_code="44"), "+447700900123")
+
+    def test_length_bounds(self):
+        self.assertEqual(normalize_phone_number("+12345678"), "+12345678")
+        self.assertEqual(normalize_phone_number("+123456789012345"), "+123456789012345")
+        self.assertIsNone(normalize_phone_number("+1234567"))
+        self.assertIsNone(normalize_phone_number("+1234567890123456"))
+
+    def test_missing_or_not_a_number(self):
+        self.assertIsNone(normalize_phone_number(None))
+        self.assertIsNone(normalize_phone_number(""))
+        self.assertIsNone(normalize_phone_number("n/a"))
+
+
+def order_row(**fields):
+    row = {
+        "number": "A-1001",
+        "order_at": "2026-10-19T12:30:00+05:00",
+        "customer_name": "Ali",
+        "customer_phone_number": "0300 1234567",
+        "branch_name": "DHA",
+        "order_details": [{"item": "Zinger", "quantity": 2, "price": 650}],
+    }
+    row.update(fields)
+    return row
+
+
+class ValidateOrderTests(SimpleTestCase):
+    def test_valid_order(self):
+        values, errors = validate_order(order_row())
+        self.assertIsNone(errors)
+        self.assertEqual(values["number"], "A-1001")
+        self.assertEqual(values["order_details"][0]["price"], 650.0)
+
+    def test_naive_order_at_is_made_aware(self):
+        values, errors = validate_order(order_row(order_at="2026-10-19T12:30:00"))
+        self.assertIsNone(errors)
+        self.assertTrue(timezone.is_aware(values["order_at"]))
+
+    def test_missing_and_too_long_fields(self):
+        values, errors = validate_order(order_row(number="", customer_name="x" * 101))
+        self.assertIsNone(values)
+        self.assertEqual(errors["number"], "required")
+        self.assertIn("customer_name", errors)
+
+    def test_nonexistent_date_is_a_field_error(self):
+        values, errors = validate_order(order_row(order_at="2024-02-30T10:00:00"))
+        self.assertIsNone(values)
+        self.assertIn("order_at", errors)
+
+    def test_non_finite_prices_are_field_errors(self):
+        for price in ("NaN", "sNaN", "Infinity", "-Infinity"):
+            values, errors = validate_order(order_row(order_details=[{"item": "Fries", "price": price}]))
+            self.assertIsNone(values)
+            self.assertIn("order_details", errors)
+
+    def test_negative_quantity_and_missing_item(self):
+        _, errors = validate_order(order_row(order_details=[{"item": "Fries", "quantity": 0}]))
+        self.assertIn("order_details", errors)
+        _, errors = validate_order(order_row(order_details=[{"quantity": 1}]))
+        self.assertIn("order_details", errors)
+
+    def test_not_an_object(self):
+        self.assertEqual(validate_order([1, 2]), (None, {"__all__": "expected a JSON object"}))
+
+    def test_ingest_reports_bad_rows_without_raising(self):
+        lines = [
+            (1, "{not json"),
+            (2, json.dumps(order_row(order_at="2024-02-30T10:00:00"))),
+            (3, json.dumps(order_row(order_details=[{"item": "Fries", "price": "NaN"}]))),
+        ]
+        results = list(ingest_orders(None, lines))
+        self.assertEqual([result["status"] for result in results], ["error", "error", "error"])
+        self.assertEqual([result["line"] for result in results], [1, 2, 3])
+
+
+def create_company():
+    return Company.objects.create(
+        name="Burger Lab",
+        phone_number="923001234567",
+        api_token="token",
+        instance_id="instance-1",
+        webhook_token="webhook",
+    )
+
+
+def create_order(company, number, order_at=None, **fields):
+    return Order.objects.create(
+        company=company,
+        number=number,
+        details="",
+        order_at=order_at or timezone.make_aware(datetime(2026, 10, 1, 12)),
+        customer_name="Ali",
+        customer_phone_number="03001234567",
+        branch_name="DHA",
+        **fields,
+    )
+
+
+class BuildDayAggregatesTests(TestCase):
+    day = date(2026, 10, 1)
+
+    def setUp(self):
+        self.company = create_company()
+
+    def aggregates(self, metric):
+        return {
+            row.key: row.value
+            for row in build_day_aggregates(self.company.id, [self.day])
+            if row.metric == metric and row.branch_name == "DHA"
+        }
+
+    def test_counts_responses_and_analyses(self):
+        completed = create_order(self.company, "A-1")
+        QuestionTemplate.objects.create(order=completed, question="How was it?", priority=1, answer="Great")
+        QuestionTemplate.objects.create(order=completed, question="Thanks!", priority=WRAP_UP_PRIORITY, answer="N/A")
+        Analytics.objects.create(
+            order=completed, sentiment_label="positive", extracted_keywords=["Crispy "], products=["Zinger"]
+        )
+        abandoned = create_order(self.company, "A-2", review_abandoned_at=timezone.now())
+        QuestionTemplate.objects.create(order=abandoned, question="How was it?", priority=1)
+        create_order(self.company, "A-3")
+
+        self.assertEqual(
+            self.aggregates("response"), {"invited": 2, "responded": 1, "completed": 1, "abandoned": 1}
+        )
+        self.assertEqual(self.aggregates("sentiment"), {"positive": 1})
+        self.assertEqual(self.aggregates("keyword"), {"crispy": 1})
+        self.assertEqual(self.aggregates("product"), {"zinger": 1})
+
+    def test_counts_archived_conversations(self):
+        order = create_order(self.company, "A-1")
+        ArchivedConversation.objects.create(
+            order=order,
+            questions=[
+                {"question": "How was it?", "priority": 1, "answer": "", "audio": "audio/a.ogg"},
+                {"question": "Thanks!", "priority": WRAP_UP_PRIORITY, "answer": "N/A", "audio": None},
+            ],
+        )
+
+        self.assertEqual(self.aggregates("response"), {"invited": 1, "responded": 1, "completed": 1})
+
+    def test_days_of_other_companies_are_ignored(self):
+        other = Company.objects.create(
+            name="Other", phone_number="1", api_token="t", instance_id="instance-2", webhook_token="w"
+        )
+        order = create_order(other, "B-1")
+        QuestionTemplate.objects.create(order=order, question="How was it?", priority=1, answer="Good")
+
+        self.assertEqual(build_day_aggregates(self.company.id, [self.day]), [])
+
+
+class ChangedDaysTests(TestCase):
+    def test_abandoned_and_sent_conversations_are_changed(self):
+        company = create_company()
+        abandoned = create_order(company, "A-1")
+        sent = create_order(company, "A-2", order_at=timezone.make_aware(datetime(2026, 10, 2, 12)))
+        question = QuestionTemplate.objects.create(order=sent, question="How was it?", priority=1)
+        since = timezone.now()
+
+        Conversation(abandoned, questions=[]).abandon()
+        conversation = Conversation(sent, questions=[question])
+        conversation.mark_sent(question)
+        conversation.save()
+
+        self.assertEqual(changed_days(since), {company.id: {date(2026, 10, 1), date(2026, 10, 2)}})
+
+    def test_every_day_without_since(self):
+        company = create_company()
+        create_order(company, "A-1")
+
+        self.assertEqual(changed_days(), {company.id: {date(2026, 10, 1)}})
+
+
+@mock.patch("backend.tasks.send_whats_app_message")
+class ProcessNextStepTests(TestCase):
+    def setUp(self):
+        company = create_company()
+        self.customer = Customer.objects.create(company=company, phone_number="+923001234567")
+        self.order = create_order(company, "A-1", customer=self.customer)
+        self.question = QuestionTemplate.objects.create(
+            order=self.order, question="How was it?", priority=1, sent_at=timezone.now(), send_count=1
+        )
+        Customer.objects.filter(pk=self.customer.pk).update(open_order=self.order)
+
+    def receive(self, content):
+        return InboundMessage.objects.create(
+            company_id=self.order.company_id,
+            sender_phone_number="923001234567@c.us",
+            message_type="chat",
+            content=content,
+        )
+
+    def test_template_reply_query_budget(self, send_whats_app_message):
+        message = self.receive("Great food")
+
+        # Claim, message, customer and questions, then the answer and the
+        # reply each in their own savepoint
+        with self.assertNumQueries(10):
+            process_next_step_for_order(message.id)
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer, "Great food")
+        reply = QuestionTemplate.objects.get(order=self.order, priority=2)
+        self.assertIsNotNone(reply.sent_at)
+        self.assertEqual(send_whats_app_message.call_args.args[3], reply.question)
+
+    def test_redelivered_message_is_ignored(self, send_whats_app_message):
+        message = self.receive("Great food")
+        process_next_step_for_order(message.id)
+
+        with self.assertNumQueries(1):
+            process_next_step_for_order(message.id)
+        self.assertEqual(send_whats_app_message.call_count, 1)
+
+    def test_text_while_the_reply_is_pending_is_added_to_the_answer(self, send_whats_app_message):
+        QuestionTemplate.objects.filter(pk=self.question.pk).update(answer="Good burger but cold fries")
+        message = self.receive("Drinks were warm too")
+        process_next_step_for_order(message.id)
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer, "Good burger but cold fries\nDrinks were warm too")
+        send_whats_app_message.assert_not_called()
+        self.assertFalse(QuestionTemplate.objects.filter(order=self.order, priority=2).exists())
+
+    @mock.patch("backend.tasks.process_next_step_for_order.apply_async")
+    def test_voice_note_while_the_reply_is_pending_waits(self, apply_async, send_whats_app_message):
+        QuestionTemplate.objects.filter(pk=self.question.pk).update(answer="Good burger but cold fries")
+        message = InboundMessage.objects.create(
+            company_id=self.order.company_id,
+            sender_phone_number="923001234567@c.us",
+            message_type="ptt",
+            media="audio/ab/cd/abcd.ogg",
+        )
+        process_next_step_for_order(message.id)
+
+        message.refresh_from_db()
+        self.assertIsNone(message.processed_at)
+        self.assertEqual(apply_async.call_args.args[0], (message.id,))
+        send_whats_app_message.assert_not_called()
+
+    @mock.patch("backend.tasks.continue_conversation.apply_async")
+    @mock.patch("backend.conversation.create_next_question_for_order", side_effect=LLMError("down"))
+    def test_answer_is_kept_when_the_reply_fails(self, _, apply_async, send_whats_app_message):
+        # Mixed sentiment has no template, so the reply needs the LLM
+        message = self.receive("Good burger but cold fries")
+        process_next_step_for_order(message.id)
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer, "Good burger but cold fries")
+        self.assertFalse(QuestionTemplate.objects.filter(order=self.order, priority=2).exists())
+        send_whats_app_message.assert_not_called()
+        self.assertEqual(apply_async.call_args.args[0], (self.order.id,))
+
+
+class IngestOrdersTests(TestCase):
+    def test_orders_without_a_customer_are_not_invited(self):
+        company = create_company()
+        order_at = timezone.now().isoformat()
+        lines = [
+            (1, json.dumps(order_row(number="A-1", order_at=order_at))),
+            (2, json.dumps(order_row(number="A-2", order_at=order_at, customer_phone_number="12"))),
+        ]
+        results = list(ingest_orders(company, lines))
+
+        self.assertEqual([result["status"] for result in results], ["created", "created"])
+        invited = Order.objects.get(number="A-1")
+        self.assertIsNotNone(invited.customer)
+        self.assertIsNotNone(invited.review_due_at)
+        unreachable = Order.objects.get(number="A-2")
+        self.assertIsNone(unreachable.customer)
+        self.assertIsNone(unreachable.review_due_at)
+
+    @override_settings(ORDER_INGEST_BATCH_SIZE=2)
+    def test_failed_batch_is_reported_per_row(self):
+        company = create_company()
+        bulk_create = Order.objects.bulk_create
+        calls = []
+
+        def fail_first_batch(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise DatabaseError("deadlock detected")
+            return bulk_create(*args, **kwargs)
+
+        lines = [(n, json.dumps(order_row(number=f"A-{n}"))) for n in range(1, 4)]
+        with mock.patch.object(Order.objects, "bulk_create", side_effect=fail_first_batch):
+            results = list(ingest_orders(company, lines))
+
+        self.assertEqual([(r["line"], r["status"]) for r in results], [(1, "error"), (2, "error"), (3, "created")])
+        self.assertEqual(list(Order.objects.values_list("number", flat=True)), ["A-3"])
+
+    def test_phone_number_change_moves_the_open_conversation(self):
+        company = create_company()
+        list(ingest_orders(company, [(1, json.dumps(order_row(number="A-1")))]))
+        order = Order.objects.get(number="A-1")
+        Customer.objects.filter(pk=order.customer_id).update(open_order=order)
+
+        list(ingest_orders(company, [(1, json.dumps(order_row(number="A-1", customer_phone_number="0300 7654321")))]))
+
+        previous = Customer.objects.get(phone_number="+923001234567")
+        current = Customer.objects.get(phone_number="+923007654321")
+        self.assertIsNone(previous.open_order_id)
+        self.assertEqual(current.open_order_id, order.id)
+        self.assertEqual(Order.objects.get(pk=order.pk).customer, current)
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.order = create_order(create_company(), "A-1")
+        # Attached from the phone number by the pre_save signal
+        self.customer = self.order.customer
+
+    def answered(self, *answers):
+        return [
+            QuestionTemplate.objects.create(order=self.order, question=f"Q{priority}", priority=priority, answer=answer)
+            for priority, answer in enumerate(answers, start=1)
+        ]
+
+    def test_opening_question_opens_the_conversation(self):
+        conversation = Conversation(self.order, questions=[])
+        self.assertEqual(conversation.state, ConversationState.NOT_STARTED)
+
+        self.assertEqual(conversation.advance(), OPENING_QUESTION)
+        self.assertEqual(conversation.state, ConversationState.AWAITING_ANSWER)
+        with self.assertNumQueries(4):
+            conversation.save()
+
+        self.assertEqual(QuestionTemplate.objects.get(order=self.order).priority, 1)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.open_order, self.order)
+
+    def test_answer_and_template_follow_up_are_saved_together(self):
+        question = QuestionTemplate.objects.create(order=self.order, question="How was it?", priority=1)
+        conversation = Conversation(self.order, questions=[question])
+        self.assertEqual(conversation.advance(), "How was it?")
+
+        conversation.record_answer(question, "Great food")
+        self.assertEqual(conversation.state, ConversationState.REPLY_DUE)
+        reply = conversation.advance()
+        self.assertIn(reply, FOLLOW_UP_TEMPLATES[("positive", 1)])
+
+        # One UPDATE for the answer and one INSERT, inside a savepoint
+        with self.assertNumQueries(4):
+            conversation.save()
+        question.refresh_from_db()
+        self.assertEqual(question.answer, "Great food")
+        self.assertEqual(QuestionTemplate.objects.get(order=self.order, priority=2).question, reply)
+
+        # Nothing left to write
+        with self.assertNumQueries(0):
+            conversation.save()
+
+    def test_wrap_up_completes_and_closes_the_conversation(self):
+        self.customer.open_order = self.order
+        self.customer.save()
+        conversation = Conversation(self.order, questions=self.answered("Great", "Loved the fries", "Nothing"))
+
+        reply = conversation.advance()
+        self.assertIn(reply, WRAP_UP_TEMPLATES["positive"])
+        self.assertEqual(conversation.questions[-1].priority, WRAP_UP_PRIORITY)
+        self.assertEqual(conversation.state, ConversationState.COMPLETED)
+        conversation.save()
+
+        self.assertIsNone(conversation.advance())
+        self.customer.refresh_from_db()
+        self.assertIsNone(self.customer.open_order)
+
+    def test_abandon(self):
+        self.customer.open_order = self.order
+        self.customer.save()
+        conversation = Conversation(self.order, questions=[])
+        since = timezone.now()
+
+        conversation.abandon()
+
+        self.assertEqual(conversation.state, ConversationState.ABANDONED)
+        self.assertIsNone(conversation.advance())
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.review_abandoned_at)
+        self.assertGreater(self.order.updated_at, since)
+        self.customer.refresh_from_db()
+        self.assertIsNone(self.customer.open_order)
+
+    def test_template_reply_for_given_sentiments(self):
+        question = QuestionTemplate.objects.create(order=self.order, question="How was it?", priority=1)
+        conversation = Conversation(self.order, questions=[question])
+
+        self.assertIsNone(conversation.template_reply())
+        self.assertIn(conversation.template_reply(["negative"]), FOLLOW_UP_TEMPLATES[("negative", 1)])
+
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SpeculationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.order = create_order(create_company(), "A-1")
+        self.question = QuestionTemplate.objects.create(order=self.order, question="How was it?", priority=1)
+
+    def test_only_answers_without_a_template_are_pre_generated(self):
+        conversation = Conversation(self.order, questions=[self.question])
+        self.assertEqual(speculative_classes(conversation), [MIXED])
+
+    @mock.patch("backend.conversation.create_next_question_for_order", side_effect=AssertionError("LLM called"))
+    @mock.patch("backend.speculation.create_next_question_for_order", return_value="Sorry about the fries! Anything else?")
+    def test_mixed_answer_uses_the_pre_generated_reply(self, generate, _):
+        self.assertEqual(pregenerate_replies(Conversation(self.order, questions=[self.question])), 1)
+        self.assertEqual(generate.call_args.kwargs["expected_tone"], MIXED)
+
+        conversation = Conversation(self.order, questions=[self.question], speculative=True)
+        conversation.record_answer(self.question, "Good burger but cold fries")
+
+        self.assertEqual(conversation.advance(), "Sorry about the fries! Anything else?")
+        self.assertEqual(speculation_stats()["hits"], 1)
+
+    @mock.patch("backend.speculation.create_next_question_for_order")
+    def test_templated_answer_doesnt_touch_the_cache(self, generate):
+        conversation = Conversation(self.order, questions=[self.question], speculative=True)
+        conversation.record_answer(self.question, "Great food")
+
+        self.assertIn(conversation.advance(), FOLLOW_UP_TEMPLATES[("positive", 1)])
+        generate.assert_not_called()
+        self.assertEqual(speculation_stats()["misses"], 0)
+
+
+def completion(content, total_tokens=10):
+    return {
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": total_tokens - 2, "completion_tokens": 2, "total_tokens": total_tokens},
+    }
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    LLM_MODELS={"default": ["primary", "backup"]},
+    LLM_MAX_CONCURRENCY=2,
+    LLM_COMPANY_MAX_CONCURRENCY=1,
+    LLM_TOKENS_PER_MINUTE=100000,
+    LLM_COMPANY_TOKENS_PER_MINUTE=100000,
+    LLM_MAX_WAIT=0,
+)
+@mock.patch("backend.llm._post_completion")
+class ChatCompletionTests(SimpleTestCase):
+    messages = [{"role": "user", "content": "Hello"}]
+
+    def setUp(self):
+        cache.clear()
+
+    def budget(self, scope):
+        return cache.get(f"llm:tpm:{scope}:{int(time.time() // 60)}")
+
+    def test_falls_back_to_the_next_model(self, post):
+        post.side_effect = [requests.ConnectionError("down"), completion("Hi!")]
+
+        self.assertEqual(chat_completion("next_question", self.messages, company_id=1), "Hi!")
+        self.assertEqual([call.args[0] for call in post.call_args_list], ["primary", "backup"])
+        usage = usage_stats()["next_question"]
+        self.assertEqual((usage["errors"], usage["calls"]), (1, 1))
+        # Slots are given back
+        self.assertEqual(cache.get("llm:slots:global"), 0)
+        self.assertEqual(cache.get("llm:slots:company:1"), 0)
+
+    def test_failed_call_refunds_reserved_tokens(self, post):
+        post.side_effect = requests.ConnectionError("down")
+
+        with self.assertRaises(LLMError):
+            chat_completion("next_question", self.messages, company_id=1)
+        self.assertEqual(self.budget("global"), 0)
+        self.assertEqual(self.budget("company:1"), 0)
+
+    def test_company_at_its_limit_holds_no_global_slot(self, post):
+        cache.set("llm:slots:company:1", 1)
+
+        with self.assertRaises(LLMBudgetExceeded):
+            chat_completion("next_question", self.messages, company_id=1)
+        post.assert_not_called()
+        self.assertIsNone(cache.get("llm:slots:global"))
+        self.assertIsNone(self.budget("global"))
+        self.assertEqual(self.budget("company:1"), 0)
+
+    @override_settings(LLM_TOKENS_PER_MINUTE=10)
+    def test_exhausted_budget_raises_instead_of_sleeping(self, post):
+        started_at = time.monotonic()
+        with self.assertRaises(LLMBudgetExceeded):
+            chat_completion("next_question", self.messages)
+        self.assertLess(time.monotonic() - started_at, 1)
+        post.assert_not_called()
+
+    def test_identical_requests_are_coalesced(self, post):
+        post.return_value = completion("Hi!")
+
+        chat_completion("next_question", self.messages)
+        self.assertEqual(chat_completion("next_question", self.messages), "Hi!")
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(usage_stats()["next_question"]["coalesced"], 1)
+
+
+class ProfileDataframeTests(SimpleTestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            "branch": ["DHA", "DHA", "Gulberg", None],
+            "orders": [3, 5, 7, None],
+        })
+
+    def test_summarizes_every_fetched_row(self):
+        profile = profile_dataframe(self.df, capped=True)
+
+        self.assertEqual(profile["row_count"], 4)
+        self.assertTrue(profile["capped"])
+        branch, orders = profile["columns"]
+        self.assertEqual((branch["kind"], branch["non_null"], branch["distinct"]), ("text", 3, 2))
+        self.assertEqual(branch["top"][0], ("DHA", 2))
+        self.assertEqual((orders["kind"], orders["min"], orders["max"], orders["mean"]), ("numeric", 3.0, 7.0, 5.0))
+
+    def test_does_not_query_the_database(self):
+        with mock.patch("backend.sql_execution.scoped_connection") as scoped_connection:
+            profile_dataframe(self.df)
+        scoped_connection.assert_not_called()
+
+    @override_settings(VISUALIZATION_PROMPT_MAX_CHARS=40)
+    def test_format_is_bounded(self):
+        text = format_profile(profile_dataframe(self.df, capped=True), self.df)
+
+        self.assertTrue(text.startswith("ROWS: 4 (the result is capped"))
+        self.assertTrue(text.endswith("... (truncated)"))
+
+
+@contextmanager
+def audio_path(field_file):
+    yield field_file.name
+
+
+@mock.patch("backend.tasks.continue_conversation")
+@mock.patch("backend.tasks.local_audio_path", side_effect=audio_path)
+@mock.patch("backend.tasks.transcribe_with_fallback")
+class TranscribePendingAudioTests(TestCase):
+    def setUp(self):
+        self.order = create_order(create_company(), "A-1")
+        self.clip = tempfile.NamedTemporaryFile(suffix=".ogg")
+        self.addCleanup(self.clip.close)
+
+    def question(self, audio, **fields):
+        return QuestionTemplate.objects.create(order=self.order, question="How was it?", priority=1, audio=audio, **fields)
+
+    def test_missing_clip_does_not_fail_the_batch(self, transcribe, local_audio_path, continue_conversation):
+        missing = self.question("/nonexistent/clip.ogg")
+        present = self.question(self.clip.name)
+        transcribe.return_value = ["Great"]
+
+        transcribe_pending_audio()
+
+        transcribe.assert_called_once_with([self.clip.name], language="english", backend_name="lemonfox")
+        present.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(present.answer, "Great")
+        self.assertEqual((missing.answer, missing.transcription_attempts), (None, 1))
+        continue_conversation.delay.assert_called_once_with(self.order.id)
+
+    def test_batch_error_falls_back_to_one_clip_at_a_time(self, transcribe, local_audio_path, continue_conversation):
+        first, second = self.question(self.clip.name), self.question(self.clip.name)
+        transcribe.side_effect = [OSError("bad batch"), ["Great"], OSError("bad clip")]
+
+        transcribe_pending_audio()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.answer, first.transcription_attempts), ("Great", 0))
+        self.assertEqual((second.answer, second.transcription_attempts), (None, 1))
+
+    @override_settings(TRANSCRIPTION_MAX_ATTEMPTS=3, TRANSCRIPTION_PENDING_MAX_AGE_HOURS=48)
+    def test_gives_up_on_old_or_repeatedly_failing_clips(self, transcribe, local_audio_path, continue_conversation):
+        self.question(self.clip.name, transcription_attempts=3)
+        old = self.question(self.clip.name)
+        QuestionTemplate.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=49))
+
+        transcribe_pending_audio()
+
+        transcribe.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE, NL_QUERY_JOB_TIME_LIMIT=600)
+@mock.patch("backend.nl_jobs.release_job_slot")
+@mock.patch("backend.nl_jobs.run_nl_query")
+class RunJobTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        with mock.patch("backend.nl_jobs.claim_job_slot", return_value=True):
+            self.job = create_job(user_id=1, company_id=1, query="Reviews per branch")
+
+    def start(self, seconds_ago):
+        started_at = timezone.now() - timedelta(seconds=seconds_ago)
+        self.job.update(status=RUNNING, started_at=started_at.isoformat())
+        cache.set(job_key(self.job["id"]), self.job)
+
+    def test_job_interrupted_by_a_dead_worker_runs_again(self, run_nl_query, release_job_slot):
+        run_nl_query.return_value = (pd.DataFrame({"branch": ["DHA"]}), "SELECT 1", {}, None)
+        self.start(seconds_ago=30)
+
+        run_job(self.job["id"])
+
+        run_nl_query.assert_called_once()
+        self.assertEqual(get_job(self.job["id"])["status"], SUCCEEDED)
+        release_job_slot.assert_called_with(1, self.job["id"])
+
+    def test_job_running_past_the_time_limit_fails(self, run_nl_query, release_job_slot):
+        self.start(seconds_ago=601)
+
+        job = get_job(self.job["id"])
+        run_job(self.job["id"])
+
+        self.assertEqual(job["status"], FAILED)
+        self.assertIn("600 seconds", job["error"])
+        run_nl_query.assert_not_called()
+        release_job_slot.assert_called_with(1, self.job["id"])
+
+
+class AttachCustomerTests(TestCase):
+    def setUp(self):
+        self.company = create_company()
+        self.order = create_order(self.company, "A-1")
+
+    def test_new_order_gets_its_customer(self):
+        self.assertEqual(self.order.customer.phone_number, "+923001234567")
+
+    def test_unchanged_number_is_not_looked_up_again(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.details = "extra cheese"
+        with mock.patch("backend.signals.get_customer") as get_customer:
+            order.save()
+        get_customer.assert_not_called()
+
+    def test_changed_number_moves_customer_and_open_conversation(self):
+        previous = self.order.customer
+        Customer.objects.filter(pk=previous.pk).update(open_order=self.order)
+
+        order = Order.objects.get(pk=self.order.pk)
+        order.customer_phone_number = "0300 7654321"
+        order.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.customer.phone_number, "+923007654321")
+        self.assertEqual(order.customer.open_order_id, order.id)
+        previous.refresh_from_db()
+        self.assertIsNone(previous.open_order_id)
+
+
+class BackfillCustomersTests(TestCase):
+    def test_open_conversation_is_the_oldest_unfinished_order(self):
+        company = create_company()
+        days = [timezone.make_aware(datetime(2026, 10, day, 12)) for day in (1, 2, 3, 4)]
+        finished = create_order(company, "A-1", order_at=days[0])
+        QuestionTemplate.objects.create(order=finished, question="Thanks!", priority=WRAP_UP_PRIORITY, answer="N/A")
+        oldest_open = create_order(company, "A-2", order_at=days[1])
+        QuestionTemplate.objects.create(order=oldest_open, question="How was it?", priority=1)
+        newer_open = create_order(company, "A-3", order_at=days[2])
+        QuestionTemplate.objects.create(order=newer_open, question="How was it?", priority=1)
+        # Not invited yet
+        create_order(company, "A-4", order_at=days[3])
+        unreachable = create_order(company, "A-5")
+        Order.objects.filter(pk=unreachable.pk).update(customer_phone_number="n/a")
+        quiet = Customer.objects.create(company=company, phone_number="+923009999999", open_order=finished)
+        Order.objects.update(customer=None)
+
+        call_command("backfill_customers", stdout=mock.MagicMock())
+
+        customer = Customer.objects.get(phone_number="+923001234567")
+        self.assertEqual(customer.open_order_id, oldest_open.id)
+        self.assertEqual(Order.objects.filter(customer=customer).count(), 4)
+        unreachable.refresh_from_db()
+        self.assertIsNone(unreachable.customer_id)
+        quiet.refresh_from_db()
+        self.assertIsNone(quiet.open_order_id)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CompanyRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _local_companies.clear()
+        self.company = create_company()
+
+    def test_save_invalidates_both_cache_levels(self):
+        self.assertEqual(get_company_by_instance_id("instance-1").name, "Burger Lab")
+
+        self.company.name = "Burger Lab DHA"
+        self.company.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_company_by_instance_id("instance-1").name, "Burger Lab DHA")
+        with self.assertNumQueries(0):
+            get_company_by_instance_id("instance-1")
+
+    def test_changed_instance_id_drops_the_old_one(self):
+        get_company_by_instance_id("instance-1")
+
+        self.company.instance_id = "instance-2"
+        self.company.save()
+
+        self.assertIsNone(get_company_by_instance_id("instance-1"))
+        self.assertEqual(get_company_by_instance_id("instance-2").pk, self.company.pk)
+
+    def test_delete_invalidates(self):
+        get_company_by_instance_id("instance-1")
+
+        self.company.delete()
+
+        self.assertIsNone(get_company_by_instance_id("instance-1"))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, REPLICA_MAX_LAG_SECONDS=30)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        patcher = mock.patch.dict(settings.DATABASES, {"replica": {}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_db(self):
+        with analytics_reads():
+            return self.router.db_for_read(Order)
+
+    def test_analytics_reads_go_to_the_replica(self):
+        cache.set(REPLICA_LAG_CACHE_KEY, 2)
+
+        self.assertEqual(self.read_db(), "replica")
+        # Outside analytics_reads() the conversation path reads its own writes
+        self.assertEqual(self.router.db_for_read(Order), "default")
+
+    def test_lagging_or_unreachable_replica_falls_back_to_the_primary(self):
+        cache.set(REPLICA_LAG_CACHE_KEY, 31)
+        self.assertEqual(self.read_db(), "default")
+
+        cache.set(REPLICA_LAG_CACHE_KEY, -1)
+        self.assertEqual(self.read_db(), "default")
+
+    def test_writes_always_go_to_the_primary(self):
+        cache.set(REPLICA_LAG_CACHE_KEY, 0)
+
+        with analytics_reads():
+            self.assertEqual(self.router.db_for_write(Order), "default")
+        self.assertTrue(self.router.allow_migrate("default", "backend"))
+        self.assertFalse(self.router.allow_migrate("replica", "backend"))
+
+    def test_without_a_replica_reads_use_the_primary(self):
+        del settings.DATABASES["replica"]
+
+        self.assertEqual(self.read_db(), "default")
+
+    @mock.patch("backend.db_router.connections")
+    def test_lag_is_measured_once_per_interval(self, connections):
+        cursor = connections.__getitem__.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (1.5,)
+
+        self.assertEqual(replica_lag(), 1.5)
+        self.assertEqual(replica_lag(), 1.5)
+        cursor.execute.assert_called_once()
+
+    @mock.patch("backend.db_router.connections")
+    def test_unreachable_replica_is_remembered(self, connections):
+        connections.__getitem__.return_value.cursor.side_effect = DatabaseError("connection refused")
+
+        self.assertIsNone(replica_lag())
+        self.assertEqual(cache.get(REPLICA_LAG_CACHE_KEY), -1)
+        self.assertEqual(self.read_db(), "default")
+
+
+class FakeSandbox:
+    def __init__(self):
+        self.healthy = True
+        self.resets = 0
+        self.closed = False
+
+    def is_healthy(self):
+        return self.healthy
+
+    def reset(self):
+        self.resets += 1
+
+    def close(self):
+        self.closed = True
+
+
+class SandboxPoolTests(SimpleTestCase):
+    def pool(self, size=1, idle_timeout=60, max_uses=10, health_check_interval=60):
+        self.created = []
+
+        def factory():
+            self.created.append(FakeSandbox())
+            return self.created[-1]
+
+        pool = SandboxPool(factory, size, idle_timeout, max_uses, health_check_interval)
+        self.addCleanup(pool.close)
+        pool.warm()
+        self.wait_until(lambda: pool.idle_count == size)
+        return pool
+
+    def wait_until(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not met in time")
+            time.sleep(0.01)
+
+    def test_sandbox_is_reset_and_reused(self):
+        pool = self.pool()
+
+        with pool.sandbox() as first:
+            pass
+        self.wait_until(lambda: first.resets == 1 and pool.idle_count == 1)
+        with pool.sandbox() as second:
+            pass
+
+        self.assertIs(second, first)
+        self.assertEqual(len(self.created), 1)
+
+    def test_failed_or_worn_out_sandbox_is_replaced(self):
+        pool = self.pool(max_uses=2)
+
+        with self.assertRaises(ValueError):
+            with pool.sandbox() as failed:
+                raise ValueError("run failed")
+        self.wait_until(lambda: failed.closed and pool.idle_count == 1)
+
+        with pool.sandbox() as worn:
+            pass
+        self.wait_until(lambda: pool.idle_count == 1)
+        with pool.sandbox() as same:
+            pass
+        self.assertIs(same, worn)
+        self.wait_until(lambda: worn.closed and pool.idle_count == 1)
+        self.assertEqual(len(self.created), 3)
+
+    def test_unhealthy_sandbox_is_not_leased(self):
+        pool = self.pool()
+        stale = self.created[0]
+        stale.healthy = False
+        # Past its health check interval
+        pool._idle[0].checked_at -= 120
+
+        with pool.sandbox() as sandbox:
+            self.assertIsNot(sandbox, stale)
+        self.assertTrue(stale.closed)
+
+    def test_reaper_closes_expired_sandboxes(self):
+        pool = self.pool(idle_timeout=0.05)
+
+        self.wait_until(lambda: self.created[0].closed)
+        self.assertEqual(pool.idle_count, 0)
+
+    def test_reaper_closes_unhealthy_sandboxes(self):
+        pool = self.pool(size=2, health_check_interval=0.05)
+        healthy, dead = self.created
+
+        dead.healthy = False
+        self.wait_until(lambda: dead.closed)
+        self.assertFalse(healthy.closed)
+        self.assertEqual(pool.idle_count, 1)
+
+
+class SearchAnswersTests(TestCase):
+    def setUp(self):
+        self.company = create_company()
+        self.order = create_order(self.company, "A-1")
+
+    def answer(self, text):
+        return QuestionTemplate.objects.create(order=self.order, question="How was it?", priority=1, answer=text)
+
+    def search(self, q, **kwargs):
+        return search_answers(self.company.id, parse_search_params({"q": q}), **kwargs)
+
+    def test_best_match_first_then_newest(self):
+        once = self.answer("The burger was cold")
+        often = self.answer("Cold fries, cold burger, cold drink")
+        self.answer("Great service")
+        tie = self.answer("The burger was cold")
+
+        page, next_cursor = self.search("cold")
+
+        self.assertEqual([row["id"] for row in page], [often.id, tie.id, once.id])
+        self.assertIsNone(next_cursor)
+
+    def test_cursor_pages_are_stable_when_answers_arrive(self):
+        ids = [self.answer("cold fries").id for _ in range(5)]
+
+        seen = []
+        page, cursor = self.search("cold", page_size=2)
+        seen += [row["id"] for row in page]
+        # A new, better matching answer doesn't shift the next pages
+        self.answer("cold cold cold")
+        while cursor:
+            page, cursor = self.search("cold", cursor=cursor, page_size=2)
+            seen += [row["id"] for row in page]
+
+        self.assertEqual(seen, sorted(ids, reverse=True))
+
+    def test_tampered_cursor_is_rejected(self):
+        self.answer("cold fries")
+        self.answer("cold burger")
+        _, cursor = self.search("cold", page_size=1)
+
+        with self.assertRaises(signing.BadSignature):
+            self.search("cold", cursor=cursor + "x", page_size=1)
+
+    def test_snippet_escapes_the_answer(self):
+        self.answer('cold food <b>5 < 6</b> & "fast"')
+
+        snippet = self.search("cold")[0][0]["snippet"]
+
+        # Markup in the answer never reaches the page as markup
+        self.assertEqual(snippet.replace("<mark>", "").replace("</mark>", "").count("<"), 0)
+        self.assertTrue(snippet.startswith("<mark>cold</mark> food"))
+        self.assertIn("&lt; 6", snippet)
+        self.assertIn("&amp; &quot;fast", snippet)
+
+    def test_web_search_syntax_and_operators_in_input(self):
+        phrase = self.answer("The food was cold")
+        self.answer("The burger was cold")
+
+        page, _ = self.search('"food was cold" -burger')
+        self.assertEqual([row["id"] for row in page], [phrase.id])
+
+        # tsquery operators typed by a user are not a syntax error
+        for q in ["cold & | !(", "cold:*", "' OR 1=1 --"]:
+            self.search(q)
+
+
+class ParseSearchParamsTests(SimpleTestCase):
+    def test_valid(self):
+        params = parse_search_params({"q": " cold ", "start": "2026-10-01", "end": "2026-10-19", "branch": "DHA"})
+
+        self.assertEqual(params, {"q": "cold", "start": date(2026, 10, 1), "end": date(2026, 10, 19), "branch": "DHA"})
+
+    def test_invalid(self):
+        for query_params in [
+            {},
+            {"q": "   "},
+            {"q": "x" * 201},
+            {"q": "cold", "start": "yesterday"},
+            {"q": "cold", "start": "2026-10-19", "end": "2026-10-01"},
+        ]:
+            with self.assertRaises(ValueError):
+                parse_search_params(query_params)
@@ -0,0 +1,225 @@
+import abc
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+
+TRANSCRIPTION_CACHE_PREFIX = "transcription"
+
+
+def audio_content_hash(file_path):
+    """
+    Return the sha256 hex digest of an audio file's content
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as audio_file:
+        for chunk in iter(lambda: audio_file.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscriptionBackend(abc.ABC):
+    """
+    Base class for speech-to-text engines.
+
+    Subclasses implement `_transcribe_many`. Results are cached by audio
+    content hash, so the same clip delivered twice (e.g. a WhatsApp retry)
+    is only transcribed once, whichever backend handles it.
+    """
+
+    name = None
+
+    def transcribe(self, file_path, language="english"):
+        return self.transcribe_batch([file_path], language=language)[0]
+
+    def transcribe_batch(self, file_paths, language="english"):
+        """
+        Transcribe several audio files in one go
+
+        Args:
+            file_paths: Paths to the audio files
+            language: Language of the audio (default: english)
+
+        Returns:
+            A list of transcribed texts (or None on error), in input order
+        """
+
+        keys = [self.cache_key(audio_content_hash(path), language) for path in file_paths]
+        cached = cache.get_many(keys)
+
+        results = [cached.get(key) for key in keys]
+        pending = {}
+        for index, key in enumerate(keys):
+            if results[index] is None:
+                # Identical clips inside the same batch are transcribed once
+                pending.setdefault(key, []).append(index)
+
+        if pending:
+            pending_paths = [file_paths[indexes[0]] for indexes in pending.values()]
+            texts = self._transcribe_many(pending_paths, language)
+
+            to_cache = {}
+            for (key, indexes), text in zip(pending.items(), texts):
+                for index in indexes:
+                    results[index] = text
+                if text:
+                    to_cache[key] = text
+            cache.set_many(to_cache, timeout=settings.TRANSCRIPTION_CACHE_TIMEOUT)
+
+        return results
+
+    def cache_key(self, content_hash, language):
+        return f"{TRANSCRIPTION_CACHE_PREFIX}:{language}:{content_hash}"
+
+    @abc.abstractmethod
+    def _transcribe_many(self, file_paths, language):
+        """
+        Transcribe uncached clips; returns texts (or None) in input order
+        """
+
+
+class LemonFoxBackend(TranscriptionBackend):
+    """
+    Transcription through the LemonFox AI API, one request per clip
+    """
+
+    name = "lemonfox"
+    url = "https://api.lemonfox.ai/v1/audio/transcriptions"
+
+    def _transcribe_many(self, file_paths, language):
+        return [self._transcribe_one(path, language) for path in file_paths]
+
+    def _transcribe_one(self, file_path, language):
+        headers = {"Authorization": f"Bearer {settings.LEMON_FOX_API_KEY}"}
+
+        data = {"language": language, "response_format": "json"}
+
+        files = {"file": open(file_path, "rb")}
+
+        try:
+            response = requests.post(self.url, headers=headers, files=files, data=data)
+            response.raise_for_status()
+            result = response.json()
+
+            # Extract the transcribed text from the result
+            if "text" in result:
+                return result["text"]
+            else:
+                print(f"No text found in transcription result: {result}")
+                return None
+
+        except Exception as e:
+            print(f"Error transcribing audio: {e}")
+            return None
+        finally:
+            files["file"].close()
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    CPU-only transcription with a locally loaded whisper-class model.
+
+    The model is loaded once per process on first use and reused for every
+    batch. The chunks of each clip are decoded together through
+    faster-whisper's BatchedInferencePipeline, and LOCAL_WHISPER_WORKERS
+    clips are transcribed at once. Requires the `faster-whisper` package
+    (requirements-media.txt, installed in the media worker image).
+    """
+
+    name = "local"
+
+    # Whisper expects ISO codes, the rest of the app passes language names
+    LANGUAGE_CODES = {
+        "english": "en",
+        "urdu": "ur",
+        "arabic": "ar",
+        "hindi": "hi",
+    }
+
+    _pipeline = None
+
+    @classmethod
+    def get_pipeline(cls):
+        if cls._pipeline is None:
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+            model = WhisperModel(
+                settings.LOCAL_WHISPER_MODEL,
+                device="cpu",
+                compute_type="int8",
+                cpu_threads=settings.LOCAL_WHISPER_CPU_THREADS,
+                # One worker per clip transcribed concurrently
+                num_workers=settings.LOCAL_WHISPER_WORKERS,
+            )
+            cls._pipeline = BatchedInferencePipeline(model=model)
+        return cls._pipeline
+
+    def _transcribe_one(self, pipeline, file_path, language_code):
+        try:
+            segments, _ = pipeline.transcribe(
+                file_path,
+                language=language_code,
+                beam_size=1,
+                batch_size=settings.LOCAL_WHISPER_BATCH_SIZE,
+            )
+            return " ".join(segment.text.strip() for segment in segments).strip()
+        except Exception as e:
+            print(f"Error transcribing audio locally: {e}")
+            return None
+
+    def _transcribe_many(self, file_paths, language):
+        try:
+            pipeline = self.get_pipeline()
+        except Exception as e:
+            print(f"Error loading local transcription model: {e}")
+            return [None] * len(file_paths)
+
+        language_code = self.LANGUAGE_CODES.get(language, language)
+
+        # CTranslate2 releases the GIL, so the workers run in parallel
+        with ThreadPoolExecutor(max_workers=settings.LOCAL_WHISPER_WORKERS) as executor:
+            return list(
+                executor.map(lambda path: self._transcribe_one(pipeline, path, language_code), file_paths)
+            )
+
+
+TRANSCRIPTION_BACKENDS = {
+    LemonFoxBackend.name: LemonFoxBackend,
+    LocalWhisperBackend.name: LocalWhisperBackend,
+}
+
+
+def get_transcription_backend(name=None):
+    """
+    Return a backend instance by name, defaulting to settings.TRANSCRIPTION_BACKEND
+    """
+
+    backend_class = TRANSCRIPTION_BACKENDS.get(name or settings.TRANSCRIPTION_BACKEND)
+    if backend_class is None:
+        backend_class = TRANSCRIPTION_BACKENDS[settings.TRANSCRIPTION_BACKEND]
+    return backend_class()
+
+
+def transcribe_with_fallback(file_paths, language="english", backend_name=None):
+    """
+    Transcribe a batch with the selected backend, retrying any failures on
+    settings.TRANSCRIPTION_FALLBACK_BACKEND so a provider outage doesn't
+    leave voice notes untranscribed.
+    """
+
+    backend = get_transcription_backend(backend_name)
+    results = backend.transcribe_batch(file_paths, language=language)
+
+    fallback_name = settings.TRANSCRIPTION_FALLBACK_BACKEND
+    failed = [index for index, text in enumerate(results) if not text]
+    if failed and fallback_name and fallback_name != backend.name:
+        fallback = get_transcription_backend(fallback_name)
+        retried = fallback.transcribe_batch([file_paths[i] for i in failed], language=language)
+        for index, text in zip(failed, retried):
+            results[index] = text
+
+    return results
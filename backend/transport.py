@@ -0,0 +1,130 @@
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+
+ARROW_STREAM_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+SPLIT_JSON_CONTENT_TYPE = "application/vnd.servewell.split+json"
+
+# Arrow schema metadata key holding everything that isn't table data
+ARROW_METADATA_KEY = b"servewell"
+
+VISUALIZATION_CACHE_PREFIX = "visualization"
+
+
+def negotiate_format(request):
+    """
+    Return "arrow", "split" or "records" based on the Accept header
+    """
+
+    accept = request.headers.get("Accept", "")
+    if ARROW_STREAM_CONTENT_TYPE in accept:
+        return "arrow"
+    if SPLIT_JSON_CONTENT_TYPE in accept:
+        return "split"
+    return "records"
+
+
+def store_visualization(png_bytes, company_id):
+    """
+    Keep a rendered PNG in the cache and return its id
+    """
+
+    visualization_id = uuid.uuid4().hex
+    cache.set(
+        f"{VISUALIZATION_CACHE_PREFIX}:{visualization_id}",
+        {"company_id": company_id, "png": png_bytes},
+        timeout=settings.NL_QUERY_VISUALIZATION_TTL,
+    )
+    return visualization_id
+
+
+def get_visualization(visualization_id):
+    return cache.get(f"{VISUALIZATION_CACHE_PREFIX}:{visualization_id}")
+
+
+def _arrow_table(pd_df):
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(pd_df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns (e.g. JSON fields) are sent as text
+        object_columns = pd_df.select_dtypes(include="object").columns
+        return pa.Table.from_pandas(
+            pd_df.astype({column: str for column in object_columns}), preserve_index=False
+        )
+
+
+def dataframe_to_arrow(pd_df):
+    """
+    Serialize a DataFrame as an Arrow IPC stream (stored job results)
+    """
+
+    import pyarrow as pa
+
+    table = _arrow_table(pd_df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_response(arrow_bytes, payload, result_format):
+    """
+    Like dataframe_response, for a result already stored as an Arrow IPC
+    stream; only pyarrow is needed, not pandas
+    """
+
+    import pyarrow as pa
+
+    with pa.ipc.open_stream(arrow_bytes) as reader:
+        table = reader.read_all()
+
+    if result_format == "arrow":
+        table = table.replace_schema_metadata(
+            {ARROW_METADATA_KEY: json.dumps(payload, default=str).encode()}
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return HttpResponse(sink.getvalue().to_pybytes(), content_type=ARROW_STREAM_CONTENT_TYPE)
+
+    records = table.to_pylist()
+    if result_format == "split":
+        data = {"columns": table.column_names, "data": [list(record.values()) for record in records]}
+        return JsonResponse({**payload, "data": data}, content_type=SPLIT_JSON_CONTENT_TYPE)
+
+    return JsonResponse({**payload, "data": records})
+
+
+def dataframe_response(pd_df, payload, result_format):
+    """
+    Build the query response in the negotiated format
+
+    Args:
+        pd_df: Result DataFrame
+        payload: Everything except the data (status, sql_query, metadata, ...)
+        result_format: "arrow", "split" or "records"
+    """
+
+    if result_format == "arrow":
+        import pyarrow as pa
+
+        table = _arrow_table(pd_df)
+        table = table.replace_schema_metadata(
+            {ARROW_METADATA_KEY: json.dumps(payload, default=str).encode()}
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return HttpResponse(sink.getvalue().to_pybytes(), content_type=ARROW_STREAM_CONTENT_TYPE)
+
+    if result_format == "split":
+        data = json.loads(pd_df.to_json(orient="split", index=False, date_format="iso"))
+        return JsonResponse({**payload, "data": data}, content_type=SPLIT_JSON_CONTENT_TYPE)
+
+    return JsonResponse({**payload, "data": pd_df.to_dict(orient="records")})
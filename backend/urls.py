@@ -5,11 +5,28 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 
-from backend.views import whatsapp_webhook, natural_language_query
+from backend.views import (
+    whatsapp_webhook,
+    natural_language_query,
+    nl_query_visualization,
+    order_ingest,
+    analytics_report,
+    nl_query_job_create,
+    nl_query_job,
+    nl_query_job_result,
+    answer_search,
+)
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('webhooks/whatsapp/<str:security_token>/', whatsapp_webhook),
     path('generate_sql/', natural_language_query, name='generate_sql'),
+    path('orders/ingest/', order_ingest, name='order_ingest'),
+    path('analytics/<str:report>/', analytics_report, name='analytics_report'),
+    path('search/answers/', answer_search, name='answer_search'),
+    path('generate_sql/jobs/', nl_query_job_create, name='nl_query_job_create'),
+    path('generate_sql/jobs/<str:job_id>/', nl_query_job, name='nl_query_job'),
+    path('generate_sql/jobs/<str:job_id>/result/', nl_query_job_result, name='nl_query_job_result'),
+    path('generate_sql/visualizations/<str:visualization_id>/', nl_query_visualization, name='nl_query_visualization'),
 ]
@@ -1,9 +1,10 @@
 import json
 import re
 import requests
-from django.conf import settings
 
 from backend.helpers import refine_sentiment
+from backend.llm import chat_completion
+from backend.transcription import transcribe_with_fallback
 
 
 def send_whats_app_message(instance, token, number, message):
@@ -31,57 +32,27 @@ def send_whats_app_message(instance, token, number, message):
     return response.json()
 
 
-def transcribe_audio_file(file_path, language="english"):
+def transcribe_audio_file(file_path, language="english", backend=None):
     """
-    Transcribe an audio file using the LemonFox AI API
+    Transcribe an audio file with the configured transcription backend
 
     Args:
         file_path: Path to the audio file
-        api_key: LemonFox API key
         language: Language of the audio (default: english)
+        backend: Backend name ("lemonfox" or "local"), defaults to settings.TRANSCRIPTION_BACKEND
 
     Returns:
         The transcribed text or None if there was an error
     """
 
-    api_key = settings.LEMON_FOX_API_KEY
-    url = "https://api.lemonfox.ai/v1/audio/transcriptions"
+    return transcribe_with_fallback([file_path], language=language, backend_name=backend)[0]
 
-    headers = {"Authorization": f"Bearer {api_key}"}
 
-    data = {"language": language, "response_format": "json"}
-
-    files = {"file": open(file_path, "rb")}
-
-    try:
-        response = requests.post(url, headers=headers, files=files, data=data)
-        response.raise_for_status()
-        result = response.json()
-
-        # Extract the transcribed text from the result
-        if "text" in result:
-            return result["text"]
-        else:
-            print(f"No text found in transcription result: {result}")
-            return None
-
-    except Exception as e:
-        print(f"Error transcribing audio: {e}")
-        return None
-    finally:
-        files["file"].close()
-
-
-def analyze_review_with_groq(conversation):
+def analyze_review_with_groq(conversation, company_id=None):
     """
     Use Groq API to analyze a review and extract sentiment, product name, emotions, and key feedback
     """
 
-    headers = {
-        "Authorization": f"Bearer {settings.GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
     prompt = f"""
         Analyze the following multi-turn customer service conversation related to food:
 
@@ -98,22 +69,13 @@ def analyze_review_with_groq(conversation):
         Do not add any explanations or formatting outside the JSON.
     """
 
-    payload = {
-        "model": "llama3-8b-8192",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.1,
-    }
-
     try:
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers=headers,
-            json=payload,
+        response_text = chat_completion(
+            "analyze_review",
+            [{"role": "user", "content": prompt}],
+            temperature=0.1,
+            company_id=company_id,
         )
-        response.raise_for_status()
-        result = response.json()
-
-        response_text = result["choices"][0]["message"]["content"]
         match = re.search(r"\{[\s\S]*\}", response_text)
 
         if not match:
@@ -129,27 +91,48 @@ def analyze_review_with_groq(conversation):
     except Exception as e:
         error_msg = f"API request failed: {str(e)}"
 
-        if hasattr(e, "response") and e.response is not None:
+        # The gateway raises LLMError from the last provider error
+        cause = e.__cause__ or e
+        if hasattr(cause, "response") and cause.response is not None:
             try:
-                error_details = e.response.json()
+                error_details = cause.response.json()
                 error_msg += f" - Details: {json.dumps(error_details)}"
             except:
-                error_msg += f" - Response: {e.response.text}"
+                error_msg += f" - Response: {cause.response.text}"
 
         return {"error": error_msg}
 
 
-def create_next_question_for_order(template_questions):
-    template_questions = template_questions.order_by("priority")
-    turn = template_questions.count()
+def create_next_question_for_order(template_questions, expected_tone=None):
+    """
+    Generate the next reply with the LLM
+
+    Args:
+        template_questions: The order's questions, already ordered by priority
+        expected_tone: When set, the pending question's answer isn't known yet and
+            the reply is written for any answer with this tone (positive/negative/neutral)
+    """
+
+    template_questions = list(template_questions)
+    turn = len(template_questions)
 
     conversation_history = ""
-    for i in range(turn):
-        if template_questions[i].is_question_answered:
-            assistant_questions = f"Assistant: {template_questions[i].question}"
-            user_answers = f"User: {template_questions[i].answer}"
+    for template_question in template_questions:
+        if template_question.is_question_answered:
+            assistant_questions = f"Assistant: {template_question.question}"
+            user_answers = f"User: {template_question.answer}"
+            conversation_history += f"{assistant_questions}\n{user_answers}\n"
+        elif expected_tone:
+            assistant_questions = f"Assistant: {template_question.question}"
+            user_answers = f"User: [a short, {expected_tone} answer]"
             conversation_history += f"{assistant_questions}\n{user_answers}\n"
 
+    if expected_tone:
+        conversation_history += (
+            "\n(The latest answer isn't known yet. Write a reply that fits any "
+            f"{expected_tone} answer and don't quote specifics from it.)\n"
+        )
+
     prompt = f"""
         You're a polite assistant collecting customer feedback at a restaurant.
 
@@ -177,20 +160,12 @@ def create_next_question_for_order(template_questions):
         Your reply:
     """
 
-    headers = {
-        "Authorization": f"Bearer {settings.GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
-        "model": "llama3-8b-8192",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.3,
-    }
-
-    response = requests.post(
-        "https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload
-    )
-    question = response.json()["choices"][0]["message"]["content"].strip()
+    company_id = template_questions[0].order.company_id if template_questions else None
+    question = chat_completion(
+        "next_question",
+        [{"role": "user", "content": prompt}],
+        temperature=0.3,
+        company_id=company_id,
+    ).strip()
 
     return question
@@ -1,16 +1,53 @@
 import base64
+import hmac
 import json
+from collections import Counter
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils import timezone
 from django.utils.timezone import datetime
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 
-from backend.models import Company
-from backend.tasks import process_next_step_for_order
-from backend.agent import SQLGeneratorAgent
+from backend.aggregates import (
+    REPORTS,
+    aggregates_version,
+    get_report,
+    paginate,
+    parse_report_params,
+    report_etag,
+)
+from backend.ingestion import ingest_orders, iter_lines
+from backend.models import InboundMessage
+from backend.nl_jobs import (
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    JobLimitExceeded,
+    create_job,
+    get_job,
+    get_job_result,
+    result_payload,
+    run_nl_query,
+)
+from backend.registry import get_company_by_instance_id
+from backend.search import parse_search_params, search_answers
+from backend.tasks import process_next_step_for_order, run_nl_query_job
+from backend.transport import (
+    arrow_response,
+    dataframe_response,
+    get_visualization,
+    negotiate_format,
+    store_visualization,
+)
 
 
 @csrf_exempt
@@ -30,11 +67,11 @@ def whatsapp_webhook(request, security_token):
     if not all([security_token, instance_id, event_name, event_data]):
         return JsonResponse({'error': 'Invalid request'}, status=400)
     
-    company = Company.objects.filter(instance_id=instance_id).first()
+    company = get_company_by_instance_id(instance_id)
     if not company:
         return JsonResponse({'error': 'Invalid instance ID'}, status=400)
 
-    if company.webhook_token != security_token:
+    if not hmac.compare_digest(company.webhook_token.encode(), security_token.encode()):
         return JsonResponse({'error': 'Authentication failed'}, status=401)
     
     if event_name == 'message':
@@ -44,74 +81,384 @@ def whatsapp_webhook(request, security_token):
         message_sender_id = message_data.get('from', '')
         message_sender_phone_number = message_sender_id.replace('@c.us', '')
         
+        message_created_at = timezone.make_aware(
+            datetime.fromtimestamp(int(message_data.get('timestamp', 0)))
+        )
+
         if message_type == 'chat':
-            message_created_at = datetime.fromtimestamp(int(message_data.get('timestamp', 0)))
             message_content = message_data.get('body', '')
 
             print(f"Received message from {message_sender_phone_number} at {message_created_at}: {message_content}")
-            process_next_step_for_order.delay(
-                message_sender_phone_number, 
-                instance_id, 
-                message_content,
-                message_type=message_type
+            inbound_message = InboundMessage.objects.create(
+                company=company,
+                sender_phone_number=message_sender_phone_number,
+                message_type=message_type,
+                content=message_content,
+                received_at=message_created_at,
             )
+            process_next_step_for_order.delay(inbound_message.id)
         
         elif message_type == "ptt":
             media = event_data.get('media', {})
             media_type = media.get('mimetype', '')
             media_data = media.get('data', '')
-            
-            # Pass all necessary information to the task
-            process_next_step_for_order.delay(
-                message_sender_phone_number,
-                instance_id,
-                '',  # No text content for audio
+
+            inbound_message = InboundMessage(
+                company=company,
+                sender_phone_number=message_sender_phone_number,
                 message_type=message_type,
-                media_type=media_type,
-                media_data=media_data
+                received_at=message_created_at,
             )
+            if media_data:
+                # Store the voice note once here so the task only carries the id
+                extension = "ogg" if "ogg" in media_type else "mp3"
+                inbound_message.media.save(
+                    f"inbound.{extension}", ContentFile(base64.b64decode(media_data)), save=False
+                )
+            inbound_message.save()
+            process_next_step_for_order.delay(inbound_message.id)
             
         return JsonResponse({'status': 'success'})
     else:
         return JsonResponse({'error': 'Event not supported'}, status=404)
 
 
+def get_user_company(user, company_id=None):
+    """
+    Return the company the user queries on behalf of, or None if they don't belong to it
+    """
+
+    companies = user.companies.all()
+    if company_id:
+        return companies.filter(id=company_id).first()
+    return companies.order_by("id").first()
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 @csrf_exempt
 def natural_language_query(request):
     """
     API endpoint that accepts a natural language query and returns:
-    - Data from a DataFrame as a dictionary
-    - A visualization of the data as a base64 encoded image
+    - Data from a DataFrame, as JSON records by default, or as an Arrow IPC
+      stream / split-oriented JSON depending on the Accept header
+    - A URL the visualization PNG can be fetched from
+
+    Results are scoped to the user's company and paged; pass the returned
+    `next_page_token` as `page_token` to fetch the next page without
+    re-running the LLM.
+
+    This holds a web worker for the whole pipeline; clients should prefer
+    the job API (nl_query_job_create).
     """
+
+    # Loads the analytics stack; only processes serving NL queries pay for it
+    from backend.sql_execution import UnsafeQueryError
     
     try:
         body = json.loads(request.body)
         query = body.get('query')
+        page_token = body.get('page_token')
         
-        if not query:
+        if not query and not page_token:
             return JsonResponse({'error': 'No query provided'}, status=400)
+
+        company = get_user_company(request.user, body.get('company_id'))
+        if not company:
+            return JsonResponse({'error': 'User is not a member of this company'}, status=403)
         
-        sql_agent = SQLGeneratorAgent()
-        df, image_base64 = sql_agent.run_pipeline(query) 
-        
-        # Convert DataFrame to dictionary
-        data_dict = df.to_dict(orient='records')
+        try:
+            df, sql_query, pagination, image_png = run_nl_query(company.id, query, page_token)
+        except signing.BadSignature:
+            return JsonResponse({'error': 'Invalid page token'}, status=400)
+
+        visualization_url = None
+        if image_png:
+            visualization_id = store_visualization(image_png, company.id)
+            visualization_url = request.build_absolute_uri(
+                reverse('nl_query_visualization', args=[visualization_id])
+            )
         
-        return JsonResponse({
-            'status': 'success',
-            'data': data_dict,
-            'sql_query': sql_agent.sql_query,
-            'visualization': image_base64,
-            'metadata': {
-                'columns': list(df.columns),
-                'shape': df.shape,
-                'query': query
-            }
-        })
+        return dataframe_response(
+            df,
+            result_payload(df, query, sql_query, pagination, visualization_url),
+            negotiate_format(request),
+        )
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except UnsafeQueryError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@csrf_exempt
+def nl_query_job_create(request):
+    """
+    Submit a natural language query (or a `page_token`) as a job
+
+    Returns 202 with the job id right away; the pipeline runs on the
+    nl_query Celery queue. Poll `status_url` until the status is
+    "succeeded" or "failed", then fetch `result_url`.
+    """
+
+    try:
+        body = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    query = body.get('query')
+    page_token = body.get('page_token')
+    if not query and not page_token:
+        return JsonResponse({'error': 'No query provided'}, status=400)
+
+    company = get_user_company(request.user, body.get('company_id'))
+    if not company:
+        return JsonResponse({'error': 'User is not a member of this company'}, status=403)
+
+    try:
+        job = create_job(request.user.id, company.id, query=query, page_token=page_token)
+    except JobLimitExceeded as e:
+        return JsonResponse({'error': str(e)}, status=429)
+
+    run_nl_query_job.delay(job['id'])
+    return JsonResponse(_job_status(request, job), status=202)
+
+
+def _job_status(request, job):
+    status = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'status_url': request.build_absolute_uri(reverse('nl_query_job', args=[job['id']])),
+        'result_url': None,
+    }
+    if job['status'] == SUCCEEDED:
+        status['result_url'] = request.build_absolute_uri(
+            reverse('nl_query_job_result', args=[job['id']])
+        )
+    return status
+
+
+def _get_user_job(request, job_id):
+    job = get_job(job_id)
+    if not job or job['user_id'] != request.user.id:
+        return None
+    return job
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def nl_query_job(request, job_id):
+    """
+    Status of an NL query job
+    """
+
+    job = _get_user_job(request, job_id)
+    if not job:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    response = JsonResponse(_job_status(request, job))
+    if job['status'] in (QUEUED, RUNNING):
+        response['Retry-After'] = str(settings.NL_QUERY_JOB_POLL_INTERVAL)
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def nl_query_job_result(request, job_id):
+    """
+    Result of a succeeded NL query job, in the format negotiated like
+    natural_language_query
+    """
+
+    job = _get_user_job(request, job_id)
+    result = get_job_result(job_id) if job else None
+    if not result:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+
+    payload = result['payload']
+    if result['visualization_id']:
+        payload['visualization_url'] = request.build_absolute_uri(
+            reverse('nl_query_visualization', args=[result['visualization_id']])
+        )
+    return arrow_response(result['arrow'], payload, negotiate_format(request))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def nl_query_visualization(request, visualization_id):
+    """
+    Serve a visualization rendered by natural_language_query as a PNG
+    """
+
+    visualization = get_visualization(visualization_id)
+    if not visualization or not request.user.companies.filter(id=visualization['company_id']).exists():
+        return JsonResponse({'error': 'Visualization not found'}, status=404)
+
+    response = HttpResponse(visualization['png'], content_type='image/png')
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def _request_body(request):
+    """
+    File-like request body for streaming reads. A chunked upload has no
+    Content-Length, so Django's own stream is empty; the server's WSGI input
+    still yields the de-chunked body.
+    """
+
+    django_request = request._request
+    chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    if chunked and 'wsgi.input' in django_request.META:
+        return django_request.META['wsgi.input']
+    return django_request
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@csrf_exempt
+def order_ingest(request):
+    """
+    Bulk order upload for POS systems
+
+    The body is JSON Lines, one order per line, optionally gzip-compressed
+    (`Content-Encoding: gzip`). Orders are upserted on their number in
+    batches while the body is read, and the response streams one JSON
+    result per input line followed by a summary line.
+    """
+
+    company = get_user_company(request.user, request.query_params.get('company_id'))
+    if not company:
+        return JsonResponse({'error': 'You do not have access to this company'}, status=403)
+
+    compressed = (
+        request.headers.get('Content-Encoding') == 'gzip'
+        or request.content_type in ('application/gzip', 'application/x-gzip')
+    )
+    lines = iter_lines(_request_body(request), compressed=compressed)
+
+    def results():
+        summary = Counter()
+        try:
+            for result in ingest_orders(company, lines):
+                summary[result['status']] += 1
+                yield json.dumps(result, default=str) + '\n'
+        except (OSError, EOFError) as e:
+            # Corrupt or truncated gzip body; earlier batches are kept
+            summary['error'] += 1
+            yield json.dumps({'status': 'error', 'errors': {'__all__': f'Could not read the body: {e}'}}) + '\n'
+        yield json.dumps({'summary': summary}) + '\n'
+
+    return StreamingHttpResponse(results(), content_type='application/x-ndjson')
+
+
+def _report_request(request, report):
+    """
+    Return (company, params, version, error) of a dashboard request; error
+    is a (message, status) pair when the request is invalid
+    """
+
+    # The ETag, Last-Modified and view share one lookup
+    if not hasattr(request, '_report_request'):
+        company = get_user_company(request.user, request.GET.get('company_id'))
+        params = version = error = None
+        if report not in REPORTS:
+            error = ('Unknown report', 404)
+        elif not company:
+            error = ('You do not have access to this company', 403)
+        else:
+            try:
+                params = parse_report_params(request.GET)
+                version = aggregates_version(company.id)
+            except ValueError as e:
+                error = (str(e), 400)
+        request._report_request = (company, params, version, error)
+    return request._report_request
+
+
+def _report_etag(request, report):
+    company, params, version, error = _report_request(request, report)
+    if error or not version:
+        return None
+    return report_etag(company.id, report, params, request.GET.get('cursor'), version)
+
+
+def _report_last_modified(request, report):
+    company, params, version, error = _report_request(request, report)
+    return None if error else version
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@condition(etag_func=_report_etag, last_modified_func=_report_last_modified)
+def analytics_report(request, report):
+    """
+    Dashboard reports served from the precomputed daily aggregates
+
+    Reports: sentiment, response-rates (time series by `granularity`),
+    branches, products and keywords. Query parameters: company_id, start,
+    end (YYYY-MM-DD), granularity (day/week/month), branch, cursor.
+    Unchanged reports are answered with 304 Not Modified.
+    """
+
+    company, params, version, error = _report_request(request, report)
+    if error:
+        message, status = error
+        return JsonResponse({'error': message}, status=status)
+
+    items = get_report(company.id, report, params, version)
+    try:
+        page, next_cursor = paginate(
+            items, report, request.GET.get('cursor'), settings.ANALYTICS_PAGE_SIZE
+        )
+    except signing.BadSignature:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    response = JsonResponse({
+        'report': report,
+        'start': params['start'].isoformat(),
+        'end': params['end'].isoformat(),
+        'granularity': params['granularity'],
+        'branch': params['branch'],
+        'results': page,
+        'next_cursor': next_cursor,
+    })
+    patch_cache_control(response, private=True, max_age=settings.ANALYTICS_HTTP_MAX_AGE)
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def answer_search(request):
+    """
+    Full-text search over customer answers, typed or transcribed
+
+    Query parameters: q (words, "quoted phrases", or, -excluded), company_id,
+    branch, start and end (YYYY-MM-DD order dates), cursor. Results are
+    ranked by relevance and carry an HTML snippet with matches in <mark>.
+    """
+
+    company = get_user_company(request.user, request.GET.get('company_id'))
+    if not company:
+        return JsonResponse({'error': 'You do not have access to this company'}, status=403)
+
+    try:
+        params = parse_search_params(request.GET)
+        results, next_cursor = search_answers(company.id, params, cursor=request.GET.get('cursor'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except signing.BadSignature:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'q': params['q'],
+        'results': results,
+        'next_cursor': next_cursor,
+    })
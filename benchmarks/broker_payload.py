@@ -0,0 +1,71 @@
+"""
+Broker memory per queued message, before and after slimming task payloads.
+
+Enqueues messages for `process_next_step_for_order` onto a scratch queue
+that no worker consumes, with the old signature (phone, instance id, text
+and the base64 voice note) and the current one (an InboundMessage id), in
+JSON and msgpack, and reports Redis MEMORY USAGE per message.
+
+    python benchmarks/broker_payload.py --messages 1000 --voice-note-kb 40
+"""
+
+import argparse
+import base64
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "servewell.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import redis  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from servewell.celery import app  # noqa: E402
+
+SCRATCH_QUEUE = "benchmark_payload"
+TASK_NAME = "backend.tasks.process_next_step_for_order"
+
+
+def legacy_args(voice_note_kb):
+    media_data = base64.b64encode(os.urandom(voice_note_kb * 1024)).decode()
+    return ["923354949456", "hippo_instance_101", ""], {
+        "message_type": "ptt",
+        "media_type": "audio/ogg; codecs=opus",
+        "media_data": media_data,
+    }
+
+
+def measure(client, messages, args, kwargs, serializer):
+    client.delete(SCRATCH_QUEUE)
+    for _ in range(messages):
+        app.send_task(TASK_NAME, args=args, kwargs=kwargs, queue=SCRATCH_QUEUE, serializer=serializer)
+    used = client.memory_usage(SCRATCH_QUEUE, samples=0) or 0
+    client.delete(SCRATCH_QUEUE)
+    return used / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--voice-note-kb", type=int, default=40)
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    legacy = legacy_args(args.voice_note_kb)
+    cases = [
+        ("legacy voice note, json", legacy[0], legacy[1], "json"),
+        ("legacy voice note, msgpack", legacy[0], legacy[1], "msgpack"),
+        ("inbound message id, json", [123456], {}, "json"),
+        ("inbound message id, msgpack", [123456], {}, "msgpack"),
+    ]
+    for label, task_args, task_kwargs, serializer in cases:
+        per_message = measure(client, args.messages, task_args, task_kwargs, serializer)
+        print(f"{label:32} {per_message:10.0f} bytes/message")
+
+
+if __name__ == "__main__":
+    main()
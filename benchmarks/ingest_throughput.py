@@ -0,0 +1,81 @@
+"""
+Bulk order ingestion throughput.
+
+Streams generated JSON Lines orders through ingest_orders() (the code behind
+POST /api/orders/ingest/) and reports rows/sec for a first upload (inserts)
+and the same upload sent again (updates). Exits non-zero when either is
+below --min-rows-per-second:
+
+    python benchmarks/ingest_throughput.py --company-id 1 --rows 20000
+
+Everything runs in one transaction that is rolled back at the end, so the
+company's data is left as it was. Run it with the same settings module and
+database as the web tier (`make benchmark-ingest`).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "servewell.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from backend.ingestion import ingest_orders  # noqa: E402
+from backend.models import Company  # noqa: E402
+
+
+def generate_lines(rows, customers):
+    order_at = timezone.now() - timedelta(days=1)
+    for n in range(rows):
+        row = {
+            "number": f"BENCH-{n}",
+            "order_at": (order_at + timedelta(seconds=n)).isoformat(),
+            "customer_name": f"Customer {n % customers}",
+            "customer_phone_number": f"0300{n % customers:07d}",
+            "branch_name": ("DHA", "Gulberg", "Johar Town")[n % 3],
+            "order_details": [{"item": "Zinger", "quantity": 2, "price": 650}],
+        }
+        yield n + 1, json.dumps(row)
+
+
+def measure(company, rows, customers):
+    started_at = time.perf_counter()
+    statuses = {}
+    for result in ingest_orders(company, generate_lines(rows, customers)):
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return rows / (time.perf_counter() - started_at), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--company-id", type=int, required=True)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--customers", type=int, default=5000, help="Distinct phone numbers among the rows")
+    parser.add_argument("--min-rows-per-second", type=float, default=1000)
+    args = parser.parse_args()
+
+    company = Company.objects.get(id=args.company_id)
+    failed = False
+    with transaction.atomic():
+        for phase in ("insert", "update"):
+            rate, statuses = measure(company, args.rows, args.customers)
+            print(f"{phase}: {rate:.0f} rows/s {statuses}")
+            failed = failed or rate < args.min_rows_per_second
+        transaction.set_rollback(True)
+
+    if failed:
+        sys.exit(f"Ingestion is slower than {args.min_rows_per_second:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Reply-path latency while a bulk backlog drains.
+
+Measures how long a task on the conversation queue waits before it runs,
+first on an idle system and then while a backlog of busy tasks drains on
+the analysis queue. With the routed topology the two numbers should be
+about the same; with a single shared queue the second one grows with the
+backlog.
+
+    python benchmarks/queue_latency.py --backlog 2000 --busy-seconds 0.2
+
+Run it against running workers (`make up`), with the same settings module.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "servewell.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from servewell.celery import app  # noqa: E402
+
+
+def probe_latencies(samples, interval):
+    latencies = []
+    for _ in range(samples):
+        sent_at = time.time()
+        ran_at = app.send_task("backend.tasks.ping").get(timeout=300)
+        latencies.append((ran_at - sent_at) * 1000)
+        time.sleep(interval)
+    return latencies
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    return f"p50 {statistics.median(latencies):.1f} ms, p99 {p99:.1f} ms, max {latencies[-1]:.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backlog", type=int, default=1000, help="Bulk tasks to enqueue")
+    parser.add_argument("--busy-seconds", type=float, default=0.2, help="Duration of each bulk task")
+    parser.add_argument("--samples", type=int, default=50, help="Probes per phase")
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between probes")
+    args = parser.parse_args()
+
+    idle = probe_latencies(args.samples, args.interval)
+    print(f"idle:             {summary(idle)}")
+
+    for _ in range(args.backlog):
+        app.send_task("backend.tasks.busy_wait", args=[args.busy_seconds])
+
+    draining = probe_latencies(args.samples, args.interval)
+    print(f"backlog of {args.backlog}: {summary(draining)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Visualization sandbox latency, cold versus pooled.
+
+Runs the same small plotting job in a sandbox created for each run (the old
+behaviour) and in sandboxes leased from a warm SandboxPool, and reports
+p50/p95 per phase. Use the local backend to measure without E2B:
+
+    python benchmarks/sandbox_latency.py --backend local --runs 20
+
+Run it with the same settings module and installed packages as the NL query
+worker.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "servewell.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from backend.sandbox import SANDBOX_BACKENDS, SandboxPool  # noqa: E402
+
+DATA = b"branch,reviews\nGulberg,120\nDHA,95\nJohar Town,60\n"
+
+CODE = """
+import pandas as pd
+import matplotlib.pyplot as plt
+df = pd.read_csv("data.csv")
+df.plot.bar(x="branch", y="reviews")
+plt.show()
+"""
+
+
+def run(sandbox):
+    sandbox.write_file("data.csv", DATA)
+    code_run = sandbox.run_code(CODE)
+    if code_run.error or not code_run.pngs:
+        raise RuntimeError(f"Sandbox run failed: {code_run.error}")
+
+
+def cold(factory, runs):
+    latencies = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        sandbox = factory()
+        try:
+            run(sandbox)
+        finally:
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            sandbox.close()
+    return latencies
+
+
+def pooled(pool, runs, interval):
+    latencies = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        with pool.sandbox() as sandbox:
+            run(sandbox)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        # Gives the pool time to reset the sandbox, as between real queries
+        time.sleep(interval)
+    return latencies
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+    return f"p50 {statistics.median(latencies):.0f} ms, p95 {p95:.0f} ms, max {latencies[-1]:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=sorted(SANDBOX_BACKENDS), default="local")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per phase")
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between pooled runs")
+    args = parser.parse_args()
+
+    factory = SANDBOX_BACKENDS[args.backend]
+    print(f"cold:   {summary(cold(factory, args.runs))}")
+
+    pool = SandboxPool(factory, size=args.pool_size, idle_timeout=600, max_uses=1000, health_check_interval=60)
+    pool.warm()
+    deadline = time.monotonic() + 120
+    while pool.idle_count < args.pool_size:
+        if time.monotonic() > deadline:
+            raise RuntimeError("The pool did not warm up within 120s")
+        time.sleep(0.1)
+    try:
+        print(f"pooled: {summary(pooled(pool, args.runs, args.interval))}")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Import time and memory of a freshly started web or worker process.
+
+Each process type is started in a clean interpreter that does what the real
+process does at boot (Django setup and URL loading for web, Celery app and
+task module loading for worker). The benchmark reports import time, peak RSS
+and whether any module of the analytics stack was loaded. It exits non-zero
+when a heavy module is loaded at startup or a number exceeds its budget in
+benchmarks/startup_budget.json.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 5 --process web
+
+Run it with the same settings module and installed packages as the
+processes being measured.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(REPO_ROOT, "benchmarks", "startup_budget.json")
+
+# Only needed to serve NL queries, transcribe locally or render results
+HEAVY_MODULES = (
+    "pandas",
+    "numpy",
+    "PIL",
+    "sqlalchemy",
+    "pyarrow",
+    "e2b_code_interpreter",
+    "faster_whisper",
+)
+
+BOOT = {
+    "web": """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+""",
+    "worker": """
+from servewell.celery import app
+app.loader.import_default_modules()
+""",
+}
+
+PROBE = """
+import json, os, resource, sys, time
+sys.path.insert(0, {repo_root!r})
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "servewell.settings")
+started_at = time.perf_counter()
+{boot}
+import_ms = (time.perf_counter() - started_at) * 1000
+print(json.dumps({{
+    "import_ms": import_ms,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def measure(process_type):
+    code = PROBE.format(repo_root=REPO_ROOT, boot=BOOT[process_type], heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True, cwd=REPO_ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--process", choices=sorted(BOOT), action="append", help="Process type (default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per type; the median is reported")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET, help="JSON file of per-type limits")
+    args = parser.parse_args()
+
+    with open(args.budget) as budget_file:
+        budgets = json.load(budget_file)
+
+    failures = []
+    for process_type in args.process or sorted(BOOT):
+        samples = [measure(process_type) for _ in range(args.runs)]
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        max_rss_mb = statistics.median(s["max_rss_mb"] for s in samples)
+        heavy = sorted({m for s in samples for m in s["heavy_modules"]})
+        print(
+            f"{process_type:<8} import {import_ms:7.1f} ms   rss {max_rss_mb:6.1f} MB   "
+            f"heavy modules: {', '.join(heavy) or 'none'}"
+        )
+
+        budget = budgets.get(process_type, {})
+        if heavy:
+            failures.append(f"{process_type}: loads {', '.join(heavy)} at startup")
+        if "import_ms" in budget and import_ms > budget["import_ms"]:
+            failures.append(f"{process_type}: import {import_ms:.1f} ms > {budget['import_ms']} ms")
+        if "max_rss_mb" in budget and max_rss_mb > budget["max_rss_mb"]:
+            failures.append(f"{process_type}: rss {max_rss_mb:.1f} MB > {budget['max_rss_mb']} MB")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Load test for the WhatsApp webhook endpoint.
+
+Fires chat-message webhooks at a running server and reports requests/sec
+and latency percentiles, so serving configurations can be compared:
+
+    python benchmarks/webhook_load.py --url http://localhost:8000 \\
+        --instance-id hippo_instance_101 --token webhook_hippo_secure \\
+        --requests 5000 --concurrency 50 --label runserver
+
+The sender number doesn't belong to any order, so the queued tasks return
+immediately and only the web tier is measured.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(len(values) * fraction), len(values) - 1)
+    return values[index]
+
+
+def build_payload(instance_id, sequence):
+    return {
+        "instanceId": instance_id,
+        "event": "message",
+        "data": {
+            "message": {
+                "type": "chat",
+                "from": "10000000000@c.us",
+                "timestamp": int(time.time()),
+                "body": f"load test message {sequence}",
+            }
+        },
+    }
+
+
+def run(url, instance_id, token, total_requests, concurrency):
+    endpoint = f"{url.rstrip('/')}/api/webhooks/whatsapp/{token}/"
+    local = threading.local()
+
+    def send(sequence):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started_at = time.perf_counter()
+        try:
+            response = local.session.post(endpoint, json=build_payload(instance_id, sequence), timeout=30)
+        except requests.RequestException:
+            # e.g. a keep-alive connection dropped by a recycled worker
+            return time.perf_counter() - started_at, None
+        return time.perf_counter() - started_at, response.status_code
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(total_requests)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, status in results if status != 200)
+    return {
+        "requests": total_requests,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "rps": total_requests / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--instance-id", required=True)
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--label", default="", help="Name of the configuration under test")
+    args = parser.parse_args()
+
+    # Warm up connections and worker caches
+    run(args.url, args.instance_id, args.token, min(100, args.requests), args.concurrency)
+    stats = run(args.url, args.instance_id, args.token, args.requests, args.concurrency)
+
+    print(
+        f"{args.label or args.url}: {stats['rps']:.1f} req/s, "
+        f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms, "
+        f"{stats['errors']} errors / {stats['requests']} requests"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+#!/bin/bash
+# Starts a hot-standby replica of the `db` service. On the first start the
+# data directory is cloned from the primary with pg_basebackup; -R writes
+# standby.signal and the primary_conninfo so postgres starts as a replica.
+set -e
+
+export PGPASSWORD="$POSTGRES_PASSWORD"
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_basebackup -h "${PRIMARY_HOST:-db}" -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream; do
+        echo "Waiting for the primary..."
+        sleep 2
+    done
+    chmod 0700 "$PGDATA"
+fi
+
+exec postgres -c hot_standby=on -c hot_standby_feedback=on
@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for the production serving profile.
+
+Everything can be overridden from the environment, e.g.
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker DB_CONN_MAX_AGE=0 gunicorn servewell.asgi:application
+    GUNICORN_WORKER_CLASS=gthread GUNICORN_THREADS=8 gunicorn servewell.wsgi:application
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# sync, gthread, gevent or uvicorn.workers.UvicornWorker (ASGI)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then to contain slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+# Load the app before forking so workers share memory
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
@@ -1,11 +1,40 @@
 from __future__ import absolute_import, unicode_literals
 import os
+import sys
 
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'servewell.settings')
 
+
+def patch_psycopg_for_gevent():
+    """
+    Make psycopg2 yield to other greenlets while it waits on Postgres when
+    the worker runs the gevent pool (celery monkey-patches before loading
+    the app), so one query doesn't block the whole process
+    """
+
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey and gevent_monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+
+
+patch_psycopg_for_gevent()
+
 app = Celery('servewell')
 app.conf.enable_utc = False
 app.config_from_object("django.conf:settings", namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def prewarm_sandboxes(**kwargs):
+    from django.conf import settings
+
+    if settings.SANDBOX_PREWARM:
+        from backend.sandbox import get_sandbox_pool
+
+        get_sandbox_pool().warm()
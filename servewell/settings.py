@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     # Third-party apps
     "celery",
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
 # Middleware
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "django.middleware.gzip.GZipMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -75,9 +77,28 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", "mypassword"),
         "HOST": os.getenv("DB_HOST", "db"),
         "PORT": os.getenv("DB_PORT", "5432"),
+        # Keep connections open between requests; set to 0 behind pgbouncer
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        # pgbouncer in transaction mode can't hold server-side cursors
+        "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS", "False") == "True",
     }
 }
 
+# Optional streaming replica for analytics and NL query reads (backend/db_router.py).
+# Reads fall back to the primary while the replica is down or lags more than
+# REPLICA_MAX_LAG_SECONDS; the lag is checked every REPLICA_LAG_CHECK_INTERVAL seconds.
+if os.getenv("DB_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv("DB_REPLICA_HOST"),
+        "PORT": os.getenv("DB_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["backend.db_router.ReplicaRouter"]
+REPLICA_MAX_LAG_SECONDS = int(os.getenv("REPLICA_MAX_LAG_SECONDS", 30))
+REPLICA_LAG_CHECK_INTERVAL = int(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 5))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -110,33 +131,261 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
+# Cache configuration
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://redis:6379/1"),
+    }
+}
+
+# Company lookups by WhatsApp instance id (backend/registry.py)
+COMPANY_CACHE_TIMEOUT = int(os.getenv("COMPANY_CACHE_TIMEOUT", 60 * 60))
+COMPANY_LOCAL_CACHE_TIMEOUT = int(os.getenv("COMPANY_LOCAL_CACHE_TIMEOUT", 30))
+
+# Voice note storage: "filesystem" (MEDIA_ROOT) or "s3" (any S3-compatible service)
+AUDIO_STORAGE_BACKEND = os.getenv("AUDIO_STORAGE_BACKEND", "filesystem")
+AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME", "servewell-audio")
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME", "us-east-1")
+AWS_DEFAULT_ACL = None
+
+# What happens to voice notes once transcribed: "keep", "transcode" or "delete"
+AUDIO_RETENTION_POLICY = os.getenv("AUDIO_RETENTION_POLICY", "keep")
+AUDIO_RETENTION_DAYS = int(os.getenv("AUDIO_RETENTION_DAYS", 30))
+AUDIO_COMPACT_BATCH_SIZE = int(os.getenv("AUDIO_COMPACT_BATCH_SIZE", 500))
+AUDIO_TRANSCODE_BITRATE = os.getenv("AUDIO_TRANSCODE_BITRATE", "16k")
+
+# Processed webhook messages are kept this long for auditing
+INBOUND_MESSAGE_RETENTION_DAYS = int(os.getenv("INBOUND_MESSAGE_RETENTION_DAYS", 30))
+
+# Cold storage for archived audio
+COLD_MEDIA_ROOT = os.getenv("COLD_MEDIA_ROOT", BASE_DIR / "cold_media/")
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Celery configuration
+from kombu import Queue
+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
 
+# Task arguments are compact ids, serialized as msgpack; results are only
+# stored by tasks that opt in with ignore_result=False
+CELERY_TASK_SERIALIZER = "msgpack"
+CELERY_RESULT_SERIALIZER = "msgpack"
+CELERY_ACCEPT_CONTENT = ["msgpack", "json"]
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_RESULT_EXPIRES = 60 * 60
+
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
+# Queue topology: each workload gets its own queue and worker pool (see
+# docker-compose.yml) so a bulk backlog never delays live customer replies.
+#   conversation - replies to inbound messages (latency critical)
+#   speculation  - replies pre-generated while the customer is answering
+#   outbound     - WhatsApp sends for review invitations (I/O bound, gevent)
+#   analysis     - sweeps, sentiment analysis, archiving
+#   media        - transcription and audio compaction (CPU bound)
+CELERY_TASK_DEFAULT_QUEUE = "analysis"
+CELERY_TASK_QUEUES = [
+    Queue("conversation", routing_key="conversation"),
+    Queue("speculation", routing_key="speculation"),
+    Queue("outbound", routing_key="outbound"),
+    Queue("analysis", routing_key="analysis"),
+    Queue("media", routing_key="media"),
+    Queue("nl_query", routing_key="nl_query"),
+]
+CELERY_TASK_ROUTES = {
+    "backend.tasks.process_next_step_for_order": {"queue": "conversation"},
+    "backend.tasks.continue_conversation": {"queue": "conversation"},
+    "backend.tasks.pregenerate_next_questions": {"queue": "speculation"},
+    "backend.tasks.ping": {"queue": "conversation"},
+    "backend.tasks.send_question": {"queue": "outbound"},
+    "backend.tasks.start_review": {"queue": "analysis"},
+    "backend.tasks.send_review_reminders": {"queue": "analysis"},
+    "backend.tasks.analyze_order_sentiment": {"queue": "analysis"},
+    "backend.tasks.analyze_orders_sentiment": {"queue": "analysis"},
+    "backend.tasks.refresh_analytics_aggregates": {"queue": "analysis"},
+    "backend.tasks.archive_old_conversations": {"queue": "analysis"},
+    "backend.tasks.prune_inbound_messages": {"queue": "analysis"},
+    "backend.tasks.busy_wait": {"queue": "analysis"},
+    "backend.tasks.transcribe_answer": {"queue": "media"},
+    "backend.tasks.transcribe_pending_audio": {"queue": "media"},
+    "backend.tasks.run_nl_query_job": {"queue": "nl_query"},
+    "backend.tasks.compact_transcribed_audio": {"queue": "media"},
+}
+
+# Fetch one task at a time per process so long tasks don't hold a queue of others;
+# workers override it where tasks are short (see docker-compose.yml)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
     "review_process_start": {
         "task": "backend.tasks.start_review",
-        "schedule": crontab(minute=30), # Every half hour
+        "schedule": crontab(), # Every minute: sends invitations that became due
+    },
+    "send_review_reminders": {
+        "task": "backend.tasks.send_review_reminders",
+        "schedule": crontab(minute="*/15"), # Every 15 minutes
     },
     "analyze_orders_sentiment": {
         "task": "backend.tasks.analyze_orders_sentiment",
-        "schedule": crontab(hour=1), # Every hour
+        "schedule": crontab(minute=15, hour="*/6"), # Catch-up every 6 hours
+    },
+    "refresh_analytics_aggregates": {
+        "task": "backend.tasks.refresh_analytics_aggregates",
+        "schedule": crontab(minute="*/10"), # Every 10 minutes
+    },
+    "archive_old_conversations": {
+        "task": "backend.tasks.archive_old_conversations",
+        "schedule": crontab(minute=0, hour=3), # Daily at 03:00
+    },
+    "prune_inbound_messages": {
+        "task": "backend.tasks.prune_inbound_messages",
+        "schedule": crontab(minute=45, hour=3), # Daily at 03:45
+    },
+    "compact_transcribed_audio": {
+        "task": "backend.tasks.compact_transcribed_audio",
+        "schedule": crontab(minute=30, hour=3), # Daily at 03:30
+    },
+    "transcribe_pending_audio": {
+        "task": "backend.tasks.transcribe_pending_audio",
+        "schedule": crontab(minute="*/5"), # Every 5 minutes
     },
 }
 
 # LEMON FOX API KEY
 LEMON_FOX_API_KEY = os.getenv("LEMON_FOX_API_KEY", "your_lemon_fox_api_key")
 
+# Transcription backends: "lemonfox" or "local". Companies can override the default.
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "lemonfox")
+TRANSCRIPTION_FALLBACK_BACKEND = os.getenv("TRANSCRIPTION_FALLBACK_BACKEND", "")
+TRANSCRIPTION_CACHE_TIMEOUT = int(os.getenv("TRANSCRIPTION_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+TRANSCRIPTION_BATCH_SIZE = int(os.getenv("TRANSCRIPTION_BATCH_SIZE", 16))
+# transcribe_pending_audio gives up on a voice note after this many failed
+# attempts, or once its question is older than this
+TRANSCRIPTION_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPTION_MAX_ATTEMPTS", 5))
+TRANSCRIPTION_PENDING_MAX_AGE_HOURS = int(os.getenv("TRANSCRIPTION_PENDING_MAX_AGE_HOURS", 48))
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "base")
+LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS", 4))
+# Chunks of a clip decoded per batch, and clips transcribed at once per process
+LOCAL_WHISPER_BATCH_SIZE = int(os.getenv("LOCAL_WHISPER_BATCH_SIZE", 8))
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", 2))
+
+# Dashboard reports (GET /api/analytics/<report>/) are built from daily aggregates
+# refreshed every 10 minutes; built reports are cached for ANALYTICS_CACHE_TIMEOUT seconds
+ANALYTICS_CACHE_TIMEOUT = int(os.getenv("ANALYTICS_CACHE_TIMEOUT", 300))
+ANALYTICS_HTTP_MAX_AGE = int(os.getenv("ANALYTICS_HTTP_MAX_AGE", 60))
+ANALYTICS_PAGE_SIZE = int(os.getenv("ANALYTICS_PAGE_SIZE", 100))
+ANALYTICS_DEFAULT_RANGE_DAYS = int(os.getenv("ANALYTICS_DEFAULT_RANGE_DAYS", 30))
+ANALYTICS_REFRESH_LOOKBACK_DAYS = int(os.getenv("ANALYTICS_REFRESH_LOOKBACK_DAYS", 30))
+ANALYTICS_REFRESH_BATCH_DAYS = int(os.getenv("ANALYTICS_REFRESH_BATCH_DAYS", 31))
+
+# Answer search (GET /api/search/answers/)
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+
+# Bulk order ingestion (POST /api/orders/ingest/): orders per upsert statement and per request
+ORDER_INGEST_BATCH_SIZE = int(os.getenv("ORDER_INGEST_BATCH_SIZE", 1000))
+ORDER_INGEST_MAX_ROWS = int(os.getenv("ORDER_INGEST_MAX_ROWS", 100000))
+
+# Country code for customer phone numbers written without one (backend/customers.py)
+DEFAULT_PHONE_COUNTRY_CODE = os.getenv("DEFAULT_PHONE_COUNTRY_CODE", "92")
+
+# Only orders from the last REVIEW_WINDOW_DAYS are invited to review; conversations
+# older than CONVERSATION_RETENTION_DAYS are archived in batches
+REVIEW_WINDOW_DAYS = int(os.getenv("REVIEW_WINDOW_DAYS", 7))
+# Invitations are due REVIEW_DELAY_HOURS after the order; start_review sends them every minute
+REVIEW_DELAY_HOURS = int(os.getenv("REVIEW_DELAY_HOURS", 6))
+REVIEW_DISPATCH_BATCH_SIZE = int(os.getenv("REVIEW_DISPATCH_BATCH_SIZE", 200))
+# Minutes to put off an invitation while the customer is reviewing another order
+REVIEW_RETRY_MINUTES = int(os.getenv("REVIEW_RETRY_MINUTES", 30))
+# Hours to wait before each reminder of an unanswered question (comma-separated,
+# counted from the previous send); a conversation still unanswered
+# CONVERSATION_EXPIRY_HOURS after the last reminder is abandoned
+REVIEW_REMINDER_HOURS = [
+    int(hours) for hours in os.getenv("REVIEW_REMINDER_HOURS", "24").split(",") if hours.strip()
+]
+CONVERSATION_EXPIRY_HOURS = int(os.getenv("CONVERSATION_EXPIRY_HOURS", 48))
+# A reply that fails to generate is retried by continue_conversation after
+# CONVERSATION_REPLY_RETRY_DELAY seconds (with backoff); send_review_reminders
+# queues it again for answers left without a reply for CONVERSATION_REPLY_SWEEP_MINUTES
+CONVERSATION_REPLY_RETRY_DELAY = int(os.getenv("CONVERSATION_REPLY_RETRY_DELAY", 30))
+CONVERSATION_REPLY_SWEEP_MINUTES = int(os.getenv("CONVERSATION_REPLY_SWEEP_MINUTES", 30))
+CONVERSATION_RETENTION_DAYS = int(os.getenv("CONVERSATION_RETENTION_DAYS", 180))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_MAX_BATCHES_PER_RUN = int(os.getenv("ARCHIVE_MAX_BATCHES_PER_RUN", 100))
+
+# Conversations are analyzed when they complete; the periodic sweep only catches up
+# Analytics is unique per order; this lock only keeps two workers from running
+# the same analysis at once and expires this long after a worker dies
+ANALYSIS_LOCK_TIMEOUT = int(os.getenv("ANALYSIS_LOCK_TIMEOUT", 5 * 60))
+ANALYSIS_CATCH_UP_LOOKBACK_DAYS = int(os.getenv("ANALYSIS_CATCH_UP_LOOKBACK_DAYS", 7))
+
+# How long speculatively pre-generated replies are kept while waiting for an answer
+SPECULATIVE_REPLY_TIMEOUT = int(os.getenv("SPECULATIVE_REPLY_TIMEOUT", 60 * 60 * 24))
+
 # Groq API Key
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "your_groq_api_key")
 
+# LLM gateway (backend/llm.py): model fallback chain per call site and shared limits
+LLM_MODELS = {
+    "default": ["llama3-8b-8192", "llama-3.1-8b-instant"],
+    "analyze_review": ["llama3-8b-8192", "llama-3.1-8b-instant"],
+    "next_question": ["llama3-8b-8192", "llama-3.1-8b-instant"],
+    "sql_generate": ["compound-beta-mini", "llama-3.3-70b-versatile"],
+    "sql_evaluate": ["compound-beta-mini", "llama-3.3-70b-versatile"],
+    "visualization": ["compound-beta-mini", "llama-3.3-70b-versatile"],
+}
+LLM_TIMEOUT = int(os.getenv("LLM_TIMEOUT", 30))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1024))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+LLM_COMPANY_MAX_CONCURRENCY = int(os.getenv("LLM_COMPANY_MAX_CONCURRENCY", 4))
+LLM_COMPANY_TOKENS_PER_MINUTE = int(os.getenv("LLM_COMPANY_TOKENS_PER_MINUTE", 50000))
+LLM_COALESCE_TTL = int(os.getenv("LLM_COALESCE_TTL", 10))
+# Longest a call waits for a free slot or token budget before raising LLMBudgetExceeded
+LLM_MAX_WAIT = int(os.getenv("LLM_MAX_WAIT", 10))
+
+# Natural language SQL execution limits
+NL_QUERY_PAGE_SIZE = int(os.getenv("NL_QUERY_PAGE_SIZE", 1000))
+NL_QUERY_MAX_ROWS = int(os.getenv("NL_QUERY_MAX_ROWS", 10000))
+NL_QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("NL_QUERY_STATEMENT_TIMEOUT_MS", 10000))
+NL_QUERY_PAGE_TOKEN_MAX_AGE = int(os.getenv("NL_QUERY_PAGE_TOKEN_MAX_AGE", 60 * 60))
+NL_QUERY_VISUALIZATION_TTL = int(os.getenv("NL_QUERY_VISUALIZATION_TTL", 60 * 60))
+# NL query jobs (POST /api/generate_sql/jobs/) run on the nl_query queue; job
+# status and results are kept for NL_QUERY_JOB_TTL seconds
+NL_QUERY_JOB_TTL = int(os.getenv("NL_QUERY_JOB_TTL", 60 * 60))
+NL_QUERY_MAX_JOBS_PER_USER = int(os.getenv("NL_QUERY_MAX_JOBS_PER_USER", 2))
+# Upper bound on how long a job can stay queued or running before its slot is freed
+NL_QUERY_JOB_TIME_LIMIT = int(os.getenv("NL_QUERY_JOB_TIME_LIMIT", 10 * 60))
+NL_QUERY_JOB_POLL_INTERVAL = int(os.getenv("NL_QUERY_JOB_POLL_INTERVAL", 1))
+# The visualization prompt describes the fetched result with column summaries
+VISUALIZATION_PROFILE_MAX_COLUMNS = int(os.getenv("VISUALIZATION_PROFILE_MAX_COLUMNS", 30))
+VISUALIZATION_PROFILE_TOP_VALUES = int(os.getenv("VISUALIZATION_PROFILE_TOP_VALUES", 5))
+VISUALIZATION_PROMPT_MAX_CHARS = int(os.getenv("VISUALIZATION_PROMPT_MAX_CHARS", 6000))
+
 # E2B API Key
 E2B_API_KEY = os.getenv("E2B_API_KEY", "your_e2b_api_key")
+
+# Visualization sandboxes: "e2b", or "local" (resource-limited subprocess for
+# development and benchmarking). Each process keeps up to SANDBOX_POOL_SIZE
+# warm and closes them after SANDBOX_IDLE_TIMEOUT seconds without use.
+SANDBOX_BACKEND = os.getenv("SANDBOX_BACKEND", "e2b")
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", 2))
+SANDBOX_IDLE_TIMEOUT = int(os.getenv("SANDBOX_IDLE_TIMEOUT", 10 * 60))
+SANDBOX_MAX_USES = int(os.getenv("SANDBOX_MAX_USES", 50))
+SANDBOX_HEALTH_CHECK_INTERVAL = int(os.getenv("SANDBOX_HEALTH_CHECK_INTERVAL", 60))
+SANDBOX_START_TIMEOUT = int(os.getenv("SANDBOX_START_TIMEOUT", 60))
+SANDBOX_RUN_TIMEOUT = int(os.getenv("SANDBOX_RUN_TIMEOUT", 60))
+# Fill the pool when a worker process starts instead of on the first query
+SANDBOX_PREWARM = os.getenv("SANDBOX_PREWARM", "False") == "True"
+LOCAL_SANDBOX_MEMORY_MB = int(os.getenv("LOCAL_SANDBOX_MEMORY_MB", 1024))
+LOCAL_SANDBOX_CPU_SECONDS = int(os.getenv("LOCAL_SANDBOX_CPU_SECONDS", 300))